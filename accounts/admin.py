@@ -3,12 +3,14 @@ from django.contrib import admin
 from django.contrib.admin import SimpleListFilter
 from django.contrib.admin.views.main import ChangeList
 from django.contrib import messages
+from django.db import transaction
 from django.forms import ModelForm, ModelChoiceField
 from django.urls import reverse
 from django.utils.html import format_html
 from .models import Account, Receivable, CashRecord, Expense, Vendor, TradeSize
 from tbgutils.dt import our_now
 from analytics.cash import cash_sums
+from .batch import CashBatch
 
 
 class ActiveAccountFilter(SimpleListFilter):
@@ -65,19 +67,23 @@ def duplicate_receivable(modeladmin, request, qs):
 
 
 def receivable2cash(modeladmin, request, qs):
-    for rec in qs:
-        description = f"{rec.client} - {rec.invoice}"
-        if rec.received is None:
-            rec.received = our_now().date()
-            rec.save()
-        new_rec = CashRecord(
-            d=rec.received,
-            description=description,
-            account=rec.account,
-            category="DE",
-            amt=rec.amt,
-        )
-        new_rec.save()
+    received = []
+    # The cash records and the received dates are written together or not at all.
+    with transaction.atomic():
+        with CashBatch() as batch:
+            for rec in qs:
+                description = f"{rec.client} - {rec.invoice}"
+                if rec.received is None:
+                    rec.received = our_now().date()
+                    received.append(rec)
+                batch.create(
+                    d=rec.received,
+                    description=description,
+                    account=rec.account,
+                    category="DE",
+                    amt=rec.amt,
+                )
+        Receivable.objects.bulk_update(received, ["received"])
 
 
 class ReceivableNotReceivedFilter(SimpleListFilter):
@@ -123,28 +129,28 @@ class ReceivableAdmin(admin.ModelAdmin):
 
 
 def set_cleared_flag(modeladmin, request, qs):
-    for rec in qs:
-        rec.cleared_f = True
-        rec.save()
+    with CashBatch() as batch:
+        for rec in qs:
+            batch.update(rec, cleared_f=True)
 
 
 def duplicate_record(modeladmin, request, qs):
     d = our_now().date()
-    for rec in qs:
-        new_rec = CashRecord(
-            d=d,
-            description=rec.description,
-            account=rec.account,
-            category=rec.category,
-            amt=rec.amt,
-        )
-        new_rec.save()
+    with CashBatch() as batch:
+        for rec in qs:
+            batch.create(
+                d=d,
+                description=rec.description,
+                account=rec.account,
+                category=rec.category,
+                amt=rec.amt,
+            )
 
 
 def toggle_ignored_flag(modeladmin, request, qs):
-    for rec in qs:
-        rec.ignored = not rec.ignored
-        rec.save()
+    with CashBatch() as batch:
+        for rec in qs:
+            batch.update(rec, ignored=not rec.ignored)
 
 
 class CashRecordChangeList(ChangeList):
@@ -227,27 +233,29 @@ def duplicate_expense(modeladmin, request, qs):
 
 def book_expense(modeladmin, request, qs):
     d = our_now().date()
-    for rec in qs:
-        description = f"{rec.vendor} - {rec.description}"
-        a = rec.account
-        if rec.paid is None:
-            rec.paid = d
-            rec.save()
-
-        if rec.cash_transaction is None:
-            new_rec = CashRecord(
-                d=rec.paid,
-                description=description,
-                account=a,
-                category="GN",
-                amt=-rec.amt,
-            )
-            new_rec.save()
-
-            rec.cash_transaction = new_rec
-            rec.save()
-        else:
-            messages.add_message(request, messages.INFO, f"Already booked: {description}")
+    expenses = list(qs)
+    # The cash records and the expenses are written together or not at all.
+    with transaction.atomic():
+        with CashBatch() as batch:
+            for rec in expenses:
+                description = f"{rec.vendor} - {rec.description}"
+                a = rec.account
+                if rec.paid is None:
+                    rec.paid = d
+
+                if rec.cash_transaction is None:
+                    rec.cash_transaction = batch.create(
+                        d=rec.paid,
+                        description=description,
+                        account=a,
+                        category="GN",
+                        amt=-rec.amt,
+                    )
+                else:
+                    messages.add_message(request, messages.INFO, f"Already booked: {description}")
+
+        # After the batch, the new cash records have their ids.
+        Expense.objects.bulk_update(expenses, ["paid", "cash_transaction"])
 
 
 def expense_form_factory(d, a):
@@ -0,0 +1,63 @@
+"""
+Write many cash records with a few queries.
+
+    with CashBatch() as batch:
+        batch.create(account=a, d=d, description=note, amt=amt)
+        batch.update(rec, cleared_f=True)
+
+Records are collected in the with block and written when it exits, with one
+bulk_create and one bulk_update in a transaction, and get_cash_df is
+cleared once instead of by every CashRecord.save().  Nothing is written if
+the block raises.
+"""
+
+from django.db import transaction
+
+from accounts.models import CashRecord, get_cash_df
+
+
+class CashBatch:
+    def __init__(self):
+        self.created = []
+        self.updated = {}  # id -> record
+        self.fields = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.write()
+
+    def create(self, rec=None, **kwargs):
+        """Add rec, or a new CashRecord(**kwargs).  Returns the record."""
+        if rec is None:
+            rec = CashRecord(**kwargs)
+        self.created.append(rec)
+        return rec
+
+    def update(self, rec, **kwargs):
+        """
+        Set the fields in kwargs of rec and save them.  rec may be one added
+        by create().
+        """
+        for field, value in kwargs.items():
+            setattr(rec, field, value)
+        if rec.pk is not None:
+            self.fields.update(kwargs)
+            self.updated[rec.pk] = rec
+        return rec
+
+    def write(self):
+        if not (self.created or self.updated):
+            return
+
+        with transaction.atomic():
+            CashRecord.objects.bulk_create(self.created)
+            if self.updated:
+                CashRecord.objects.bulk_update(self.updated.values(), sorted(self.fields))
+        get_cash_df.cache_clear()
+
+        self.created = []
+        self.updated = {}
+        self.fields = set()
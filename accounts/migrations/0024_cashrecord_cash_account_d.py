@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0023_receivable_account"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="cashrecord",
+            index=models.Index(
+                condition=models.Q(("ignored", False)),
+                fields=["account", "d"],
+                name="cash_account_d",
+            ),
+        ),
+    ]
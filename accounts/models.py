@@ -158,6 +158,14 @@ class CashRecord(models.Model):
     cleared_f = models.BooleanField(default=False)
     ignored = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # Cash sums of an account up to a date skip ignored records.
+            models.Index(
+                fields=["account", "d"], condition=models.Q(ignored=False), name="cash_account_d"
+            ),
+        ]
+
     def save(self, *args, **kwargs):
         get_cash_df.cache_clear()
         super().save(*args, **kwargs)
@@ -169,8 +177,8 @@ class CashRecord(models.Model):
         )
 
 
-@lru_cache(maxsize=10)
-def get_cash_df(a=None, d=None, pivot=False, active_f=True, cleared=False):
+def cash_sums_qs(a=None, d=None, active_f=True, cleared=False):
+    """Sum of amt per account name of the records not ignored."""
     qs = CashRecord.objects.filter(ignored=False)
 
     if active_f:
@@ -183,7 +191,12 @@ def get_cash_df(a=None, d=None, pivot=False, active_f=True, cleared=False):
     if cleared:
         qs = qs.filter(cleared_f=True)
 
-    qs = qs.values("account__name").order_by("account__name").annotate(total=Sum("amt"))
+    return qs.values("account__name").order_by("account__name").annotate(total=Sum("amt"))
+
+
+@lru_cache(maxsize=10)
+def get_cash_df(a=None, d=None, pivot=False, active_f=True, cleared=False):
+    qs = cash_sums_qs(a=a, d=d, active_f=active_f, cleared=cleared)
 
     columns = ["a", "q"]
     if len(qs):
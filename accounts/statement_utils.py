@@ -58,3 +58,8 @@ def ib_statements(decrypt=False):
         file_names = [gpg_decrypt(fn)[0] for fn in file_names]
 
     return file_names
+
+
+def ib_statements_job():
+    """ib_statements for the jobs runner, the file names for the job page."""
+    return {"lines": ib_statements(decrypt=True)}
@@ -1,4 +1,5 @@
 import os
+from datetime import date
 import shutil
 import tempfile
 from unittest import mock
@@ -6,6 +7,8 @@ from unittest import mock
 import gnupg
 from django.test import TestCase, override_settings, tag
 
+from .batch import CashBatch
+from .models import Account, CashRecord, get_cash_df
 from .statement_utils import gpg_encrypt, gpg_decrypt
 
 
@@ -55,3 +58,25 @@ class GPGTests(TestCase):
         fn_out = self.fn + ".decrypted"
         fn, status = gpg_decrypt(self.fn + ".asc", fn_out=fn_out)
         self.assertTrue(status.ok)
+
+
+class CashBatchTests(TestCase):
+    def test_batch(self):
+        a = Account.objects.create(name="Cash", owner="o", broker="b", broker_account="1")
+        rec = CashRecord.objects.create(account=a, d=date(2022, 1, 3), description="x", amt=10)
+        self.assertEqual(10, get_cash_df(a="Cash").q.sum())
+
+        with self.assertNumQueries(4):
+            with CashBatch() as batch:
+                batch.create(account=a, d=date(2022, 1, 4), description="y", amt=5)
+                batch.create(account=a, d=date(2022, 1, 5), description="z", amt=1)
+                batch.update(rec, amt=20, cleared_f=True)
+        rec.refresh_from_db()
+        self.assertEqual((20, True), (rec.amt, rec.cleared_f))
+        self.assertEqual(26, get_cash_df(a="Cash").q.sum())
+
+        with self.assertRaises(ValueError):
+            with CashBatch() as batch:
+                batch.create(account=a, d=date(2022, 1, 6), description="w", amt=1)
+                raise ValueError()
+        self.assertEqual(3, CashRecord.objects.count())
@@ -1,25 +1,28 @@
 from datetime import date, timedelta
 from django.contrib import messages
-from django.shortcuts import render
-from django.db import transaction, IntegrityError
+from django.shortcuts import render, redirect
+from django.db import IntegrityError
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.views.generic import TemplateView, FormView
+from django.views.generic import TemplateView, FormView, View
 from tbgutils.dt import eom
-from accounts.statement_utils import ib_statements
+from jobs.utils import enqueue
+from .batch import CashBatch
 from .utils import get_receivables
 from .forms import AccountForm, CashTransferForm, DifferenceForm
-from .models import Account, CashRecord
+from .models import Account
 from analytics.cash import cash_sums
 
 
-class GetIBStatementsView(LoginRequiredMixin, TemplateView):
-    template_name = "accounts/ib_statements.html"
+class GetIBStatementsView(LoginRequiredMixin, View):
+    """Download the statements in the jobs runner, the job page lists the files."""
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context["filenames"] = ib_statements(decrypt=True)
-        context["title"] = "IB Statements Retrieved"
-        return context
+    def get(self, request, *args, **kwargs):
+        job = enqueue(
+            "accounts.statement_utils.ib_statements_job",
+            title="IB Statements Retrieved",
+            key="getibstatements",
+        )
+        return redirect(job)
 
 
 class AccountsView(LoginRequiredMixin, FormView):
@@ -71,14 +74,14 @@ class CashTransferView(LoginRequiredMixin, FormView):
             amt = form.cleaned_data["amt"]
             s = f"{d} from_account: {from_accnt}, to_account: {to_accnt}, amt: {amt}"
             try:
-                with transaction.atomic():
-                    CashRecord.objects.create(
+                with CashBatch() as batch:
+                    batch.create(
                         d=d,
                         account=from_accnt,
                         amt=-amt,
                         description=f"Transfer to {to_accnt}",
                     )
-                    CashRecord.objects.create(
+                    batch.create(
                         d=d,
                         account=to_accnt,
                         amt=amt,
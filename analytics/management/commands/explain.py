@@ -0,0 +1,94 @@
+import re
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from tbgutils.dt import day_start_next_day, lbd_prior_month
+
+from accounts.models import cash_sums_qs
+from markets.models import DailyPrice, TBGDailyBar
+from trades.models import Trade, filter_trades
+from trades.positions import latest_snapshots
+
+
+def critical_queries(a, t, d):
+    """(name, QuerySet) of the queries the pages and the trade cache depend on."""
+    month_ends = [d := lbd_prior_month(d) for _ in range(24)]
+    d = month_ends[0]
+    recent = Trade.objects.exclude(trade_id=None).order_by("-dt")
+    trade_ids = list(recent.values_list("trade_id", flat=True)[:50])
+    return [
+        ("trades of account", filter_trades(a=a)),
+        ("trades of ticker", filter_trades(t=t, active_f=False)),
+        ("trades to date", filter_trades(a=a).filter(dt__lt=day_start_next_day(d))),
+        ("modified trades", Trade.objects.filter(modified__gte=day_start_next_day(d))),
+        ("flex trade ids", Trade.objects.filter(trade_id__in=trade_ids)),
+        ("cash sums", cash_sums_qs(d=d)),
+        ("cash sums of account", cash_sums_qs(a=a, d=d, cleared=True)),
+        ("price on date", DailyPrice.objects.filter(ticker__ticker=t, d=d)),
+        ("prices on dates", DailyPrice.objects.filter(d__in=month_ends)),
+        (
+            "price history",
+            DailyPrice.objects.filter(ticker__ticker=t, d__gte=d - timedelta(days=365)),
+        ),
+        ("bars on dates", TBGDailyBar.objects.filter(d__in=month_ends)),
+        ("positions as of", latest_snapshots(d)),
+    ]
+
+
+class Command(BaseCommand):
+    help = "Show the query plans and timings of the queries the pages depend on."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--account", help="Account name, default of the latest trade.")
+        parser.add_argument("--ticker", help="Ticker, default of the latest trade.")
+        parser.add_argument(
+            "--d", type=date.fromisoformat, help="Date, YYYY-MM-DD, default today."
+        )
+        parser.add_argument("--name", help="Only queries whose name contains this.")
+        parser.add_argument(
+            "--no-analyze", action="store_true", help="Plan without running the queries."
+        )
+        parser.add_argument("--summary", action="store_true", help="Only the timings.")
+
+    def handle(self, *args, **options):
+        latest = Trade.objects.select_related("account", "ticker").order_by("-dt").first()
+        a = options["account"] or (latest and latest.account.name)
+        t = options["ticker"] or (latest and latest.ticker.ticker)
+        d = options["d"] or date.today()
+
+        queries = critical_queries(a, t, d)
+        if options["name"]:
+            queries = [(n, qs) for n, qs in queries if options["name"] in n]
+            if not queries:
+                raise CommandError(f"No query name contains {options['name']}.")
+
+        # EXPLAIN ANALYZE is postgres, elsewhere time the queries separately.
+        postgres = connection.vendor == "postgresql"
+        analyze = not options["no_analyze"]
+        print(f"account={a} ticker={t} d={d}")
+
+        timings = []
+        for name, qs in queries:
+            if postgres and analyze:
+                plan = qs.explain(analyze=True, buffers=True)
+                ms = re.search(r"Execution Time: ([\d.]+) ms", plan)
+                ms = float(ms.group(1)) if ms else None
+            else:
+                plan = qs.explain()
+                ms = None
+                if analyze:
+                    start = time.perf_counter()
+                    list(qs)
+                    ms = (time.perf_counter() - start) * 1000
+
+            timings.append((name, ms))
+            if not options["summary"]:
+                print(f"\n== {name} ==")
+                print(plan)
+
+        print()
+        width = max(len(name) for name, _ in timings)
+        for name, ms in timings:
+            print(f"{name:<{width}}  {'' if ms is None else f'{ms:10.3f} ms'}")
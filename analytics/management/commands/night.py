@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from analytics.pnl import pnl
+from analytics.utils import warm_prices
 from trades.ib_flex import get_trades
 
 
@@ -13,10 +14,35 @@ from trades.ib_flex import get_trades
 class Command(BaseCommand):
     help = "Run PPM and store results in database."
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months",
+            type=int,
+            default=24,
+            help="Number of month end prices to make sure are stored.",
+        )
+        parser.add_argument("--no-flex", action="store_true", help="Do not get trades from IB.")
+
     def handle(self, *args, **options):
-        x = get_trades()
-        for i in x[1]:
-            print(i)
+        if not options["no_flex"]:
+            x = get_trades()
+            for i in x[1]:
+                print(i)
+
+        summary = warm_prices(n_months=options["months"])
+        print(
+            f"Prices for {summary['pairs']} held ticker dates on {summary['dates']} dates: "
+            f"{summary['stored']} stored, {summary['fetched']} fetched, "
+            f"{len(summary['misses'])} missing."
+        )
+        print(
+            f"Positions {summary['positions_seconds']:.2f}s, "
+            f"lookup {summary['lookup_seconds']:.2f}s, "
+            f"fetch {summary['fetch_seconds']:.2f}s."
+        )
+        for t, d in summary["misses"]:
+            print(f"Missing price: {t} {d}")
+
         df, *_ = pnl()
         df = df[df.Account == "TOTAL"]
         print(df.to_string())
@@ -1,6 +1,6 @@
 import numpy as np
 import pandas as pd
-from datetime import date
+from datetime import date, timedelta
 from collections import OrderedDict
 import json
 from tbgutils.str import cround, is_near_zero
@@ -10,8 +10,10 @@ from moneycounter.pnl import pnl_calc
 from markets.models import get_ticker, NOT_FUTURES_EXCHANGES, DailyPrice, Ticker
 from analytics.models import PPMResult
 from trades.models import copy_trades_df, bucketed_trades
-from trades.utils import pnl_asof, open_position_pnl
-from markets.utils import ticker_url, get_price
+from trades.positions import position_history, positions_asof
+from trades.utils import pnl_horizons, open_position_pnl
+from markets.utils import ticker_url, get_price, get_prices_bulk
+from markets.price_series import to_datetime64
 from accounts.utils import get_account_url
 
 
@@ -65,8 +67,8 @@ def format_rec(a, t, pos=0, price=1, value=0, daily=0, mtd=0, ytd=0, pnl=0):
 
 def daily_pos(a=None):
     """
-    Build a dataframe of daily opening/closing positions per ticker using
-    trades.models.bucketed_trades().
+    Build a dataframe of daily opening/closing positions per ticker from the
+    position snapshots of trades.positions.
 
     Args:
         a: Optional account name to filter trades. If None, uses all accounts.
@@ -74,33 +76,19 @@ def daily_pos(a=None):
     Returns:
         pandas.DataFrame with columns
         ['d', 'a', 'ticker', 'opening_pos', 'closing_pos']
-        where positions are computed per account. If `a` is provided, only that
-        account is included; otherwise, rows are per-account rather than
-        aggregated across accounts.
+        with a row for each trading day a ticker traded.  Positions are
+        computed per account. If `a` is provided, only that account is
+        included; otherwise, rows are per-account rather than aggregated
+        across accounts.
     """
-    trades_df = bucketed_trades(a=a)
-    if trades_df is None or trades_df.empty:
-        return pd.DataFrame(columns=["d", "a", "ticker", "opening_pos", "closing_pos"])
-
-    # Aggregate net traded quantity per (date, ticker)
-    dq = (
-        trades_df[["d", "a", "t", "q"]]
-        .groupby(["d", "a", "t"], as_index=False)["q"]
-        .sum()
-        .rename(columns={"t": "ticker"})
-    )
-
+    columns = ["d", "a", "ticker", "opening_pos", "closing_pos"]
+    dq = position_history(a=a).rename(columns={"t": "ticker", "q": "closing_pos"})
     if dq.empty:
-        return pd.DataFrame(columns=["d", "a", "ticker", "opening_pos", "closing_pos"])
-
-    # Sort by account, ticker then date to compute cumulative position per (a,t)
-    dq.sort_values(["a", "ticker", "d"], inplace=True)
-    dq["closing_pos"] = dq.groupby(["a", "ticker"])["q"].cumsum()
-    dq["opening_pos"] = dq["closing_pos"] - dq["q"]
+        return pd.DataFrame(columns=columns)
 
-    pos_df = dq[["d", "a", "ticker", "opening_pos", "closing_pos"]].copy()
-    pos_df.reset_index(drop=True, inplace=True)
-    return pos_df, trades_df
+    # The snapshots are sorted by account, ticker then date.
+    dq["opening_pos"] = dq.groupby(["a", "ticker"])["closing_pos"].shift(fill_value=0.0)
+    return dq[columns]
 
 
 def pnl(d=None, a=None, active_f=True):
@@ -111,10 +99,9 @@ def pnl(d=None, a=None, active_f=True):
     eoy = lbd_prior_month(date(d.year, 1, 1))
     lm = lbd_prior_month(d)
 
-    pnl_total, cash = pnl_asof(d=d, a=a, active_f=active_f)
-    pnl_eod, cash_eod = pnl_asof(d=yesterday, a=a, active_f=active_f)
-    pnl_eom, cash_eom = pnl_asof(d=lm, a=a, active_f=active_f)
-    pnl_eoy, cash_eoy = pnl_asof(d=eoy, a=a, active_f=active_f)
+    (pnl_total, cash), (pnl_eod, cash_eod), (pnl_eom, cash_eom), (pnl_eoy, cash_eoy) = (
+        pnl_horizons([d, yesterday, lm, eoy], a=a, active_f=active_f)
+    )
 
     # The Value of Futures positions is already added to the cash and should
     # not be added to the total again.
@@ -250,6 +237,23 @@ def pnl_summary(d=None, a=None, active_f=True):
     return headings, data, formats, total_worth, total_today, total_pnl
 
 
+def missing_ppm_dates(dates):
+    """The dates without a PPMResult."""
+    d_exists = PPMResult.objects.filter(d__in=dates).values_list("d", flat=True)
+    return sorted(set(dates) - set(d_exists))
+
+
+def backfill_ppm(dates):
+    """
+    Save the all accounts PPMResult of each date, dates or ISO date strings
+    when run as a job.
+    """
+    dates = [date.fromisoformat(d) if isinstance(d, str) else d for d in dates]
+    for d in dates:
+        pnl_summary(d, active_f=False)
+    return {"message": f"Saved the value on {len(dates)} days."}
+
+
 def format_if_closed(a, t, q=0, wap=0, cs=1, price=0, value=0, pnl=0):
     t = get_ticker(t)
     pprec = t.market.pprec
@@ -313,7 +317,20 @@ def ticker_pnl(t, active_f=True):
     return total_pnl
 
 
+def performance_dates(n_months=120):
+    """Today, the prior business day and the month ends of the years performance() covers."""
+    d = date.today()
+    dtes = [d, prior_business_day(d)] + [d := lbd_prior_month(d) for i in range(int(n_months))]
+    dtes.reverse()
+    return dtes
+
+
 def performance():
+    """
+    Value and gain by year from the saved PPMResults.  This only reads, the
+    caller enqueues backfill_ppm for the missing_ppm_dates(performance_dates())
+    first, as ValueChartView does.
+    """
     formats = json.dumps(
         {
             "columnDefs": [
@@ -326,21 +343,11 @@ def performance():
 
     headings = ["Year", "Value ($)", "Gain ($)", "YTD ROI (%)"]
 
-    d = date.today()
-    n_months = 120
-
-    dtes = [d, prior_business_day(d)] + [d := lbd_prior_month(d) for i in range(int(n_months))]
-    dtes.reverse()
-    d_exists = PPMResult.objects.filter(d__in=dtes).values_list("d", flat=True)
-    for d in set(dtes) - set(d_exists):
-        pnl_summary(d, active_f=False)
-    values = PPMResult.objects.filter(d__in=dtes).order_by("d").values_list("value", flat=True)
-
-    values = list(values)
-    data = list(zip(dtes, values))
+    dtes = performance_dates()
+    data = list(PPMResult.objects.filter(d__in=dtes).order_by("d").values_list("d", "value"))
 
     # roll-up data by year
-    years = sorted(list(set([d.year for d in dtes])))
+    years = sorted(list(set([d.year for d, _ in data])))
     values = [[i for d, i in data if d.year == y][-1] for y in years]
 
     current_value = values[-1]
@@ -357,45 +364,75 @@ def performance():
     return headings, data, formats
 
 
-def add_close_to_pos(pos_df):
-    # If no positions, return as-is with an empty 'close' column
-    if pos_df is None or len(pos_df) == 0:
-        empty = pd.DataFrame(
-            columns=["d", "ticker", "opening_pos", "closing_pos", "close"]
-        )  # noqa: E501
-        return empty
+POS_COLUMNS = ["d", "a", "ticker", "opening_pos", "closing_pos", "close", "d_prev", "prev_close"]
+TRADES_COLUMNS = ["d", "dt", "a", "t", "q", "p", "c", "r"]
 
-    # Fetch closing prices for each (d, ticker) present in pos_df
-    dates = sorted(set(pos_df["d"].tolist()))
-    tickers = sorted(set(pos_df["ticker"].tolist()))
 
-    if dates and tickers:
-        price_qs = DailyPrice.objects.filter(ticker__ticker__in=tickers, d__in=dates).values_list(
-            "ticker__ticker", "d", "c"
-        )
-        prices = (
-            pd.DataFrame.from_records(
-                list(price_qs), columns=["ticker", "d", "close"]
-            )  # noqa: E501
-            if price_qs
-            else pd.DataFrame(columns=["ticker", "d", "close"])  # noqa: E501
-        )
-    else:
-        prices = pd.DataFrame(columns=["ticker", "d", "close"]).head(0)
+def empty_daily_pnl(dates=(), accounts=()):
+    """daily_pnl() with no positions, zero PnL for each day and account."""
+    pnl_df = pd.MultiIndex.from_product([dates, accounts], names=["d", "a"]).to_frame(index=False)
+    pnl_df["pnl"] = 0.0
+    return pnl_df, pd.DataFrame(columns=POS_COLUMNS), pd.DataFrame(columns=TRADES_COLUMNS)
+
 
-    # Merge prices into positions
-    pos_df = (
-        pos_df.merge(prices, on=["ticker", "d"], how="left")
-        if not prices.empty
-        else pos_df.assign(close=pd.NA)
-    )  # noqa: E501
+def close_matrix(tickers, dates):
+    """
+    DailyPrice closes of tickers on dates, sorted datetime64[D], as a
+    (dates x tickers) array, NaN where there is no close on the day.  One
+    query for all of them.
+    """
+    closes = np.full((len(dates), len(tickers)), np.nan)
+    if not len(dates) or not len(tickers):
+        return closes
+
+    ids = dict(Ticker.objects.filter(ticker__in=tickers).values_list("id", "ticker"))
+    column = {i: tickers.index(t) for i, t in ids.items()}
+    qs = DailyPrice.objects.filter(
+        ticker_id__in=ids, d__gte=dates[0].astype(object), d__lte=dates[-1].astype(object)
+    )
+    rows = np.fromiter(
+        qs.values_list("ticker_id", "d", "c").iterator(chunk_size=10000),
+        dtype=[("t", "i8"), ("d", "datetime64[D]"), ("c", "f8")],
+    )
+    i = np.minimum(np.searchsorted(dates, rows["d"]), len(dates) - 1)
+    found = dates[i] == rows["d"]
+    j = np.array([column[t] for t in rows["t"].tolist()], dtype=np.int64)
+    closes[i[found], j[found]] = rows["c"][found]
+    return closes
+
+
+def missing_prices_map(pairs):
+    # Resolve (ticker, d) pairs in one batch, keeping only usable prices.
+    prices = get_prices_bulk(pairs)
+    return {k: float(p) for k, p in prices.items() if p is not None and float(p) > 0}
+
+
+def fill_missing_prices(tickers, dates, prev_dates, close, prev_close, need_close, need_prev):
+    """
+    Fill the cells of the (dates x tickers) close and prev_close arrays in
+    need_close and need_prev with get_prices_bulk(), one call for both.
+    Prices that cannot be found are left as they are and printed.
+    """
+    need = [(tickers[j], dates[i]) for i, j in zip(*np.nonzero(need_close))]
+    need += [(tickers[j], prev_dates[i]) for i, j in zip(*np.nonzero(need_prev))]
+    if not need:
+        return
+    try:
+        prices = missing_prices_map(need)
+    except OSError as e:
+        # Network errors of the price provider, requests and curl ones included.
+        print(f"Cannot fetch prices: {e}")
+        prices = {}
 
-    # Only keep close where there is a non-zero closing position
-    if not pos_df.empty:
-        mask_zero = pos_df["closing_pos"].fillna(0) == 0
-        pos_df.loc[mask_zero, "close"] = pd.NA
+    for closes, mask, days in ((close, need_close, dates), (prev_close, need_prev, prev_dates)):
+        for i, j in zip(*np.nonzero(mask)):
+            price = prices.get((tickers[j], days[i]))
+            if price is not None:
+                closes[i, j] = price
 
-    return pos_df
+    missing = sorted(set(need) - set(prices))
+    if missing:
+        print(f"No price for {len(missing)} (ticker, date) pairs: {missing}")
 
 
 def daily_pnl(a=None, start=None, end=None):
@@ -408,32 +445,24 @@ def daily_pnl(a=None, start=None, end=None):
     - pos_df: DataFrame with columns
       ['d','a','ticker','opening_pos','closing_pos','close','d_prev','prev_close']
     - trades_df: DataFrame of bucketed trades (as returned by trades.models.bucketed_trades)
-    """
-    # All trades (bucketed to trading day) for the specified account
-    trades_all = bucketed_trades(a=a)
 
+    Positions, prices and PnL are (business days x (a, t) pairs) arrays.  The
+    positions before start are the latest position snapshots before it, only
+    the trades from start on are read.  Their quantities are added into the
+    days they were bucketed to and summed down the days.  The PnL of a day
+    is the change in value, closing_pos * close - opening_pos * prev_close,
+    less the cash paid for the day's trades and commissions.  The closes of
+    all days come from one DailyPrice query and the missing ones from one
+    get_prices_bulk() call.
+    """
     # Establish date range (inclusive) to cover all business days
     if start is None and end is None:
-        if trades_all is not None and len(trades_all):
-            start = trades_all["d"].min()
-            end = trades_all["d"].max()
-        else:
-            # No trades at all and no range specified -> nothing to do
-            empty_pnl = pd.DataFrame(columns=["d", "a", "pnl"])  # empty
-            empty_pos = pd.DataFrame(
-                columns=[
-                    "d",
-                    "a",
-                    "ticker",
-                    "opening_pos",
-                    "closing_pos",
-                    "close",
-                    "d_prev",
-                    "prev_close",
-                ]
-            )  # noqa: E501
-            empty_trades = pd.DataFrame(columns=["d", "dt", "a", "t", "q", "p", "c", "r"])
-            return empty_pnl, empty_pos, empty_trades
+        # All trades (bucketed to trading day) for the specified account
+        trades_all = bucketed_trades(a=a)
+        if trades_all is None or not len(trades_all):
+            return empty_daily_pnl()
+        start = trades_all["d"].min()
+        end = trades_all["d"].max()
     elif start is None:
         start = end
     elif end is None:
@@ -442,354 +471,128 @@ def daily_pnl(a=None, start=None, end=None):
     # Business-day calendar for the full period
     dates_full = pd.bdate_range(start=start, end=end).date.tolist()
     if not dates_full:
-        empty_pnl = pd.DataFrame(columns=["d", "a", "pnl"])  # no business days
-        empty_pos = pd.DataFrame(
-            columns=[
-                "d",
-                "a",
-                "ticker",
-                "opening_pos",
-                "closing_pos",
-                "close",
-                "d_prev",
-                "prev_close",
-            ]
-        )  # noqa: E501
-        empty_trades = pd.DataFrame(columns=["d", "dt", "a", "t", "q", "p", "c", "r"])
-        return empty_pnl, empty_pos, empty_trades
+        return empty_daily_pnl()
+
+    # The trades from start to end and the positions before start.
+    trades_all = bucketed_trades(a=a, start=start)
+    trades_all = trades_all[trades_all["d"] <= end] if len(trades_all) else trades_all
+    before = positions_asof(start - timedelta(days=1), a=a)
 
     # If there are no trades but an account was specified, still emit zero rows
-    if trades_all is None or len(trades_all) == 0:
-        accounts = [a] if a else []
-        if not accounts:
-            empty_pnl = pd.DataFrame(columns=["d", "a", "pnl"])
-            empty_pos = pd.DataFrame(
-                columns=[
-                    "d",
-                    "a",
-                    "ticker",
-                    "opening_pos",
-                    "closing_pos",
-                    "close",
-                    "d_prev",
-                    "prev_close",
-                ]
-            )  # noqa: E501
-            empty_trades = pd.DataFrame(columns=["d", "dt", "a", "t", "q", "p", "c", "r"])
-            return empty_pnl, empty_pos, empty_trades
-        base = pd.MultiIndex.from_product([dates_full, accounts], names=["d", "a"]).to_frame(
-            index=False
-        )  # noqa: E501
-        base["pnl"] = 0.0
-        empty_pos = pd.DataFrame(
-            columns=[
-                "d",
-                "a",
-                "ticker",
-                "opening_pos",
-                "closing_pos",
-                "close",
-                "d_prev",
-                "prev_close",
-            ]
-        )  # noqa: E501
-        empty_trades = pd.DataFrame(columns=["d", "dt", "a", "t", "q", "p", "c", "r"])
-        return base[["d", "a", "pnl"]], empty_pos, empty_trades
-
-    trades_all = trades_all[trades_all["d"] <= end].copy()
+    if not len(trades_all) and before.empty:
+        return empty_daily_pnl(dates_full, [a] if a else [])
 
     # Determine accounts to report
-    accounts = [a] if a else sorted(trades_all["a"].dropna().unique().tolist())
+    if a:
+        accounts = [a]
+    else:
+        accounts = sorted(set(trades_all["a"].dropna().astype(str)) | set(before["a"]))
     if not accounts:
-        empty_pnl = pd.DataFrame(columns=["d", "a", "pnl"])  # empty
-        empty_pos = pd.DataFrame(
-            columns=[
-                "d",
-                "a",
-                "ticker",
-                "opening_pos",
-                "closing_pos",
-                "close",
-                "d_prev",
-                "prev_close",
-            ]
-        )  # noqa: E501
-        empty_trades = pd.DataFrame(columns=["d", "dt", "a", "t", "q", "p", "c", "r"])
-        return empty_pnl, empty_pos, empty_trades
-
-    # Net traded quantity per (d,a,t)
-    dq = (
-        trades_all.groupby(["d", "a", "t"], as_index=False)["q"].sum().sort_values(["a", "t", "d"])
-    )
-
-    # Initial offsets (trades prior to start)
-    pre_start = dq[dq["d"] < start]
-    offsets = (
-        pre_start.groupby(["a", "t"], as_index=False)["q"].sum().rename(columns={"q": "offset"})
+        return empty_daily_pnl()
+
+    dates = to_datetime64(dates_full)
+    prev_full = [prior_business_day(d) for d in dates_full]
+    prev_dates = to_datetime64(prev_full)
+    n = len(dates)
+
+    # Every (a, t) pair with trades up to end is a column, sorted.
+    keys = pd.MultiIndex.from_arrays([trades_all["a"].astype(str), trades_all["t"].astype(str)])
+    held = pd.MultiIndex.from_arrays([before["a"], before["t"]])
+    pairs = keys.union(held).unique().sort_values()
+    pair = pairs.get_indexer(keys)
+    pair_a = pairs.get_level_values(0).to_numpy()
+    pair_t = pairs.get_level_values(1).to_numpy()
+    m = len(pairs)
+
+    # The day of each trade, trades on days outside the calendar are dropped.
+    d = to_datetime64(trades_all["d"].tolist())
+    day = np.minimum(np.searchsorted(dates, d), n - 1)
+    in_range = dates[day] == d
+
+    def day_sums(values, mask):
+        cells = day[mask] * m + pair[mask]
+        return np.bincount(cells, weights=values[mask], minlength=n * m).reshape(n, m)
+
+    q = pd.to_numeric(trades_all["q"], errors="coerce").fillna(0.0).to_numpy(dtype=float)
+    offset = np.zeros(m)
+    offset[pairs.get_indexer(held)] = before["q"].to_numpy(dtype=float)
+    traded = day_sums(q, in_range)
+    closing_pos = offset + np.cumsum(traded, axis=0)
+    opening_pos = closing_pos - traded
+
+    # Closes on each day and the business day before it, by ticker.
+    tickers, ticker = np.unique(pair_t, return_inverse=True)
+    union = np.union1d(dates, prev_dates)
+    closes = close_matrix(tickers.tolist(), union)
+    close_t = closes[np.searchsorted(union, dates)]
+    prev_close_t = closes[np.searchsorted(union, prev_dates)]
+
+    # A ticker is missing a price where any of its pairs needs one.
+    owner = np.zeros((m, len(tickers)))
+    owner[np.arange(m), ticker] = 1.0
+
+    def missing(prices):
+        return np.isnan(prices) | (prices == 0)
+
+    need_close = missing(close_t[:, ticker]) & (closing_pos != 0)
+    need_prev = missing(prev_close_t[:, ticker]) & (opening_pos != 0)
+    filled_close_t, filled_prev_t = close_t.copy(), prev_close_t.copy()
+    fill_missing_prices(
+        tickers.tolist(),
+        dates_full,
+        prev_full,
+        filled_close_t,
+        filled_prev_t,
+        (need_close @ owner) > 0,
+        (need_prev @ owner) > 0,
     )
-
-    # Daily net_q within [start, end] but reindexed to include all business days
-    in_range = dq[dq["d"].between(start, end)]
-
-    def _build_series(g):
-        s = g.set_index("d")["q"]
-        s = s.reindex(dates_full, fill_value=0.0)
-        return s
-
-    # Expand to all days for each (a,t)
-    parts = []
-    for (acc, tkr), g in in_range.groupby(["a", "t"], as_index=False):
-        s = _build_series(g)
-        df_part = s.reset_index().rename(columns={"index": "d", 0: "q"})
-        df_part["a"] = acc
-        df_part["t"] = tkr
-        parts.append(df_part)
-
-    # Also include pairs that only have pre-start offset (no trades in range)
-    only_offsets = []
-    for row in offsets.itertuples(index=False):
-        acc, tkr = row.a, row.t
-        if in_range[(in_range["a"] == acc) & (in_range["t"] == tkr)].empty:
-            df_part = pd.DataFrame({"d": dates_full, "q": 0.0, "a": acc, "t": tkr})
-            only_offsets.append(df_part)
-
-    net_by_day = (
-        pd.concat(parts + only_offsets, ignore_index=True)
-        if (parts or only_offsets)
-        else pd.DataFrame(columns=["d", "q", "a", "t"])
+    close = np.where(need_close, filled_close_t[:, ticker], close_t[:, ticker])
+    close[closing_pos == 0] = np.nan
+    prev_close = np.where(need_prev, filled_prev_t[:, ticker], prev_close_t[:, ticker])
+
+    # Contract size per ticker, pairs of unknown tickers are not valued.
+    tcs = Ticker.objects.filter(ticker__in=tickers.tolist()).values_list("ticker", "market__cs")
+    cs_map = {t: float(cs) for t, cs in tcs}
+    cs = np.array([cs_map.get(t, np.nan) for t in tickers])[ticker]
+
+    value = np.nan_to_num(cs * closing_pos * close)
+    prev_value = np.nan_to_num(cs * opening_pos * prev_close)
+
+    # Cash paid for the trades in range, with their commissions.
+    def column(name):
+        return pd.to_numeric(trades_all[name], errors="coerce").fillna(0.0).to_numpy(dtype=float)
+
+    paid = day_sums(column("cs") * q * column("p") + column("c"), in_range)
+    pnl = value - prev_value - paid
+
+    # Sum the pairs of each account.
+    account = np.searchsorted(accounts, pair_a)
+    by_account = np.zeros((m, len(accounts)))
+    by_account[np.arange(m), account] = 1.0
+    pnl_df = pd.DataFrame(
+        {
+            "d": np.repeat(np.array(dates_full, dtype=object), len(accounts)),
+            "a": np.tile(np.array(accounts, dtype=object), n),
+            "pnl": (pnl @ by_account).ravel(),
+        }
     )
 
-    # Merge offsets and compute opening/closing positions across all days
-    if len(net_by_day):
-        net_by_day = net_by_day.merge(offsets, on=["a", "t"], how="left")
-        net_by_day["offset"] = net_by_day["offset"].fillna(0.0)
-        net_by_day.sort_values(["a", "t", "d"], inplace=True)
-        net_by_day["closing_pos"] = (
-            net_by_day.groupby(["a", "t"])
-            .apply(lambda x: (x["offset"].iloc[0] + x["q"].cumsum()), include_groups=False)
-            .reset_index(level=[0, 1], drop=True)
-        )
-        net_by_day["opening_pos"] = net_by_day["closing_pos"] - net_by_day["q"]
-        pos_df = net_by_day.rename(columns={"t": "ticker"})[
-            ["d", "a", "ticker", "opening_pos", "closing_pos"]
-        ]
-    else:
-        pos_df = pd.DataFrame(columns=["d", "a", "ticker", "opening_pos", "closing_pos"]).head(0)
-
-    # Attach prices and then fill missing using markets.utils.get_price
-    pos_df = add_close_to_pos(pos_df)
-    # General fallback: for any date where we have a non-zero closing position
-    # but missing/zero close, fetch via get_price(ticker, d)
-    try:
-        if len(pos_df):
-            need_close = pos_df["closing_pos"].fillna(0) != 0
-            # Treat NA or 0.0 as missing
-            close_missing = pos_df["close"].isna() | (
-                pd.to_numeric(pos_df["close"], errors="coerce").fillna(0.0) == 0.0
-            )
-            need_close &= close_missing
-            if need_close.any():
-                need_pairs = pos_df.loc[need_close, ["ticker", "d"]].drop_duplicates()
-                tickers_needed = sorted(set(need_pairs["ticker"]))
-                t_map = {t.ticker: t for t in Ticker.objects.filter(ticker__in=tickers_needed)}
-                price_map = {}
-                for rec in need_pairs.itertuples(index=False):
-                    tk = rec.ticker
-                    dd = rec.d
-                    t_obj = t_map.get(tk)
-                    if t_obj is None:
-                        continue
-                    try:
-                        p = get_price(t_obj, d=dd)
-                        if p is not None and float(p) > 0:
-                            price_map[(tk, dd)] = float(p)
-                    except Exception:
-                        # leave missing
-                        pass
-                if price_map:
-                    keys = list(zip(pos_df["ticker"], pos_df["d"]))
-                    mapped = pd.Series(keys).map(price_map)
-                    # Only fill rows in need_close
-                    pos_df.loc[need_close, "close"] = mapped.loc[need_close].combine_first(
-                        pos_df.loc[need_close, "close"]
-                    )
-
-                # Last-chance per-row fill for any remaining rows still missing/zero
-                # (defensive alignment with the Prices table shown in Daily Trades view)
-                remaining = pos_df[need_close]
-                remaining_mask = remaining["close"].isna() | (
-                    pd.to_numeric(remaining["close"], errors="coerce").fillna(0.0) <= 0.0
-                )
-                if remaining_mask.any():
-                    for idx, row in remaining.loc[remaining_mask].iterrows():
-                        t_obj = t_map.get(row["ticker"]) if "t_map" in locals() else None
-                        try:
-                            if t_obj is None:
-                                t_obj = Ticker.objects.filter(ticker=row["ticker"]).first()
-                            if t_obj is not None:
-                                p = get_price(t_obj, d=row["d"])
-                                if p is not None and float(p) > 0:
-                                    pos_df.at[idx, "close"] = float(p)
-                        except Exception:
-                            # keep as missing if any error
-                            pass
-    except Exception:
-        # Continue even if price fetch fails
-        pass
-    if len(pos_df):
-        d_prev_map = {d0: prior_business_day(d0) for d0 in dates_full}
-        prev_dates = sorted(set(d_prev_map.values()))
-        tickers = sorted(set(pos_df["ticker"].tolist()))
-        if tickers and prev_dates:
-            price_prev_qs = DailyPrice.objects.filter(
-                ticker__ticker__in=tickers, d__in=prev_dates
-            ).values_list("ticker__ticker", "d", "c")
-            prev_prices = (
-                pd.DataFrame.from_records(
-                    list(price_prev_qs), columns=["ticker", "d_prev", "prev_close"]
-                )  # noqa: E501
-                if price_prev_qs
-                else pd.DataFrame(columns=["ticker", "d_prev", "prev_close"])
-            )
-        else:
-            prev_prices = pd.DataFrame(columns=["ticker", "d_prev", "prev_close"]).head(0)
-
-        pos_df["d_prev"] = pos_df["d"].map(d_prev_map)
-        if not prev_prices.empty:
-            pos_df = pd.merge(pos_df, prev_prices, on=["ticker", "d_prev"], how="left")
-        else:
-            pos_df["prev_close"] = pd.NA
-
-        # Fallback for prev_close: if opening_pos != 0 and prev_close missing/zero
-        try:
-            need_prev = pos_df["opening_pos"].fillna(0) != 0
-            prev_missing = pos_df["prev_close"].isna() | (
-                pd.to_numeric(pos_df["prev_close"], errors="coerce").fillna(0.0) == 0.0
-            )
-            need_prev &= prev_missing & pos_df["d_prev"].notna()
-            if need_prev.any():
-                need_prev_pairs = pos_df.loc[need_prev, ["ticker", "d_prev"]].drop_duplicates()
-                need_prev_pairs.rename(columns={"d_prev": "d"}, inplace=True)
-                tickers_prev = sorted(set(need_prev_pairs["ticker"]))
-                t_map_prev = {t.ticker: t for t in Ticker.objects.filter(ticker__in=tickers_prev)}
-                prev_price_map = {}
-                for rec in need_prev_pairs.itertuples(index=False):
-                    tk = rec.ticker
-                    dd = rec.d
-                    t_obj = t_map_prev.get(tk)
-                    if t_obj is None:
-                        continue
-                    try:
-                        p = get_price(t_obj, d=dd)
-                        if p is not None and float(p) > 0:
-                            prev_price_map[(tk, dd)] = float(p)
-                    except Exception:
-                        pass
-                if prev_price_map:
-                    keys_prev = list(zip(pos_df["ticker"], pos_df["d_prev"]))
-                    mapped_prev = pd.Series(keys_prev).map(prev_price_map)
-                    pos_df.loc[need_prev, "prev_close"] = mapped_prev.loc[need_prev].combine_first(
-                        pos_df.loc[need_prev, "prev_close"]
-                    )
-
-                # Last-chance per-row fill for any remaining prev_close still missing/zero
-                remaining_prev = pos_df[need_prev]
-                remaining_prev_mask = remaining_prev["prev_close"].isna() | (
-                    pd.to_numeric(remaining_prev["prev_close"], errors="coerce").fillna(0.0) <= 0.0
-                )
-                if remaining_prev_mask.any():
-                    for idx, row in remaining_prev.loc[remaining_prev_mask].iterrows():
-                        t_obj = t_map_prev.get(row["ticker"]) if "t_map_prev" in locals() else None
-                        try:
-                            if t_obj is None:
-                                t_obj = Ticker.objects.filter(ticker=row["ticker"]).first()
-                            if t_obj is not None and pd.notna(row.get("d_prev")):
-                                p = get_price(t_obj, d=row["d_prev"])
-                                if p is not None and float(p) > 0:
-                                    pos_df.at[idx, "prev_close"] = float(p)
-                        except Exception:
-                            pass
-        except Exception:
-            pass
-
-    # Contract size per ticker
-    cs_map = {}
-    try:
-        tickers_all = sorted(set(pos_df["ticker"].tolist()))
-        if tickers_all:
-            tcs = Ticker.objects.filter(ticker__in=tickers_all).values_list("ticker", "market__cs")
-            cs_map = {t: float(cs) for t, cs in tcs}
-    except Exception:
-        cs_map = {}
-
-    # Synthetic opening trades
-    open_syn_cols = ["d", "a", "t", "cs", "q", "p", "c"]
-    if len(pos_df):
-        open_mask = pos_df["opening_pos"].fillna(0) != 0
-        open_df = pos_df.loc[open_mask, ["d", "a", "ticker", "opening_pos", "prev_close"]].copy()
-        open_df.rename(
-            columns={"ticker": "t", "opening_pos": "q", "prev_close": "p"}, inplace=True
-        )
-        open_df["cs"] = open_df["t"].map(cs_map).astype(float)
-        open_df["c"] = 0.0
-        open_df = open_df.dropna(subset=["p", "cs"]) if len(open_df) else (open_df)
-        open_df = open_df[open_syn_cols] if len(open_df) else open_df
-    else:
-        open_df = pd.DataFrame(columns=open_syn_cols).head(0)
-
-    # Synthetic closing trades
-    if len(pos_df):
-        close_mask = pos_df["closing_pos"].fillna(0) != 0
-        close_df = pos_df.loc[close_mask, ["d", "a", "ticker", "closing_pos", "close"]].copy()
-        close_df.rename(columns={"ticker": "t", "closing_pos": "q", "close": "p"}, inplace=True)
-        close_df["q"] = -close_df["q"]
-        close_df["cs"] = close_df["t"].map(cs_map).astype(float)
-        close_df["c"] = 0.0
-        close_df = close_df.dropna(subset=["p", "cs"]) if len(close_df) else close_df
-        close_df = close_df[open_syn_cols] if len(close_df) else close_df
-    else:
-        close_df = pd.DataFrame(columns=open_syn_cols).head(0)
-
-    # Real trades in range only (also build a trades_df with full columns for callers)
-    real_cols = ["d", "a", "t", "cs", "q", "p", "c"]
-    if trades_all is not None and len(trades_all):
-        in_range_mask = trades_all["d"].isin(dates_full)
-        real_df = trades_all.loc[in_range_mask, ["d", "a", "t", "cs", "q", "p", "c"]].copy()
-        # Expose the original bucketed trades with time/flags for the range
-        trade_cols = [
-            col for col in ["d", "dt", "a", "t", "q", "p", "c", "r"] if col in trades_all.columns
-        ]
-        trades_df = trades_all.loc[in_range_mask, trade_cols].copy()
-    else:
-        real_df = pd.DataFrame(columns=real_cols).head(0)
-        trades_df = pd.DataFrame(columns=["d", "dt", "a", "t", "q", "p", "c", "r"]).head(0)
-
-    # Combine all lines
-    lines = [df for df in (open_df, close_df, real_df) if len(df)]
-    all_lines = (
-        pd.concat(lines, ignore_index=True) if lines else pd.DataFrame(columns=real_cols).head(0)
+    # Positions, one row per pair and day sorted by a, t, d.
+    pos_df = pd.DataFrame(
+        {
+            "d": np.tile(np.array(dates_full, dtype=object), m),
+            "a": np.repeat(pair_a, n),
+            "ticker": np.repeat(pair_t, n),
+            "opening_pos": opening_pos.T.ravel(),
+            "closing_pos": closing_pos.T.ravel(),
+            "close": close.T.ravel(),
+            "d_prev": np.tile(np.array(prev_full, dtype=object), m),
+            "prev_close": prev_close.T.ravel(),
+        }
     )
 
-    if len(all_lines):
-        for col in ("cs", "q", "p", "c"):
-            all_lines[col] = (
-                pd.to_numeric(all_lines[col], errors="coerce").fillna(0.0).astype(float)
-            )
-        all_lines["val"] = all_lines["cs"] * all_lines["q"] * all_lines["p"]
-        pnl_by_da = all_lines.groupby(["d", "a"], as_index=False).agg(
-            val_sum=("val", "sum"), comm_sum=("c", "sum")
-        )
-        pnl_by_da["pnl"] = -pnl_by_da["val_sum"] - pnl_by_da["comm_sum"]
-        pnl_df = pnl_by_da[["d", "a", "pnl"]]
-    else:
-        pnl_df = pd.DataFrame(columns=["d", "a", "pnl"]).head(0)
+    # Expose the original bucketed trades with time/flags for the range
+    trade_cols = [col for col in TRADES_COLUMNS if col in trades_all.columns]
+    trades_df = trades_all.loc[in_range, trade_cols].copy()
 
-    # Ensure all business days are present for all accounts, filling  0
-    base = pd.MultiIndex.from_product([dates_full, accounts], names=["d", "a"]).to_frame(
-        index=False
-    )
-    pnl_full = base.merge(pnl_df, on=["d", "a"], how="left").fillna({"pnl": 0.0})
-    pnl_full.sort_values(["d", "a"], inplace=True)
-    pnl_full.reset_index(drop=True, inplace=True)
-    # Return PnL, enriched positions dataframe, and bucketed trades in range
-    return pnl_full[["d", "a", "pnl"]], pos_df, trades_df
+    return pnl_df, pos_df, trades_df
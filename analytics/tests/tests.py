@@ -1,13 +1,26 @@
 import datetime
+import io
+import json
+from contextlib import redirect_stdout
+from unittest import mock
 import pandas as pd
-from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from tbgutils.dt import our_localize
 from trades.tests import make_trades, make_trades_split
 
-from analytics.pnl import pnl, pnl_if_closed
-from markets.utils import get_price
+from accounts.models import Account
+from analytics.pnl import daily_pnl, pnl, pnl_if_closed
+from analytics.utils import warm_prices
+from analytics.views import PlotlyJSView, TickerChartDataView
+from markets.models import DailyPrice, Ticker
+from markets.utils import get_price, get_prices_bulk
+from trades.models import Trade, bucketed_trades, copy_trades_df
+from trades.utils import pnl_asof, pnl_horizons, trades_pnl
 
 
-@override_settings(USE_PRICE_FEED=False, FIFO=True)
+@override_settings(PRICE_PROVIDER="fixed", FIFO=True)
 class PnLTests(TestCase):
     def setUp(self):
         make_trades()
@@ -69,8 +82,95 @@ class PnLTests(TestCase):
         cash_today = list(df[df.Ticker == "CASH"].Today)[0]
         self.assertAlmostEqual(24660.0, cash_today)
 
+    def test_pnl_horizons(self):
+        # An evening trade bucketed on the next business day, after its snapshot.
+        dt = our_localize(datetime.datetime(2021, 10, 22, 18, 0))
+        a = Account.objects.get(name="MSFidelity")
+        t = Ticker.objects.get(ticker="MSFT")
+        Trade.objects.create(dt=dt, account=a, ticker=t, q=5, p=306)
 
-@override_settings(USE_PRICE_FEED=False, FIFO=True)
+        dates = [datetime.date(2021, 10, d) for d in (21, 22, 25, 26, 29)] + [None]
+        for a in (None, "MSFidelity"):
+            for d, (df, cash) in zip(dates, pnl_horizons(dates, a=a)):
+                expected_df, expected_cash = pnl_asof(d=d, a=a)
+                pd.testing.assert_frame_equal(expected_df, df)
+                pd.testing.assert_frame_equal(expected_cash, cash)
+
+    def test_trades_pnl_prices_in_one_batch(self):
+        d = datetime.date(2021, 10, 22)
+        with mock.patch("trades.utils.get_prices_bulk", wraps=get_prices_bulk) as bulk:
+            df = trades_pnl(copy_trades_df(d=d), d=d)
+        bulk.assert_called_once()
+        held = df[df.q != 0]
+        self.assertEqual(len(set(held.t)), len(bulk.call_args.args[0]))
+        for t, price in zip(held.t, held.price):
+            self.assertAlmostEqual(get_price(Ticker.objects.get(ticker=t), d), price)
+        self.assertTrue((df.price[df.q == 0] == 0).all())
+
+    def test_daily_pnl(self):
+        start, end = datetime.date(2021, 10, 20), datetime.date(2021, 11, 5)
+        pnl_df, pos_df, trades_df = daily_pnl(start=start, end=end)
+        days = pd.bdate_range(start, end).date
+        self.assertEqual(len(days) * pnl_df.a.nunique(), len(pnl_df))
+
+        trades = bucketed_trades()
+        for (d, a, t), row in pos_df.set_index(["d", "a", "ticker"]).iterrows():
+            traded = trades[(trades.d <= d) & (trades.a == a) & (trades.t == t)]
+            self.assertAlmostEqual(traded.q.sum(), row.closing_pos)
+
+        # The PnL of a day is the change in value less the cash paid.
+        cs = dict(Ticker.objects.values_list("ticker", "market__cs"))
+        pos_df["cs"] = pos_df.ticker.map(cs)
+        trades_df = trades_df.assign(cs=trades_df.t.map(cs))
+        for (d, a), day_pnl in pnl_df.set_index(["d", "a"]).pnl.items():
+            pos = pos_df[(pos_df.d == d) & (pos_df.a == a)].fillna(0)
+            value = pos.closing_pos * pos.close - pos.opening_pos * pos.prev_close
+            value = (pos.cs * value).sum()
+            paid = trades_df[(trades_df.d == d) & (trades_df.a == a)]
+            paid = (paid.cs * paid.q * paid.p + paid.c).sum()
+            self.assertAlmostEqual(value - paid, day_pnl)
+
+    def test_daily_pnl_values(self):
+        start, end = datetime.date(2021, 10, 20), datetime.date(2021, 11, 5)
+        expected = [0, 0, 10450, 3360, -3440, 4000, 4560, 1200, -2660, -50, 0, 0, 0]
+        pnl_df, pos_df, _ = daily_pnl(start=start, end=end)
+        self.assertEqual(list(pd.bdate_range(start, end).date), list(pnl_df.d))
+        self.assertEqual(expected, list(pnl_df.pnl))
+
+        # Every ticker gets its own close.
+        closes = pos_df.set_index(["d", "ticker"]).close
+        d = datetime.date(2021, 10, 22)
+        for t, close in [("AAPL", 305), ("MSFT", 305), ("MBXIX", 33)]:
+            self.assertEqual(close, closes[(d, t)])
+        self.assertEqual(115, closes[(datetime.date(2021, 10, 25), "AMZN")])
+        self.assertTrue(pd.isna(closes[(d, "AMZN")]))
+
+        # A range that starts with positions open.
+        start = datetime.date(2021, 10, 26)
+        pnl_df, pos_df, _ = daily_pnl(a="MSFidelity", start=start, end=end)
+        self.assertEqual(expected[4:], list(pnl_df.pnl))
+        opening = pos_df[pos_df.d == start].set_index("ticker").opening_pos
+        self.assertEqual({"AMZN": 80, "MBXIX": 1001.4, "MSFT": 10}, dict(opening[opening != 0]))
+
+    def test_daily_pnl_provider_down(self):
+        start, end = datetime.date(2021, 10, 20), datetime.date(2021, 11, 5)
+        out = io.StringIO()
+        with (
+            mock.patch("analytics.pnl.get_prices_bulk", side_effect=OSError("offline")),
+            redirect_stdout(out),
+        ):
+            pnl_df, pos_df, _ = daily_pnl(start=start, end=end)
+        self.assertEqual(list(pd.bdate_range(start, end).date), list(pnl_df.d))
+        self.assertIn("Cannot fetch prices: offline", out.getvalue())
+        self.assertIn("('AMZN', datetime.date(2021, 10, 25))", out.getvalue())
+
+        # Errors that are not the provider's are not hidden.
+        with mock.patch("analytics.pnl.get_prices_bulk", side_effect=KeyError("t")):
+            with self.assertRaises(KeyError):
+                daily_pnl(start=start, end=end)
+
+
+@override_settings(PRICE_PROVIDER="fixed", FIFO=True)
 class PnLSplitTests(TestCase):
     def setUp(self):
         self.aapl_ticker, self.msft_ticker = make_trades_split()
@@ -99,7 +199,7 @@ class PnLSplitTests(TestCase):
         self.check_pnl(self.msft_ticker, df, x)
 
 
-@override_settings(USE_PRICE_FEED=False, FIFO=True)
+@override_settings(PRICE_PROVIDER="fixed", FIFO=True)
 class PnLIfClosedTests(TestCase):
     def setUp(self):
         make_trades()
@@ -127,3 +227,99 @@ class PnLIfClosedTests(TestCase):
         print(expected)
 
         pd.testing.assert_frame_equal(df, expected)
+
+
+@override_settings(PRICE_PROVIDER="yahoo", FIFO=True)
+class WarmPricesTests(TestCase):
+    def setUp(self):
+        make_trades()
+
+    def test_warm_prices(self):
+        eoy = datetime.date(2020, 12, 31)
+        DailyPrice.objects.create(ticker=Ticker.objects.get(ticker="MBXIX"), d=eoy, c=30.0)
+
+        days = pd.bdate_range("2021-10-18", "2021-11-02").date
+        closes = {"AMZN": pd.Series(range(len(days)), index=days, dtype=float) + 100}
+        with mock.patch("markets.providers.yahooCloses", return_value=closes) as yc:
+            summary = warm_prices(d=datetime.date(2021, 11, 3), n_months=1)
+            yc.assert_called_once()
+
+        # MBXIX on eoy, then AMZN, MBXIX and MSFT on Oct 29 and Nov 2.
+        self.assertEqual(3, summary["dates"])
+        self.assertEqual(7, summary["pairs"])
+        self.assertEqual(1, summary["stored"])
+        self.assertEqual(4, summary["fetched"])
+        self.assertEqual(
+            [("MBXIX", datetime.date(2021, 10, 29)), ("MBXIX", datetime.date(2021, 11, 2))],
+            sorted(summary["misses"]),
+        )
+
+        amzn = DailyPrice.objects.filter(ticker__ticker="AMZN").values_list("d", "c")
+        self.assertEqual(
+            {(datetime.date(2021, 10, 29), 109.0), (datetime.date(2021, 11, 2), 111.0)}, set(amzn)
+        )
+
+
+@override_settings(PRICE_PROVIDER="fixed")
+class TickerChartDataTests(TestCase):
+    def setUp(self):
+        make_trades()
+        aapl = Ticker.objects.get(ticker="AAPL")
+        days = pd.bdate_range("2016-01-01", "2021-12-31").date
+        DailyPrice.objects.bulk_create(
+            [DailyPrice(ticker=aapl, d=d, c=100 + i % 50) for i, d in enumerate(days)]
+        )
+        self.n = len(days)
+        self.user = User.objects.create(username="chart")
+
+    def get(self, **params):
+        request = RequestFactory().get("/", params)
+        request.user = self.user
+        return TickerChartDataView.as_view()(request, ticker="AAPL")
+
+    def test_downsampled(self):
+        # Two points per pixel, the closes cover the axis up to today.
+        span = (datetime.date.today() - datetime.date(2016, 1, 1)).days + 1
+        covered = (datetime.date(2021, 12, 31) - datetime.date(2016, 1, 1)).days + 1
+        data = json.loads(self.get(width=400).content)
+        self.assertEqual(self.n, data["n"])
+        # Downsampled plus today's price.
+        self.assertEqual(round(800 * covered / span) + 1, len(data["x"]))
+        self.assertEqual("2016-01-01", data["x"][0])
+        self.assertEqual(f"{datetime.date.today():%Y-%m-%d}", data["x"][-1])
+
+        # Closes on half of a wider axis.
+        data = json.loads(self.get(start="2010-01-01", end="2021-12-31", width=400).content)
+        self.assertEqual(self.n, data["n"])
+        self.assertEqual(400, len(data["x"]))
+
+        # MAX_CHART_POINTS is more than the closes, all of them are drawn.
+        data = json.loads(self.get(width=10**6).content)
+        self.assertEqual(self.n + 1, len(data["x"]))
+
+    def test_zoom(self):
+        data = json.loads(self.get(start="2021-10-01", end="2021-10-31").content)
+        self.assertEqual(21, data["n"])
+        self.assertEqual(21, len(data["x"]))
+        self.assertEqual(["2021-10-01", "2021-10-29"], [data["x"][0], data["x"][-1]])
+
+        response = self.get(start="Oct 1")
+        self.assertEqual(400, response.status_code)
+
+    def test_plotly_js(self):
+        request = RequestFactory().get("/")
+        response = PlotlyJSView.as_view()(request)
+        self.assertEqual("text/javascript", response["Content-Type"])
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn(b"plotly.js", response.content[:1000])
+
+
+class ExplainCommandTests(TestCase):
+    def test_explain(self):
+        make_trades()
+        out = io.StringIO()
+        with redirect_stdout(out):
+            call_command("explain", "--summary")
+        out = out.getvalue()
+        self.assertIn("trades of account", out)
+        self.assertIn("positions as of", out)
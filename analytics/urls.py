@@ -12,6 +12,8 @@ from .views import (
     income_csv_view,
     expenses_csv_view,
     TickerChartView,
+    TickerChartDataView,
+    PlotlyJSView,
     PerformanceView,
     DailyTradesView,
 )
@@ -24,6 +26,8 @@ urlpatterns = [
     path("pnl/", PnLView.as_view(), name="pnl"),
     path("ticker/<ticker>/", TickerView.as_view(), name="ticker_view"),
     path("ticker/<ticker>/chart/", TickerChartView.as_view(), name="ticker_chart"),
+    path("ticker/<ticker>/chart/data/", TickerChartDataView.as_view(), name="ticker_chart_data"),
+    path("plotly.js", PlotlyJSView.as_view(), name="plotly_js"),
     path("value_chart/", ValueChartView.as_view(), name="value_chart"),
     path("realized/", RealizedGainView.as_view(), name="realized"),
     path("realized/csv/<int:param>", realized_csv_view, name="realizedcsv"),
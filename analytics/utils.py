@@ -1,11 +1,14 @@
 from datetime import date
+from time import perf_counter
 import json
 import pandas as pd
-from moneycounter import realized_gains
-from tbgutils.dt import lbd_prior_month
+from tbgutils.dt import lbd_prior_month, prior_business_day, day_start_next_day, our_now
 from tbgutils.str import cround
-from trades.models import get_non_qualified_equity_trades_df, NOT_FUTURES_EXCHANGES
-from trades.utils import pnl_asof
+from markets.models import DailyPrice
+from markets.utils import get_prices_bulk
+from trades.lots import equity_realized_gains
+from trades.models import copy_trades_df, NOT_FUTURES_EXCHANGES
+from trades.utils import pnl_horizons
 from accounts.models import get_expenses_df, get_income_df
 
 
@@ -17,13 +20,11 @@ def format_realized_rec(a, t, realized):
 def total_realized_gains(year):
     eoy = lbd_prior_month(date(year, 1, 1))
 
-    # Equity Gains
-    trades_df = get_non_qualified_equity_trades_df()
-    realized = realized_gains(trades_df, year)
+    # Equity Gains, from the closes of the tax lot ledger.
+    realized = equity_realized_gains(year)
 
-    # Futures Gains
-    pnl, _ = pnl_asof(only_non_qualified=True)
-    pnl_eoy, _ = pnl_asof(d=eoy, only_non_qualified=True)
+    # Futures Gains, marked to market so priced at both ends.
+    (pnl, _), (pnl_eoy, _) = pnl_horizons([None, eoy], only_non_qualified=True)
 
     pnl = pnl[~pnl.e.isin(NOT_FUTURES_EXCHANGES)]
     pnl_eoy = pnl_eoy[~pnl_eoy.e.isin(NOT_FUTURES_EXCHANGES)]
@@ -120,3 +121,74 @@ def expenses(year):
     )
 
     return expenses_df, formats
+
+
+def warm_dates(d=None, n_months=24):
+    """
+    Historical dates the PnL and value chart pages price positions on:
+    the prior business day, the last n_months month ends and year end.
+    """
+    if d is None:
+        d = our_now().date()
+
+    dates = {prior_business_day(d), lbd_prior_month(date(d.year, 1, 1))}
+    m = d
+    for _ in range(n_months):
+        m = lbd_prior_month(m)
+        dates.add(m)
+
+    return sorted(dates)
+
+
+def held_price_pairs(dates):
+    # (ticker, d) for every ticker with a position in some account on d.
+    df = copy_trades_df(active_f=False)
+    pairs = []
+    if df.empty:
+        return pairs
+
+    for d in dates:
+        held = df[df["dt"] < day_start_next_day(d)].groupby(["a", "t"])["q"].sum()
+        held = held[held.abs() > 1e-8]
+        pairs += [(t, d) for t in sorted(set(held.index.get_level_values("t")))]
+
+    return pairs
+
+
+def warm_prices(d=None, n_months=24, batch_size=500):
+    """
+    Make sure DailyPrice has a close for every held ticker on warm_dates()
+    so page loads do not go to the network for historical prices.
+
+    Returns a summary dict with counts, timings in seconds and the
+    (ticker, d) pairs that could not be priced.
+    """
+    t0 = perf_counter()
+    dates = warm_dates(d, n_months)
+    pairs = held_price_pairs(dates)
+    t1 = perf_counter()
+
+    stored = set(
+        DailyPrice.objects.filter(
+            ticker__ticker__in={t for t, _ in pairs}, d__in=dates
+        ).values_list("ticker__ticker", "d")
+    )
+    todo = [pair for pair in pairs if pair not in stored]
+    t2 = perf_counter()
+
+    misses = []
+    for i in range(0, len(todo), batch_size):
+        prices = get_prices_bulk(todo[i : i + batch_size])
+        misses += [pair for pair, p in prices.items() if not p]
+    t3 = perf_counter()
+
+    return {
+        "dates": len(dates),
+        "pairs": len(pairs),
+        "stored": len(pairs) - len(todo),
+        "fetched": len(todo) - len(misses),
+        "misses": misses,
+        "positions_seconds": t1 - t0,
+        "lookup_seconds": t2 - t1,
+        "fetch_seconds": t3 - t2,
+    }
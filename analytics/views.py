@@ -1,21 +1,34 @@
 from datetime import datetime, date, timedelta
 import json
 
-from plotly.offline import plot
+from plotly.offline import get_plotlyjs, get_plotlyjs_version, plot
 import plotly.graph_objs as go
 
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404, redirect
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.views.decorators.gzip import gzip_page
+import numpy as np
 import pandas as pd
-from django.views.generic import TemplateView, FormView
+from django.views.generic import TemplateView, FormView, View
 from django.urls import reverse
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
-from analytics.pnl import pnl, pnl_summary, pnl_if_closed, ticker_pnl, daily_pnl, format_rec
+from analytics.pnl import (
+    pnl,
+    pnl_summary,
+    pnl_if_closed,
+    ticker_pnl,
+    daily_pnl,
+    format_rec,
+    missing_ppm_dates,
+)
 from analytics.risk import daily_returns, sharpe, volatility, total_return, annualized_return
 from analytics.utils import total_realized_gains, income, expenses
 from analytics.models import PPMResult
 from analytics.forms import PnLForm
-from trades.ib_flex import get_trades
+from jobs.utils import enqueue
 from trades.models import copy_trades_df
 from trades.utils import weighted_average_price
 from tbgutils.dt import lbd_prior_month, our_now, prior_business_day
@@ -25,7 +38,7 @@ from markets.models import Ticker
 from worth.utils import df_to_jqtable, nice_headings
 
 from markets.utils import get_price, ticker_admin_url
-from markets.models import DailyPrice
+from markets.price_series import PriceSeries
 from accounts.models import Account
 
 
@@ -168,14 +181,14 @@ class PnLView(LoginRequiredMixin, MyFormView):
         return self.render_to_response(self.get_context_data(form=form))
 
 
-class GetIBTradesView(LoginRequiredMixin, TemplateView):
-    template_name = "analytics/table.html"
+class GetIBTradesView(LoginRequiredMixin, View):
+    """Get the Flex trades in the jobs runner and show them on the job page."""
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context["headings1"], context["data1"], context["formats1"] = get_trades()
-        context["title"] = "IB Futures Trades"
-        return context
+    def get(self, request, *args, **kwargs):
+        job = enqueue(
+            "trades.ib_flex.get_trades_job", title="IB Futures Trades", key="getibtrades"
+        )
+        return redirect(job)
 
 
 class TickerView(LoginRequiredMixin, TemplateView):
@@ -243,13 +256,9 @@ class ValueChartView(LoginRequiredMixin, TemplateView):
     title = "Value Chart"
     template_name = "analytics/value_chart.html"
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-
-        getter = self.request.GET.get
-
+    def x_axis(self):
         d = datetime.today().date()
-        n_months = getter("n_months")
+        n_months = self.request.GET.get("n_months")
 
         if n_months is None:
             n_months = 24
@@ -258,13 +267,32 @@ class ValueChartView(LoginRequiredMixin, TemplateView):
             d := lbd_prior_month(d) for i in range(int(n_months))
         ]
         x_axis.reverse()
+        return x_axis, n_months
+
+    def get(self, request, *args, **kwargs):
+        # The all accounts chart needs a PPMResult per date.  Work out the
+        # missing ones in the jobs runner and come back here when done.
+        if not request.GET.get("a"):
+            missing = missing_ppm_dates(self.x_axis()[0])
+            if missing:
+                job = enqueue(
+                    "analytics.pnl.backfill_ppm",
+                    title="Value Chart",
+                    key="ppm_backfill",
+                    next_url=request.get_full_path(),
+                    dates=[f"{d:%Y-%m-%d}" for d in missing],
+                )
+                return redirect(job)
+        return super().get(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+
+        x_axis, n_months = self.x_axis()
 
-        account = getter("a")
+        account = self.request.GET.get("a")
         # Treat missing or empty 'a' as All Accounts
         if not account:
-            d_exists = PPMResult.objects.filter(d__in=x_axis).values_list("d", flat=True)
-            for d in set(x_axis) - set(d_exists):
-                pnl_summary(d, active_f=False)
             y_axis = (
                 PPMResult.objects.filter(d__in=x_axis)
                 .order_by("d")
@@ -897,54 +925,94 @@ def expenses_csv_view(request, param=None):
 
 
 class TickerChartView(LoginRequiredMixin, TemplateView):
+    """
+    Page for the price chart, the data comes from TickerChartDataView so the
+    page stays small and zooming in fetches more detail for the window.
+    """
+
     template_name = "analytics/ticker_chart.html"
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         ticker_symbol = context["ticker"]
-        ticker = Ticker.objects.get(ticker=ticker_symbol)
-
-        # Get historical prices from database
-        historical_prices = DailyPrice.objects.filter(ticker=ticker).order_by("d")
+        context["data_url"] = reverse("analytics:ticker_chart_data", args=[ticker_symbol])
+        context["plotly_url"] = f"{reverse('analytics:plotly_js')}?v={get_plotlyjs_version()}"
+        context["title"] = f"Price Chart for {ticker_symbol}"
+        return context
 
-        # Get current price if not in database
-        today = date.today()
-        current_price_in_db = historical_prices.filter(d=today).exists()
 
-        dates = [p.d for p in historical_prices]
-        prices = [p.c for p in historical_prices]
+# Closes returned per pixel of chart width, at most MAX_CHART_POINTS.
+POINTS_PER_PIXEL = 2
+CHART_WIDTH = 1000
+MAX_CHART_POINTS = 5000
+
+
+@method_decorator(gzip_page, name="get")
+class PlotlyJSView(View):
+    """
+    plotly.js as bundled with the plotly package, so it is neither kept in
+    the repo nor loaded from a CDN.  The URL carries its version so browsers
+    can cache it for good.
+    """
+
+    def get(self, request):
+        response = HttpResponse(get_plotlyjs(), content_type="text/javascript")
+        patch_cache_control(response, public=True, max_age=365 * 24 * 3600, immutable=True)
+        return response
+
+
+def parse_chart_date(value):
+    # Dates come from the chart axis as "2021-10-22" or "2021-10-22 13:45:10.5".
+    if not value:
+        return None
+    return datetime.strptime(value[:10], "%Y-%m-%d").date()
+
+
+def chart_points(series, start, end, width):
+    """
+    How many of the closes of series to draw on a chart width pixels wide
+    showing start to end.  POINTS_PER_PIXEL of the part of the axis the
+    closes cover, so zooming in gives more detail.
+    """
+    if not len(series):
+        return 0
+    first, last = series.first_date(), series.last_date()
+    span = ((end or max(last, date.today())) - (start or first)).days + 1
+    covered = (last - first).days + 1
+    points = round(POINTS_PER_PIXEL * width * min(covered / span, 1))
+    return min(max(points, 3), MAX_CHART_POINTS)
+
+
+class TickerChartDataView(LoginRequiredMixin, View):
+    """
+    Closes for ?start=&end= (both optional) downsampled for a chart ?width=
+    pixels wide, see chart_points().  Response: {"ticker", "n", "x": [dates],
+    "y": [closes]} where n is the number of closes in the range before
+    downsampling.
+    """
+
+    def get(self, request, ticker):
+        ticker = get_object_or_404(Ticker, ticker=ticker)
+        try:
+            start = parse_chart_date(request.GET.get("start"))
+            end = parse_chart_date(request.GET.get("end"))
+            width = int(request.GET.get("width", CHART_WIDTH))
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        series = PriceSeries.load(ticker, start, end)
+        n = len(series)
+        series = series.downsample(chart_points(series, start, end, width))
+        x = np.datetime_as_string(series.dates).tolist()
+        y = np.round(series.closes, ticker.market.pprec).tolist()
 
         # Add current price if not already in database
-        if not current_price_in_db:
-            current_price = get_price(ticker)
-            dates.append(today)
-            prices.append(current_price)
-
-        # Create the plot
-        fig = go.Figure(
-            data=go.Scatter(
-                x=dates,
-                y=prices,
-                mode="lines+markers",
-                name=f"{ticker_symbol} Price",
-                opacity=0.8,
-                marker_color="blue",
-            )
-        )
-
-        fig.update_layout(
-            {
-                "title_text": f"Price History for {ticker_symbol}",
-                "yaxis_title": "Price ($)",
-                "xaxis_title": "Date",
-            }
-        )
-
-        context["plot_div"] = plot({"data": fig}, output_type="div")
-        context["ticker"] = ticker_symbol
-        context["title"] = f"Price Chart for {ticker_symbol}"
+        today = date.today()
+        if (end is None or end >= today) and series.last_date() != today:
+            x.append(f"{today:%Y-%m-%d}")
+            y.append(get_price(ticker))
 
-        return context
+        return JsonResponse({"ticker": ticker.ticker, "n": n, "x": x, "y": y})
 
 
 class PerformanceView(LoginRequiredMixin, TemplateView):
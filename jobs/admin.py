@@ -0,0 +1,9 @@
+from django.contrib import admin
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "title", "func", "status", "created", "started", "finished")
+    list_filter = ("status",)
+    search_fields = ("title", "func", "key")
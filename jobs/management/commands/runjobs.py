@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from jobs.utils import run_jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued jobs, waiting for new ones unless --once is given."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Run the queued jobs and exit.")
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=2.0,
+            help="Seconds to wait before looking for new jobs again.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            # Drop connections the database closed while we slept.
+            close_old_connections()
+            n = run_jobs()
+            if n:
+                print(f"Ran {n} jobs.")
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
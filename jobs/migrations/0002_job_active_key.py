@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:39
+
+from django.db import migrations, models
+
+
+def fail_duplicates(apps, schema_editor):
+    # Keep the oldest active job of each key, enqueue() could race before.
+    Job = apps.get_model("jobs", "Job")
+    seen = set()
+    duplicates = []
+    active = Job.objects.filter(status__in=["Q", "R"]).exclude(key="").order_by("id")
+    for pk, key in active.values_list("id", "key"):
+        if key in seen:
+            duplicates.append(pk)
+        seen.add(key)
+    Job.objects.filter(pk__in=duplicates).update(status="F", error="Duplicate of an active job.")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("jobs", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="job",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("status__in", ["Q", "R"]), models.Q(("key", ""), _negated=True)
+                ),
+                fields=("key",),
+                name="job_active_key",
+            ),
+        ),
+    ]
@@ -0,0 +1,66 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.urls import reverse
+
+
+class Job(models.Model):
+    """
+    A function to run in the runjobs worker instead of in a web request.
+
+    func is the dotted path of the function and kwargs its keyword
+    arguments.  The function returns something JSON serializable which is
+    kept in result.  See jobs.utils.
+    """
+
+    QUEUED = "Q"
+    RUNNING = "R"
+    DONE = "D"
+    FAILED = "F"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+    ACTIVE = [QUEUED, RUNNING]
+
+    func = models.CharField(max_length=200)
+    kwargs = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    title = models.CharField(max_length=100, blank=True, default="")
+    key = models.CharField(
+        max_length=200,
+        blank=True,
+        default="",
+        db_index=True,
+        help_text="No new job while one with this key is queued or running.",
+    )
+    next_url = models.CharField(
+        max_length=200, blank=True, default="", help_text="Where to go once the job is done."
+    )
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=QUEUED)
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "id"])]
+        constraints = [
+            # At most one queued or running job per key.
+            models.UniqueConstraint(
+                fields=["key"],
+                condition=models.Q(status__in=["Q", "R"]) & ~models.Q(key=""),
+                name="job_active_key",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.id} {self.title or self.func} {self.get_status_display()}"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    def get_absolute_url(self):
+        return reverse("jobs:job", kwargs={"pk": self.pk})
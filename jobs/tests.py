@@ -0,0 +1,88 @@
+import json
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+
+from jobs.models import Job
+from jobs.utils import claim_job, enqueue, reap_jobs, run_job, run_jobs
+from jobs.views import JobStatusView
+
+
+def add(x, y):
+    return {"message": f"{x + y}"}
+
+
+def fail():
+    raise ValueError("no good")
+
+
+class JobTests(TestCase):
+    def test_enqueue_key(self):
+        job = enqueue("jobs.tests.add", key="add", x=1, y=2)
+        self.assertEqual(job, enqueue("jobs.tests.add", key="add", x=1, y=2))
+        self.assertNotEqual(job, enqueue("jobs.tests.add", x=1, y=2))
+
+        run_jobs()
+        self.assertNotEqual(job, enqueue("jobs.tests.add", key="add", x=1, y=2))
+
+    def test_one_active_job_per_key(self):
+        enqueue("jobs.tests.add", key="add", x=1, y=2)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Job.objects.create(func="jobs.tests.add", key="add")
+        # Jobs without a key are not limited.
+        Job.objects.create(func="jobs.tests.add")
+        Job.objects.create(func="jobs.tests.add")
+
+    def test_stale_jobs_fail(self):
+        job = enqueue("jobs.tests.add", key="add", x=1, y=2)
+        self.assertEqual(job, claim_job())
+        self.assertEqual(job, enqueue("jobs.tests.add", key="add", x=1, y=2))
+
+        # Its worker died an hour ago.
+        with self.settings(JOB_TIMEOUT=60):
+            Job.objects.filter(pk=job.pk).update(started=timezone.now() - timedelta(hours=1))
+            self.assertNotEqual(job, enqueue("jobs.tests.add", key="add", x=1, y=2))
+        job.refresh_from_db()
+        self.assertEqual(Job.FAILED, job.status)
+        self.assertIsNotNone(job.finished)
+
+    def test_reaped_job_stays_failed(self):
+        job = enqueue("jobs.tests.add", x=1, y=2)
+        job = claim_job()
+        Job.objects.filter(pk=job.pk).update(started=timezone.now() - timedelta(hours=2))
+        self.assertEqual(1, reap_jobs())
+
+        # The worker was only slow, its result comes too late.
+        job = run_job(job)
+        self.assertEqual(Job.FAILED, job.status)
+        self.assertIsNone(job.result)
+
+    def test_run_jobs(self):
+        ok = enqueue("jobs.tests.add", x=1, y=2)
+        bad = enqueue("jobs.tests.fail")
+        self.assertEqual(2, run_jobs())
+        self.assertEqual(0, run_jobs())
+
+        ok.refresh_from_db()
+        self.assertEqual(Job.DONE, ok.status)
+        self.assertEqual({"message": "3"}, ok.result)
+        self.assertIsNotNone(ok.finished)
+
+        bad.refresh_from_db()
+        self.assertEqual(Job.FAILED, bad.status)
+        self.assertIn("ValueError: no good", bad.error)
+
+    def test_status_view(self):
+        job = enqueue("jobs.tests.add", title="Add", x=1, y=2)
+        request = RequestFactory().get("/")
+        request.user = User.objects.create(username="jobs")
+
+        def status():
+            return json.loads(JobStatusView.as_view()(request, pk=job.pk).content)
+
+        self.assertEqual(("Queued", False), (status()["status"], status()["finished"]))
+        run_jobs()
+        self.assertEqual(("Done", True), (status()["status"], status()["finished"]))
@@ -0,0 +1,10 @@
+from django.urls import path
+from .views import JobView, JobStatusView
+
+
+app_name = "jobs"
+
+urlpatterns = [
+    path("jobs/<int:pk>/", JobView.as_view(), name="job"),
+    path("jobs/<int:pk>/status/", JobStatusView.as_view(), name="status"),
+]
@@ -0,0 +1,143 @@
+"""
+Slow work run outside web requests, without a message broker.
+
+enqueue() saves a Job and returns at once.  The runjobs management command
+claims queued jobs with SELECT ... FOR UPDATE SKIP LOCKED, so several
+workers can share the table, and runs them.  A page that queued a job sends
+the browser to the job's page, which polls job_status() until it is done.
+
+A job running longer than settings.JOB_TIMEOUT is taken for one whose
+worker died and is failed, by reap_jobs() before every claim and enqueue.
+It is not run again, whatever killed the worker would likely kill the next
+one too.  If the worker was only slow, the result it writes later is dropped.
+
+A job function takes keyword arguments that fit in JSON and returns a JSON
+serializable result.  The job page shows these keys of a dict result:
+
+    headings, data, formats   a table like analytics/table.html
+    lines                     a list of strings
+    message                   a line of text
+"""
+
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from jobs.models import Job
+
+
+def enqueue(func, title="", key="", next_url="", **kwargs):
+    """
+    Queue func, the dotted path of a function, to be called with kwargs.
+
+    If key is given and a job with that key is queued or running, that job
+    is returned instead of queueing another.  The job_active_key constraint
+    makes that hold for concurrent calls too.
+    """
+    reap_jobs()
+    if key:
+        job = Job.objects.filter(key=key, status__in=Job.ACTIVE).first()
+        if job is not None:
+            return job
+
+    try:
+        with transaction.atomic():
+            return Job.objects.create(
+                func=func, kwargs=kwargs, title=title, key=key, next_url=next_url
+            )
+    except IntegrityError:
+        # Another request queued it since.
+        if not key:
+            raise
+        return Job.objects.get(key=key, status__in=Job.ACTIVE)
+
+
+def reap_jobs():
+    """
+    Fail the jobs running for longer than settings.JOB_TIMEOUT, their worker
+    died.  Returns how many.
+    """
+    stale = timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT)
+    return Job.objects.filter(status=Job.RUNNING, started__lt=stale).update(
+        status=Job.FAILED,
+        error=f"No result after {settings.JOB_TIMEOUT} seconds, the worker died.",
+        finished=timezone.now(),
+    )
+
+
+def job_status(job):
+    """What the jobs:status endpoint returns for job, a Job or its id."""
+    if not isinstance(job, Job):
+        job = Job.objects.get(pk=job)
+
+    return {
+        "id": job.id,
+        "title": job.title,
+        "status": job.get_status_display(),
+        "finished": job.is_finished,
+        "error": job.error,
+        "created": job.created,
+        "started": job.started,
+        "finished_at": job.finished,
+        "next_url": job.next_url,
+    }
+
+
+def claim_job():
+    """
+    Mark the oldest queued job running and return it, None if there is no
+    queued job.  Jobs locked by another worker are skipped.
+    """
+    reap_jobs()
+    with transaction.atomic():
+        queued = Job.objects.select_for_update(skip_locked=True).filter(status=Job.QUEUED)
+        job = queued.order_by("id").first()
+        if job is None:
+            return None
+
+        job.status = Job.RUNNING
+        job.started = timezone.now()
+        job.save(update_fields=["status", "started"])
+
+    return job
+
+
+def run_job(job):
+    """
+    Call the function of job, a claimed one, and record its result.  A job
+    reap_jobs() failed meanwhile stays failed, its result is dropped.
+    """
+    try:
+        result = import_string(job.func)(**job.kwargs)
+    except Exception:
+        job.status = Job.FAILED
+        job.error = traceback.format_exc()
+        print(f"Job {job} failed:\n{job.error}")
+    else:
+        job.status = Job.DONE
+        job.result = result
+
+    job.finished = timezone.now()
+    running = Job.objects.filter(pk=job.pk, status=Job.RUNNING)
+    if not running.update(
+        status=job.status, result=job.result, error=job.error, finished=job.finished
+    ):
+        print(f"Job {job} was reaped before it finished.")
+        job.refresh_from_db()
+    return job
+
+
+def run_jobs(limit=None):
+    """Run queued jobs until there are none left, or limit of them.  Returns the count."""
+    n = 0
+    while limit is None or n < limit:
+        job = claim_job()
+        if job is None:
+            break
+        run_job(job)
+        n += 1
+    return n
@@ -0,0 +1,42 @@
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404, redirect
+from django.urls import reverse
+from django.views.generic import TemplateView, View
+
+from jobs.models import Job
+from jobs.utils import job_status
+
+
+class JobView(LoginRequiredMixin, TemplateView):
+    """Progress page of a job, shows the result once it is done."""
+
+    template_name = "jobs/job.html"
+
+    def get(self, request, *args, **kwargs):
+        self.job = get_object_or_404(Job, pk=kwargs["pk"])
+        if self.job.status == Job.DONE and self.job.next_url:
+            return redirect(self.job.next_url)
+        return super().get(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        job = self.job
+        context["job"] = job
+        context["title"] = job.title or f"Job {job.id}"
+        context["status_url"] = reverse("jobs:status", kwargs={"pk": job.pk})
+
+        result = job.result if isinstance(job.result, dict) else {}
+        context["message"] = result.get("message")
+        context["lines"] = result.get("lines")
+        if "data" in result:
+            context["headings1"] = result.get("headings", [])
+            context["data1"] = result["data"]
+            context["formats1"] = result.get("formats", "{}")
+        return context
+
+
+class JobStatusView(LoginRequiredMixin, View):
+    def get(self, request, *args, **kwargs):
+        job = get_object_or_404(Job, pk=kwargs["pk"])
+        return JsonResponse(job_status(job))
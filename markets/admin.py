@@ -1,6 +1,7 @@
 from django.contrib import admin
-from .models import Market, Ticker, DailyPrice, TBGDailyBar
-from .utils import populate_historical_price_data
+from .models import Market, Ticker, DailyPrice, TBGDailyBar, QuoteSnapshot
+from django.utils.html import format_html
+from jobs.utils import enqueue
 
 
 @admin.register(Market)
@@ -14,8 +15,13 @@ class MarketAdmin(admin.ModelAdmin):
 
 
 def get_historical_prices(modeladmin, request, qs):
-    for ticker in qs:
-        populate_historical_price_data(ticker)
+    job = enqueue(
+        "markets.utils.populate_historical_prices",
+        title=f"Historical prices for {qs.count()} tickers",
+        ticker_ids=list(qs.values_list("id", flat=True)),
+    )
+    url = job.get_absolute_url()
+    modeladmin.message_user(request, format_html('Queued <a href="{}">job {}</a>.', url, job.id))
 
 
 @admin.register(Ticker)
@@ -40,3 +46,10 @@ class DailyBarAdmin(admin.ModelAdmin):
     date_hierarchy = "d"
     list_display = ("ticker", "d", "c")
     search_fields = ("ticker__ticker",)
+
+
+@admin.register(QuoteSnapshot)
+class QuoteSnapshotAdmin(admin.ModelAdmin):
+    date_hierarchy = "d"
+    list_display = ("ticker", "d", "dt", "price")
+    search_fields = ("ticker__ticker",)
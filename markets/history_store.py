@@ -0,0 +1,105 @@
+"""
+On-disk daily bar history, one .npz file of date/o/h/l/c/v/oi arrays per ticker.
+
+The files live in settings.PRICE_HISTORY_DIR so they survive restarts and are
+shared by every worker and management command.  Files are replaced atomically.
+Once a ticker has a history only the bars after the last stored date are
+requested from yahoo.  Each file also records the business day it was
+checked through, so a ticker that gets no new bars, an expired contract or a
+delisted stock, is asked for at most once a business day.
+"""
+
+import os
+import re
+import tempfile
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from tbgutils.dt import prior_business_day
+
+from markets.tbgyahoo import BAR_DTYPE, yahooBars
+
+
+def history_path(ticker):
+    name = re.sub(r"[^A-Za-z0-9_.^=-]", "_", ticker.ticker)
+    return Path(settings.PRICE_HISTORY_DIR) / f"{name}.npz"
+
+
+def read_history(ticker):
+    """
+    Return the stored BAR_DTYPE bars for ticker and the datetime64[D] day it
+    was checked through, (None, None) if nothing has been stored yet.  Files
+    written before the checked day was kept are checked through their last
+    bar.
+    """
+    path = history_path(ticker)
+    try:
+        with np.load(path) as data:
+            bars = np.empty(len(data["d"]), dtype=BAR_DTYPE)
+            for field in BAR_DTYPE.names:
+                bars[field] = data[field]
+            checked = data["checked"][()] if "checked" in data else None
+    except (FileNotFoundError, OSError, KeyError, ValueError):
+        return None, None
+
+    if checked is None and len(bars):
+        checked = bars["d"][-1]
+    return bars, checked
+
+
+def load_history(ticker):
+    """
+    Return the stored BAR_DTYPE bars for ticker or None if nothing has been
+    stored yet.
+    """
+    return read_history(ticker)[0]
+
+
+def save_history(ticker, bars, checked=None):
+    """Store bars, checked through the business day before today by default."""
+    if checked is None:
+        checked = prior_business_day(date.today())
+    path = history_path(ticker)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Write next to the target and rename so readers never see a partial file.
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            arrays = {field: bars[field] for field in BAR_DTYPE.names}
+            np.savez(fh, checked=np.datetime64(checked, "D"), **arrays)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def update_history(ticker):
+    """
+    Bring the stored history for ticker up to date and return all its bars.
+
+    The last stored bar is requested again because it may have been saved
+    while its day was still trading.  Nothing is requested when the history
+    was already checked through the last business day, even if yahoo had no
+    bars for it.
+    """
+    bars, checked = read_history(ticker)
+
+    if checked is not None and checked >= np.datetime64(prior_business_day(date.today()), "D"):
+        return bars
+
+    if bars is None or not len(bars):
+        # An empty history is saved too, so it is also asked for once a day.
+        bars = yahooBars(ticker)
+        save_history(ticker, bars)
+        return bars
+
+    last = bars["d"][-1]
+    new_bars = yahooBars(ticker, start=last.astype(object))
+    if len(new_bars):
+        bars = np.concatenate([bars[bars["d"] < new_bars["d"][0]], new_bars])
+    save_history(ticker, bars)
+
+    return bars
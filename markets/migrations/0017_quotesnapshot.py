@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("markets", "0016_market_t_close"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="QuoteSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("d", models.DateField(help_text="Trading day of the quote")),
+                ("dt", models.DateTimeField(help_text="When the quote was fetched")),
+                ("price", models.FloatField()),
+                (
+                    "ticker",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="markets.ticker"
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("ticker", "d")},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:01
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("markets", "0017_quotesnapshot"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="dailyprice",
+            index=django.contrib.postgres.indexes.BrinIndex(
+                fields=["d"], name="dailyprice_d_brin"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="tbgdailybar",
+            index=django.contrib.postgres.indexes.BrinIndex(
+                fields=["d"], name="tbgdailybar_d_brin"
+            ),
+        ),
+    ]
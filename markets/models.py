@@ -1,4 +1,5 @@
 from cachetools.func import ttl_cache
+from django.contrib.postgres.indexes import BrinIndex
 from django.db import models
 from django.dispatch import receiver
 from django.db.models.signals import pre_save
@@ -151,6 +152,9 @@ class DailyPrice(models.Model):
 
     class Meta:
         unique_together = [["ticker", "d"]]
+        # Rows are mostly appended in date order, a BRIN index on d stays
+        # tiny and lets date range and d__in scans skip most of the table.
+        indexes = [BrinIndex(fields=["d"], name="dailyprice_d_brin")]
 
     def __str__(self):
         return f"{self.d} {self.c}"
@@ -168,11 +172,31 @@ class TBGDailyBar(models.Model):
 
     class Meta:
         unique_together = [["ticker", "d"]]
+        # See DailyPrice.
+        indexes = [BrinIndex(fields=["d"], name="tbgdailybar_d_brin")]
 
     def __str__(self):
         return f"{self.d}|{self.o}|{self.h}|{self.l}|{self.c}|{self.v}|{self.oi}"
 
 
+class QuoteSnapshot(models.Model):
+    """
+    Last live quote for a ticker on a trading day, shared by every process.
+    See markets.quotes for when a snapshot is fresh enough to use.
+    """
+
+    ticker = models.ForeignKey(Ticker, on_delete=models.CASCADE)
+    d = models.DateField(help_text="Trading day of the quote")
+    dt = models.DateTimeField(help_text="When the quote was fetched")
+    price = models.FloatField()
+
+    class Meta:
+        unique_together = [["ticker", "d"]]
+
+    def __str__(self):
+        return f"{self.ticker} {self.dt} {self.price}"
+
+
 @ttl_cache(maxsize=10000, ttl=10)
 def get_ticker(t):
     return Ticker.objects.get(ticker=t)
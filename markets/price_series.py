@@ -0,0 +1,167 @@
+"""
+Sorted in-memory daily close series with binary search lookups.
+
+A PriceSeries holds a ticker's dates and closes as two sorted NumPy arrays.
+Looking up a date is a searchsorted instead of a scan of the history, and
+asof_many() prices a whole array of dates in one call.  downsample() thins
+a long series for charts.
+"""
+
+from itertools import groupby
+
+import numpy as np
+
+from markets.models import DailyPrice
+
+
+def to_datetime64(dates):
+    return np.asarray(dates, dtype="datetime64[D]")
+
+
+def lttb(x, y, n):
+    """
+    Indices of n points of (x, y) chosen by largest-triangle-three-buckets.
+
+    The first and last points are kept.  The points between are split into
+    n - 2 buckets and from each the point making the largest triangle with
+    the point kept from the previous bucket and the mean of the next bucket
+    is kept, so peaks and troughs survive.
+    """
+    size = len(x)
+    if n >= size or n < 3:
+        return np.arange(size)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+    edges[-1] = size - 1
+
+    result = np.empty(n, dtype=np.int64)
+    result[0], result[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i < n - 3:
+            next_x = x[hi : edges[i + 2]].mean()
+            next_y = y[hi : edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+
+        area = np.abs((x[a] - next_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y - y[a]))
+        a = lo + int(area.argmax())
+        result[i + 1] = a
+
+    return result
+
+
+class PriceSeries:
+    def __init__(self, dates, closes):
+        dates = to_datetime64(dates)
+        closes = np.asarray(closes, dtype=float)
+        if len(dates) > 1 and (np.diff(dates) < np.timedelta64(0, "D")).any():
+            order = np.argsort(dates, kind="stable")
+            dates, closes = dates[order], closes[order]
+        self.dates = dates
+        self.closes = closes
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __repr__(self):
+        if not len(self):
+            return "PriceSeries([])"
+        return f"PriceSeries({len(self)} closes {self.dates[0]} to {self.dates[-1]})"
+
+    @classmethod
+    def from_bars(cls, bars):
+        """Build from a BAR_DTYPE record array such as the yahoo history."""
+        return cls(bars["d"], bars["c"])
+
+    @classmethod
+    def load(cls, ticker, d_i=None, d_f=None):
+        """
+        DailyPrice closes of one Ticker, read with values_list straight into
+        arrays without making model instances.
+        """
+        qs = DailyPrice.objects.filter(ticker=ticker)
+        if d_i is not None:
+            qs = qs.filter(d__gte=d_i)
+        if d_f is not None:
+            qs = qs.filter(d__lte=d_f)
+        rows = np.fromiter(
+            qs.order_by("d").values_list("d", "c").iterator(),
+            dtype=[("d", "datetime64[D]"), ("c", "f8")],
+        )
+        return cls(rows["d"], rows["c"])
+
+    @classmethod
+    def from_daily_prices(cls, tickers, d_i=None, d_f=None):
+        """
+        Load DailyPrice closes for many ticker symbols with one query.
+
+        Returns {ticker symbol: PriceSeries}.  Every requested symbol is in the
+        result, those without prices get an empty series.
+        """
+        qs = DailyPrice.objects.filter(ticker__ticker__in=tickers)
+        if d_i is not None:
+            qs = qs.filter(d__gte=d_i)
+        if d_f is not None:
+            qs = qs.filter(d__lte=d_f)
+        qs = qs.order_by("ticker__ticker", "d").values_list("ticker__ticker", "d", "c")
+
+        result = {t: cls([], []) for t in tickers}
+        for t, rows in groupby(qs, key=lambda row: row[0]):
+            _, dates, closes = zip(*rows)
+            result[t] = cls(dates, closes)
+
+        return result
+
+    def first_date(self):
+        return self.dates[0].astype(object) if len(self) else None
+
+    def last_date(self):
+        return self.dates[-1].astype(object) if len(self) else None
+
+    def asof_index(self, dates):
+        """Index of the last close on or before each date, -1 if there is none."""
+        return np.searchsorted(self.dates, to_datetime64(dates), side="right") - 1
+
+    def asof(self, d):
+        """
+        Return (date, close) for the last close on or before d or None if the
+        series starts after d.
+        """
+        i = self.asof_index(d)
+        if i < 0:
+            return None
+        return self.dates[i].astype(object), float(self.closes[i])
+
+    def asof_many(self, dates, exact=False):
+        """
+        Closes for an array of dates, NaN where there is no price.
+
+        With exact=True only closes dated on the requested day are used.
+        """
+        dates = to_datetime64(dates)
+        result = np.full(dates.shape, np.nan)
+        if not len(self):
+            return result
+
+        i = self.asof_index(dates)
+        found = i >= 0
+        if exact:
+            found &= self.dates[np.maximum(i, 0)] == dates
+        result[found] = self.closes[i[found]]
+        return result
+
+    def downsample(self, n):
+        """At most n points of the series picked with lttb()."""
+        days = self.dates.astype(np.int64)
+        i = lttb(days, self.closes, n)
+        return PriceSeries(self.dates[i], self.closes[i])
+
+    def range(self, d0=None, d1=None):
+        """Sub-series with d0 <= date <= d1.  A None bound is open."""
+        i0 = 0 if d0 is None else np.searchsorted(self.dates, to_datetime64(d0), side="left")
+        i1 = len(self) if d1 is None else np.searchsorted(self.dates, to_datetime64(d1), "right")
+        return PriceSeries(self.dates[i0:i1], self.closes[i0:i1])
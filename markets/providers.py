@@ -0,0 +1,230 @@
+"""
+Where prices come from.
+
+A PriceProvider answers quote(), quotes(), history() and bar() for Ticker
+objects.  settings.PRICE_PROVIDER picks one of:
+
+    yahoo      live quotes and history from yahoo.
+    db         only what is already in DailyPrice and TBGDailyBar.
+    synthetic  a seeded random walk per ticker, PRICE_PROVIDER_SEED.
+    fixed      the fixed_prices table, what the tests use.
+
+get_price() and get_prices_bulk() still read DailyPrice and TBGDailyBar
+first and only ask the provider for what is missing.  Only prices from
+yahoo are saved to DailyPrice.  The fixed provider is authoritative, its
+prices are used even when the database has others.
+"""
+
+import zlib
+from datetime import date, timedelta
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from cachetools.func import ttl_cache
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from markets.history_store import update_history
+from markets.models import DailyPrice, TBGDailyBar
+from markets.price_series import PriceSeries
+from markets.tbgyahoo import BAR_DTYPE, bars_to_tuples, empty_bars, yahooCloses, yahooQuotes
+
+fixed_prices = {
+    "AAPL": 305.0,
+    "MSFT": 305.0,
+    "AMZN": 115.0,
+    "ESZ2021": 4300.0,
+    "MBXIX": 33.0,
+}
+
+
+def bars_since(bars, start):
+    if start is None:
+        return bars
+    return bars[bars["d"] >= np.datetime64(start, "D")]
+
+
+class PriceProvider:
+    # Prices from this provider override anything in the database.
+    authoritative = False
+    # Save historical closes from this provider to DailyPrice.
+    persist = False
+
+    def history(self, ticker, start=None):
+        """BAR_DTYPE record array of daily bars, on or after start if given."""
+        raise NotImplementedError
+
+    def quotes(self, tickers):
+        """{yahoo_ticker: price} for the tickers that have a price now."""
+        result = {}
+        today = date.today()
+        for ticker in tickers:
+            bar = self.bar(ticker, today)
+            if bar is not None:
+                result[ticker.yahoo_ticker] = bar[4]
+        return result
+
+    def quote(self, ticker):
+        return self.quotes([ticker]).get(ticker.yahoo_ticker)
+
+    def bar(self, ticker, d):
+        """
+        The (d, o, h, l, c, v, oi) bar for d or the last one before d.
+        None if there is none.
+        """
+        bars = self.history(ticker)
+        i = PriceSeries.from_bars(bars).asof_index(d)
+        if i < 0:
+            return None
+        return bars_to_tuples(bars[i : i + 1])[0]
+
+    def price(self, ticker, d=None):
+        # Today's quote or the close on or before d, None if unknown.
+        if d is None or d == date.today():
+            return self.quote(ticker)
+        bar = self.bar(ticker, d)
+        return None if bar is None else bar[4]
+
+    def closes(self, tickers, start, end):
+        """
+        {yahoo_ticker: Series of closes indexed by date} for start <= d < end.
+        Tickers without closes are left out.
+        """
+        result = {}
+        for ticker in tickers:
+            bars = self.history(ticker, start=start)
+            bars = bars[bars["d"] < np.datetime64(end, "D")]
+            if len(bars):
+                result[ticker.yahoo_ticker] = pd.Series(
+                    bars["c"], index=bars["d"].astype(object).tolist()
+                )
+        return result
+
+
+@ttl_cache(maxsize=1000, ttl=10)
+def yahoo_history(ticker):
+    return update_history(ticker)
+
+
+class YahooProvider(PriceProvider):
+    persist = True
+
+    def history(self, ticker, start=None):
+        return bars_since(yahoo_history(ticker), start)
+
+    def quotes(self, tickers):
+        return yahooQuotes(tickers) if tickers else {}
+
+    def bar(self, ticker, d):
+        # A history that ends before d may just not be updated yet.
+        bars = self.history(ticker)
+        if not len(bars) or np.datetime64(d, "D") > bars["d"][-1]:
+            return None
+        return super().bar(ticker, d)
+
+    def closes(self, tickers, start, end):
+        return yahooCloses(tickers, start, end)
+
+
+class DBProvider(PriceProvider):
+    def history(self, ticker, start=None):
+        # TBGDailyBar bars plus DailyPrice closes for the days without a bar.
+        prices = DailyPrice.objects.filter(ticker=ticker)
+        tbg = TBGDailyBar.objects.filter(ticker=ticker)
+        if start is not None:
+            prices = prices.filter(d__gte=start)
+            tbg = tbg.filter(d__gte=start)
+
+        bars = {d: (d, c, c, c, c, 0, 0) for d, c in prices.values_list("d", "c")}
+        for bar in tbg.values_list("d", "o", "h", "l", "c", "v", "oi"):
+            bars[bar[0]] = bar
+
+        if not bars:
+            return empty_bars()
+        return np.array([bars[d] for d in sorted(bars)], dtype=BAR_DTYPE)
+
+
+class SyntheticProvider(PriceProvider):
+    """
+    Geometric random walk of business day bars from start to today.  The
+    same seed and ticker always give the same prices.
+    """
+
+    start = date(2000, 1, 3)
+    drift = 0.0003
+    volatility = 0.015
+
+    def __init__(self, seed=0):
+        self.seed = seed
+        self.cache = {}
+
+    def history(self, ticker, start=None):
+        key = (ticker.ticker, date.today())
+        bars = self.cache.get(key)
+        if bars is None:
+            bars = self.cache[key] = self.generate(ticker, key[1])
+        return bars_since(bars, start)
+
+    def generate(self, ticker, today):
+        days = np.arange(self.start, today + timedelta(days=1), dtype="datetime64[D]")
+        days = days[np.is_busday(days)]
+
+        name = zlib.crc32(ticker.ticker.encode())
+        rng = np.random.default_rng([self.seed, name])
+        level = 10.0 + name % 490
+        c = level * np.exp(np.cumsum(rng.normal(self.drift, self.volatility, len(days))))
+        o = np.concatenate([[level], c[:-1]])
+        spread = np.abs(rng.normal(0.0, self.volatility / 2, len(days)))
+
+        pprec = ticker.market.pprec
+        bars = np.empty(len(days), dtype=BAR_DTYPE)
+        bars["d"] = days
+        bars["o"] = np.round(o, pprec)
+        bars["c"] = np.round(c, pprec)
+        bars["h"] = np.round(np.maximum(o, c) * (1 + spread), pprec)
+        bars["l"] = np.round(np.minimum(o, c) * (1 - spread), pprec)
+        bars["v"] = rng.integers(1_000, 1_000_000, len(days))
+        bars["oi"] = 0
+        return bars
+
+
+class FixedProvider(PriceProvider):
+    authoritative = True
+
+    @staticmethod
+    def fixed_price(ticker):
+        return fixed_prices.get(ticker.yahoo_ticker, 1.0)
+
+    def history(self, ticker, start=None):
+        return empty_bars()
+
+    def quotes(self, tickers):
+        return {t.yahoo_ticker: self.fixed_price(t) for t in tickers}
+
+    def bar(self, ticker, d):
+        p = self.fixed_price(ticker)
+        return d, p, p, p, p, 0, 0
+
+
+PROVIDERS = {
+    "yahoo": YahooProvider,
+    "db": DBProvider,
+    "synthetic": SyntheticProvider,
+    "fixed": FixedProvider,
+}
+
+
+@lru_cache(maxsize=None)
+def make_provider(name, seed):
+    if name not in PROVIDERS:
+        raise ImproperlyConfigured(
+            f"PRICE_PROVIDER must be one of {', '.join(PROVIDERS)}, not {name}."
+        )
+    if name == "synthetic":
+        return SyntheticProvider(seed)
+    return PROVIDERS[name]()
+
+
+def get_provider():
+    return make_provider(settings.PRICE_PROVIDER, settings.PRICE_PROVIDER_SEED)
@@ -0,0 +1,165 @@
+"""
+Live quotes for many tickers fetched concurrently.
+
+fetch_quotes() runs one request per symbol on a bounded thread pool.  A
+symbol that fails or is not back in time is reported in Quotes.failed
+instead of raising, so the other prices still come back.
+
+The transport does the actual request.  It is any object with a
+fetch(symbol, timeout) method returning the last price.  settings.QUOTE_TRANSPORT
+names the default one, YahooChartTransport, whose requests give up after
+timeout.  YFinanceTransport has no timeout: fetch_quotes() stops waiting for
+it but a hung request keeps its thread until it returns on its own.
+
+Quotes are also kept in the QuoteSnapshot table so every worker and command
+shares them.  A snapshot taken QUOTE_CLOSE_DELAY minutes or more after its
+market's t_close is final for the day and never refetched.  Before that it
+is reused for QUOTE_STALENESS seconds.
+"""
+
+import math
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+import requests
+import yfinance as yf
+from django.conf import settings
+from django.utils.module_loading import import_string
+from tbgutils.dt import our_now, our_localize, most_recent_business_day
+
+from markets.models import QuoteSnapshot
+
+# prices: {symbol: price}, failed: {symbol: reason}
+Quotes = namedtuple("Quotes", ["prices", "failed"])
+
+
+class YFinanceTransport:
+    """
+    regularMarketPrice from yfinance Ticker.info.  yfinance has no timeout
+    for info, a request fetch_quotes() stopped waiting for keeps running.
+    """
+
+    def fetch(self, symbol, timeout):
+        return yf.Ticker(symbol).info.get("regularMarketPrice")
+
+
+class YahooChartTransport:
+    """regularMarketPrice from the yahoo chart endpoint, which needs no crumb."""
+
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; WOW64) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/54.0.2840.99 Safari/537.36",
+    }
+
+    def __init__(self, base_url="https://query1.finance.yahoo.com"):
+        self.base_url = base_url.rstrip("/")
+
+    def fetch(self, symbol, timeout):
+        url = f"{self.base_url}/v8/finance/chart/{quote(symbol, safe='')}"
+        response = requests.get(url, headers=self.headers, timeout=timeout)
+        response.raise_for_status()
+        result = response.json()["chart"]["result"]
+        if not result:
+            return None
+        return result[0]["meta"].get("regularMarketPrice")
+
+
+def get_transport():
+    return import_string(settings.QUOTE_TRANSPORT)()
+
+
+def fetch_quotes(symbols, transport=None, max_workers=None, timeout=None):
+    """
+    Fetch the last price of each symbol, at most max_workers at a time.
+
+    Never raises for a single symbol.  Errors, missing prices and requests
+    that are still running when the time is up all end up in failed.  The
+    wait is timeout for each round of max_workers requests, the transport is
+    expected to give up on a request after timeout itself.
+    """
+    symbols = list(dict.fromkeys(symbols))
+    prices, failed = {}, {}
+    if not symbols:
+        return Quotes(prices, failed)
+
+    if transport is None:
+        transport = get_transport()
+    if max_workers is None:
+        max_workers = settings.QUOTE_MAX_WORKERS
+    if timeout is None:
+        timeout = settings.QUOTE_TIMEOUT
+
+    max_workers = min(max_workers, len(symbols))
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="quotes")
+    futures = {pool.submit(transport.fetch, s, timeout): s for s in symbols}
+
+    # Requests queue behind the first max_workers so allow a timeout per round.
+    rounds = math.ceil(len(symbols) / max_workers)
+    done, not_done = wait(futures, timeout=timeout * rounds)
+    pool.shutdown(wait=False, cancel_futures=True)
+
+    for future in done:
+        symbol = futures[future]
+        try:
+            price = future.result()
+        except Exception as e:
+            failed[symbol] = f"{type(e).__name__}: {e}"
+            continue
+
+        try:
+            price = float(price)
+        except (TypeError, ValueError):
+            price = math.nan
+
+        if math.isfinite(price):
+            prices[symbol] = price
+        else:
+            failed[symbol] = "no price"
+
+    for future in not_done:
+        failed[futures[future]] = f"no response in {timeout}s"
+
+    return Quotes(prices, failed)
+
+
+def is_final(snapshot):
+    # The day's quote does not change once the market has closed.
+    close = datetime.combine(snapshot.d, snapshot.ticker.market.t_close)
+    close = our_localize(close) + timedelta(minutes=settings.QUOTE_CLOSE_DELAY)
+    return snapshot.dt >= close
+
+
+def load_snapshots(tickers, now=None):
+    """
+    Return {yahoo_ticker: price} for the tickers with a usable snapshot for
+    the current trading day.
+    """
+    if now is None:
+        now = our_now()
+    d = most_recent_business_day(now.date())
+    stale = now - timedelta(seconds=settings.QUOTE_STALENESS)
+
+    qs = QuoteSnapshot.objects.filter(ticker__in=tickers, d=d).select_related("ticker__market")
+    return {s.ticker.yahoo_ticker: s.price for s in qs if s.dt >= stale or is_final(s)}
+
+
+def save_snapshots(tickers, prices, now=None):
+    """Store prices, {yahoo_ticker: price}, as the snapshots for the current trading day."""
+    if now is None:
+        now = our_now()
+    d = most_recent_business_day(now.date())
+
+    snapshots = {
+        t.id: QuoteSnapshot(ticker=t, d=d, dt=now, price=prices[t.yahoo_ticker])
+        for t in tickers
+        if t.yahoo_ticker in prices
+    }
+    QuoteSnapshot.objects.bulk_create(
+        list(snapshots.values()),
+        update_conflicts=True,
+        unique_fields=["ticker", "d"],
+        update_fields=["dt", "price"],
+    )
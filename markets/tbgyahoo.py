@@ -3,7 +3,9 @@ import requests
 from django.utils.safestring import mark_safe
 import yfinance as yf
 from tbgutils.dt import next_business_day
+import numpy as np
 import pandas as pd
+from markets.quotes import fetch_quotes, load_snapshots, save_snapshots
 
 
 def price_now(ticker):
@@ -14,8 +16,11 @@ def price_now(ticker):
 
 
 def prices_now(tickers):
-    # tickers is a list of yahoo tickers
-    return {t: price_now(t) for t in tickers}
+    # tickers is a list of yahoo tickers, fetched concurrently.
+    quotes = fetch_quotes(tickers)
+    for t, reason in quotes.failed.items():
+        print(f"Cannot get quote for {t}: {reason}")
+    return quotes.prices
 
 
 def yahoo_get(url):
@@ -34,77 +39,157 @@ def yahoo_get(url):
     return website.text
 
 
-def yahooHistory(ticker):
+# Daily bars as a compact record array, one row per day.
+BAR_DTYPE = np.dtype(
+    [
+        ("d", "datetime64[D]"),
+        ("o", "f8"),
+        ("h", "f8"),
+        ("l", "f8"),
+        ("c", "f8"),
+        ("v", "i8"),
+        ("oi", "i8"),
+    ]
+)
+
+
+def empty_bars():
+    return np.empty(0, dtype=BAR_DTYPE)
+
+
+def bars_to_tuples(bars):
+    """
+    Adapter for code that wants the old list of
+    (date, open, high, low, close, volume, open_interest) tuples.
+    """
+    return list(
+        zip(
+            bars["d"].astype(object),
+            bars["o"].tolist(),
+            bars["h"].tolist(),
+            bars["l"].tolist(),
+            bars["c"].tolist(),
+            bars["v"].tolist(),
+            bars["oi"].tolist(),
+        )
+    )
+
+
+def frame_to_bars(df, yahoo_ticker, multiplier=1.0, pprec=4):
+    """
+    Convert a yf.download frame for one ticker to a BAR_DTYPE record array.
+
+    Rows with any missing value are dropped.  Prices are scaled by multiplier
+    and rounded to pprec digits.  Works on whole columns, no per-row Python.
+    """
+    if isinstance(df.columns, pd.MultiIndex):
+        level = 1 if yahoo_ticker in df.columns.get_level_values(1) else 0
+        df = df.xs(yahoo_ticker, axis=1, level=level)
+
+    df = df[df.notna().all(axis=1).to_numpy()]
+
+    index = df.index
+    if index.tz is not None:
+        index = index.tz_localize(None)
+
+    bars = np.empty(len(df), dtype=BAR_DTYPE)
+    bars["d"] = index.to_numpy().astype("datetime64[D]")
+    for field, column in (("o", "Open"), ("h", "High"), ("l", "Low"), ("c", "Close")):
+        bars[field] = np.round(df[column].to_numpy(dtype=float) * multiplier, pprec)
+    bars["v"] = df["Volume"].to_numpy(dtype=float).astype(np.int64)
+    bars["oi"] = 0  # YFinance doesn't provide open interest
+
+    return bars
+
+
+def yahooBars(ticker, start=None):
     """
     Get historical yahoo prices for the given ticker symbol using yfinance.
     ticker can be KCH22.NYB or ^GSPC or MSFT
+    If start is given only bars on or after that date are downloaded.
 
-    Returns tuples with (date, open, high, low, close, volume, open_interest)
+    Returns a BAR_DTYPE record array.
     """
     yahoo_ticker = ticker.yahoo_ticker
-    try:
+    if start is None:
         # Download all historical data for this ticker
+        span = {"period": "max"}
+    else:
+        span = {"start": start}
+    try:
         df = yf.download(
             tickers=yahoo_ticker,
-            period="max",  # Get all available data
+            **span,
             interval="1d",
             auto_adjust=False,
             prepost=True,  # Include pre-market and after-hours data
             repair=not ticker.is_futures,
         )
 
-        if df.empty:
+        if df is None or df.empty:
             print(f"Cannot get prices for {yahoo_ticker} from yahoo.")
-            return []
-
-        # Convert the DataFrame to the expected output format
-        multiplier = ticker.market.yahoo_price_factor
-        p = ticker.market.pprec
-
-        def scale(x):
-            if x is None or pd.isna(x):
-                return None
-            return round(x * multiplier, ndigits=p)
-
-        # Process the data into the expected format
-        result = []
-        for index, row in df.iterrows():
-            try:
-                if any([pd.isna(i) for i in row.values]):
-                    continue
-
-                bar_date = index.date()
-                open_price = scale(row["Open"][yahoo_ticker])
-                high_price = scale(row["High"][yahoo_ticker])
-                low_price = scale(row["Low"][yahoo_ticker])
-                close_price = scale(row["Close"][yahoo_ticker])
-                volume = row["Volume"][yahoo_ticker]
-                if pd.isna(volume):
-                    volume = 0
-                else:
-                    volume = int(volume)
-                open_interest = 0  # YFinance doesn't provide open interest
-
-                result.append(
-                    (
-                        bar_date,
-                        open_price,
-                        high_price,
-                        low_price,
-                        close_price,
-                        volume,
-                        open_interest,
-                    )
-                )
-            except (TypeError, ValueError) as e:
-                print(f"Error processing row for {ticker} on {index.date()}: {e}")
-                continue
+            return empty_bars()
 
-        return result
+        market = ticker.market
+        return frame_to_bars(df, yahoo_ticker, market.yahoo_price_factor, market.pprec)
 
     except Exception as e:
         print(f"Error fetching history for {ticker} with yfinance: {e}")
-        return []
+        return empty_bars()
+
+
+def yahooHistory(ticker, start=None):
+    """
+    Same as yahooBars but returns tuples with
+    (date, open, high, low, close, volume, open_interest)
+    """
+    return bars_to_tuples(yahooBars(ticker, start=start))
+
+
+def yahooCloses(tickers, start, end):
+    """
+    Get daily closes for many tickers with a single yf.download.
+
+    tickers are Ticker objects, start is inclusive and end is exclusive.
+    Returns {yahoo_ticker: Series of closes indexed by date} with the market
+    yahoo_price_factor and pprec applied.  Tickers yahoo has nothing for are left out.
+    """
+    tickers = {t.yahoo_ticker: t for t in tickers}
+    if not tickers:
+        return {}
+
+    try:
+        df = yf.download(
+            tickers=" ".join(sorted(tickers)),
+            start=start,
+            end=end,
+            interval="1d",
+            group_by="ticker",
+            auto_adjust=False,
+            prepost=True,
+        )
+    except Exception as e:
+        print(f"Error fetching closes with yfinance: {e}")
+        return {}
+
+    if df is None or df.empty:
+        return {}
+
+    result = {}
+    for yahoo_ticker, ticker in tickers.items():
+        try:
+            close = df[yahoo_ticker]["Close"].dropna()
+        except KeyError:
+            continue
+
+        if close.empty:
+            continue
+
+        close = (close * ticker.market.yahoo_price_factor).round(ticker.market.pprec)
+        close.index = close.index.date
+        result[yahoo_ticker] = close
+
+    return result
 
 
 def get_prices(tickers, d=None):
@@ -131,15 +216,21 @@ def get_prices(tickers, d=None):
     )
 
     result = {}
-    date_str = d.strftime("%Y-%m-%d")
+    if data is None or data.empty:
+        return result
+
+    # All tickers share the index so find the row for d once.
+    index = data.index
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    rows = np.flatnonzero(index.normalize() == pd.Timestamp(d))
+    if not len(rows):
+        return result
+    row = rows[0]
 
     for ticker in tickers:
         try:
-            matching_dates = data[ticker].index[
-                data[ticker].index.strftime("%Y-%m-%d") == date_str
-            ]
-            if len(matching_dates) > 0:
-                result[ticker] = data[ticker].loc[matching_dates[0], "Close"]
+            result[ticker] = data[ticker]["Close"].iloc[row]
         except KeyError:
             pass
 
@@ -149,7 +240,17 @@ def get_prices(tickers, d=None):
 def yahooQuotes(tickers, d=None):
     """
     yf.download gets all the prices with a single web request.
+
+    Today's quotes go through the shared QuoteSnapshot cache, only tickers
+    without a fresh snapshot are fetched.
     """
+    live = d is None or d == date.today()
+    cached = {}
+    if live:
+        cached = load_snapshots(tickers)
+        tickers = [t for t in tickers if t.yahoo_ticker not in cached]
+        if not tickers:
+            return cached
 
     yahoo_tickers = [t.yahoo_ticker for t in tickers]
     prices = get_prices(yahoo_tickers, d)
@@ -165,6 +266,10 @@ def yahooQuotes(tickers, d=None):
         else:
             print(f"No price found for {yt}")
 
+    if live:
+        save_snapshots(tickers, result)
+        result.update(cached)
+
     return result
 
 
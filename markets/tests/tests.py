@@ -1,8 +1,35 @@
-from datetime import date
-from markets.tbgyahoo import yahooHistory, yahooQuotes
-from markets.models import Market, Ticker
+import json
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import tempfile
+from datetime import date, datetime, time as dt_time, timedelta
+from unittest import mock
+from zoneinfo import ZoneInfo
+import numpy as np
+import pandas as pd
+from markets.tbgyahoo import yahooHistory, yahooQuotes, BAR_DTYPE, bars_to_tuples, frame_to_bars
+from markets.models import Market, Ticker, DailyPrice, TBGDailyBar
+from markets.utils import (
+    get_price,
+    get_prices_bulk,
+    get_historical_bar,
+    populate_historical_price_data,
+    save_daily_bars,
+)
+from markets.price_series import PriceSeries, lttb
+from markets.providers import DBProvider, SyntheticProvider
+from markets.quotes import (
+    Quotes,
+    YahooChartTransport,
+    fetch_quotes,
+    load_snapshots,
+    save_snapshots,
+)
+from markets.history_store import load_history, save_history, update_history
 from trades.tests import make_trades
-from django.test import TestCase, tag
+from django.test import TestCase, override_settings, tag
 from tbgutils.dt import next_business_day
 import yfinance as yf
 
@@ -83,3 +110,365 @@ class YahooHistoryTests(TestCase):
         self.assertEqual(len(june_18_bars), 1)
         self.assertIsNotNone(june_18_bars[0][4])
         self.assertGreater(june_18_bars[0][4], 0)
+
+
+@override_settings(PRICE_PROVIDER="yahoo")
+class BulkPriceTests(TestCase):
+    def setUp(self):
+        make_trades()
+        self.aapl = Ticker.objects.get(ticker="AAPL")
+        self.amzn = Ticker.objects.get(ticker="AMZN")
+        self.msft = Ticker.objects.get(ticker="MSFT")
+
+    def test_prices_from_database(self):
+        d1 = date(2021, 10, 22)
+        d2 = date(2021, 10, 25)
+        DailyPrice.objects.create(ticker=self.aapl, d=d1, c=301.5)
+        TBGDailyBar.objects.create(ticker=self.amzn, d=d2, o=1, h=1, l=1, c=76.25, v=0, oi=0)
+
+        # Saturday rolls back to Friday just like get_price.
+        saturday = date(2021, 10, 23)
+        pairs = [(self.aapl, d1), ("AAPL", saturday), (self.amzn, d2), (self.msft, d2)]
+        prices = get_prices_bulk(pairs)
+
+        self.assertEqual(4, len(prices))
+        self.assertAlmostEqual(301.5, prices[(self.aapl, d1)])
+        self.assertAlmostEqual(301.5, prices[("AAPL", saturday)])
+        self.assertAlmostEqual(76.25, prices[(self.amzn, d2)])
+        self.assertAlmostEqual(300.0, prices[(self.msft, d2)])
+
+        # Closes found in TBGDailyBar are saved to DailyPrice.
+        self.assertTrue(DailyPrice.objects.filter(ticker=self.amzn, d=d2, c=76.25).exists())
+
+    @override_settings(PRICE_PROVIDER="yahoo")
+    def test_differences_from_get_price(self):
+        d1 = date(2021, 10, 22)
+        d2 = date(2021, 10, 15)
+        TBGDailyBar.objects.create(ticker=self.amzn, d=d1, o=1, h=1, l=1, c=76.25, v=0, oi=0)
+        # A month without bars before d1.
+        bars = np.concatenate(
+            [
+                HistoryStoreTests.bars(date(2021, 9, 1), date(2021, 9, 3)),
+                HistoryStoreTests.bars(d1, date(2021, 10, 29)),
+            ]
+        )
+
+        def closes(tickers, start, end):
+            window = bars[(bars["d"] >= np.datetime64(start)) & (bars["d"] < np.datetime64(end))]
+            return {"AMZN": pd.Series(window["c"], index=window["d"].astype(object).tolist())}
+
+        with (
+            mock.patch("markets.providers.yahoo_history", return_value=bars),
+            mock.patch("markets.providers.yahooCloses", side_effect=closes),
+        ):
+            # The provider before TBGDailyBar, with no limit on how old its bar is.
+            self.assertAlmostEqual(1.5, get_price(self.amzn, d1))
+            self.assertAlmostEqual(1.5, get_price(self.amzn, d2))
+
+            DailyPrice.objects.all().delete()
+            prices = get_prices_bulk([(self.amzn, d1), (self.amzn, d2)])
+        self.assertAlmostEqual(76.25, prices[(self.amzn, d1)])
+        self.assertEqual(0.0, prices[(self.amzn, d2)])
+
+
+class HistoryStoreTests(TestCase):
+    def setUp(self):
+        market = Market.objects.create(symbol="STOCK", name="Equity")
+        self.ticker = Ticker.objects.create(ticker="AAPL", market=market)
+
+        self.history_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.history_dir, True)
+        self.settings_override = override_settings(PRICE_HISTORY_DIR=self.history_dir)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    @staticmethod
+    def bars(d_i, d_f):
+        result = []
+        d = d_i
+        while d <= d_f:
+            result.append((d, 1.0, 2.0, 0.5, 1.5, 100, 0))
+            d += timedelta(days=1)
+        return np.array(result, dtype=BAR_DTYPE)
+
+    def test_incremental_update(self):
+        first = self.bars(date(2021, 1, 4), date(2021, 1, 8))
+        with mock.patch("markets.history_store.yahooBars", return_value=first) as yb:
+            np.testing.assert_array_equal(first, update_history(self.ticker))
+            yb.assert_called_once_with(self.ticker)
+
+        np.testing.assert_array_equal(first, load_history(self.ticker))
+
+        # Checked through today, yahoo is not asked again.
+        with mock.patch("markets.history_store.yahooBars") as yb:
+            np.testing.assert_array_equal(first, update_history(self.ticker))
+            yb.assert_not_called()
+
+        # Some days later the last stored bar is asked for again and replaced.
+        save_history(self.ticker, first, checked=date(2021, 1, 8))
+        newer = np.concatenate(
+            [
+                np.array([(date(2021, 1, 8), 1.0, 2.0, 0.5, 1.75, 200, 0)], dtype=BAR_DTYPE),
+                self.bars(date(2021, 1, 11), date(2021, 1, 12)),
+            ]
+        )
+        with mock.patch("markets.history_store.yahooBars", return_value=newer) as yb:
+            result = update_history(self.ticker)
+            yb.assert_called_once_with(self.ticker, start=date(2021, 1, 8))
+
+        np.testing.assert_array_equal(np.concatenate([first[:-1], newer]), result)
+        np.testing.assert_array_equal(result, load_history(self.ticker))
+
+    def test_empty_history_checked_daily(self):
+        empty = np.array([], dtype=BAR_DTYPE)
+        with mock.patch("markets.history_store.yahooBars", return_value=empty) as yb:
+            self.assertEqual(0, len(update_history(self.ticker)))
+            self.assertEqual(0, len(update_history(self.ticker)))
+            yb.assert_called_once_with(self.ticker)
+
+        # Checked before the last business day, the whole history is asked for again.
+        save_history(self.ticker, empty, checked=date(2021, 1, 8))
+        first = self.bars(date(2021, 1, 4), date(2021, 1, 8))
+        with mock.patch("markets.history_store.yahooBars", return_value=first) as yb:
+            np.testing.assert_array_equal(first, update_history(self.ticker))
+            yb.assert_called_once_with(self.ticker)
+
+
+class FrameToBarsTests(TestCase):
+    def test_frame_to_bars(self):
+        index = pd.DatetimeIndex(["2021-01-04", "2021-01-05", "2021-01-06"], tz="America/New_York")
+        columns = pd.MultiIndex.from_product(
+            [["KCH21.NYB"], ["Open", "High", "Low", "Close", "Adj Close", "Volume"]]
+        )
+        df = pd.DataFrame(
+            [
+                [125.0, 127.5, 124.0, 126.25, 126.25, 1000],
+                [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan],
+                [126.0, 128.0, 125.5, 127.123456, 127.123456, 2000],
+            ],
+            index=index,
+            columns=columns,
+        )
+
+        bars = frame_to_bars(df, "KCH21.NYB", multiplier=0.01, pprec=4)
+
+        self.assertEqual(BAR_DTYPE, bars.dtype)
+        self.assertEqual(
+            [
+                (date(2021, 1, 4), 1.25, 1.275, 1.24, 1.2625, 1000, 0),
+                (date(2021, 1, 6), 1.26, 1.28, 1.255, 1.2712, 2000, 0),
+            ],
+            bars_to_tuples(bars),
+        )
+
+
+class PriceSeriesTests(TestCase):
+    def setUp(self):
+        # Out of order on purpose, the series sorts itself.
+        self.series = PriceSeries(
+            [date(2021, 1, 6), date(2021, 1, 4), date(2021, 1, 5), date(2021, 1, 8)],
+            [12.0, 10.0, 11.0, 14.0],
+        )
+
+    def test_asof(self):
+        s = self.series
+        self.assertIsNone(s.asof(date(2021, 1, 1)))
+        self.assertEqual((date(2021, 1, 4), 10.0), s.asof(date(2021, 1, 4)))
+        self.assertEqual((date(2021, 1, 6), 12.0), s.asof(date(2021, 1, 7)))
+        self.assertEqual((date(2021, 1, 8), 14.0), s.asof(date(2021, 2, 1)))
+
+    def test_asof_many(self):
+        dates = [date(2021, 1, 1), date(2021, 1, 5), date(2021, 1, 7), date(2021, 1, 9)]
+        np.testing.assert_array_equal([np.nan, 11.0, 12.0, 14.0], self.series.asof_many(dates))
+        np.testing.assert_array_equal(
+            [np.nan, 11.0, np.nan, np.nan], self.series.asof_many(dates, exact=True)
+        )
+
+    def test_range(self):
+        r = self.series.range(date(2021, 1, 5), date(2021, 1, 7))
+        self.assertEqual([date(2021, 1, 5), date(2021, 1, 6)], r.dates.astype(object).tolist())
+        self.assertEqual([11.0, 12.0], r.closes.tolist())
+        self.assertEqual(4, len(self.series.range()))
+
+    def test_lttb(self):
+        x = np.arange(1000)
+        y = np.sin(x / 50.0)
+        y[500] = 10
+        i = lttb(x, y, 50)
+        self.assertEqual(50, len(i))
+        self.assertEqual([0, 999], [i[0], i[-1]])
+        self.assertTrue((np.diff(i) > 0).all())
+        self.assertIn(500, i)
+
+        np.testing.assert_array_equal(np.arange(4), lttb(x[:4], y[:4], 50))
+        self.assertEqual(3, len(self.series.downsample(3)))
+
+    def test_from_daily_prices(self):
+        market = Market.objects.create(symbol="STOCK", name="Equity")
+        ticker = Ticker.objects.create(ticker="AAPL", market=market)
+        DailyPrice.objects.create(ticker=ticker, d=date(2021, 1, 5), c=11.0)
+        DailyPrice.objects.create(ticker=ticker, d=date(2021, 1, 4), c=10.0)
+
+        series = PriceSeries.from_daily_prices(["AAPL", "MSFT"])
+        self.assertEqual([10.0, 11.0], series["AAPL"].closes.tolist())
+        self.assertEqual(0, len(series["MSFT"]))
+
+    def test_historical_bar_before_history(self):
+        market = Market.objects.create(symbol="STOCK", name="Equity")
+        ticker = Ticker.objects.create(ticker="AAPL", market=market)
+        bars = HistoryStoreTests.bars(date(2021, 1, 4), date(2021, 1, 8))
+        with mock.patch("markets.providers.yahoo_history", return_value=bars):
+            # Used to return the last bar of the history.
+            self.assertIsNone(get_historical_bar(ticker, date(2021, 1, 1)))
+            self.assertEqual(date(2021, 1, 5), get_historical_bar(ticker, date(2021, 1, 5))[0])
+            self.assertIsNone(get_historical_bar(ticker, date(2021, 1, 11)))
+
+
+class FakeChartHandler(BaseHTTPRequestHandler):
+    # Serves /v8/finance/chart/<symbol> like yahoo for a few made up symbols.
+    prices = {"AAPL": 150.25, "KCH21.NYB": 125.5}
+
+    def do_GET(self):
+        symbol = self.path.rsplit("/", 1)[-1]
+        if symbol == "SLOW":
+            time.sleep(2)
+        price = self.prices.get(symbol)
+        if price is None:
+            self.send_error(404)
+            return
+        body = json.dumps({"chart": {"result": [{"meta": {"regularMarketPrice": price}}]}})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class QuoteFetcherTests(TestCase):
+    def setUp(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), FakeChartHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.transport = YahooChartTransport(f"http://127.0.0.1:{server.server_port}")
+
+    def test_partial_results(self):
+        t0 = time.monotonic()
+        quotes = fetch_quotes(
+            ["AAPL", "BAD", "SLOW", "KCH21.NYB"], transport=self.transport, timeout=0.5
+        )
+        self.assertLess(time.monotonic() - t0, 2)
+
+        self.assertEqual({"AAPL": 150.25, "KCH21.NYB": 125.5}, quotes.prices)
+        self.assertEqual({"BAD", "SLOW"}, set(quotes.failed))
+
+    def test_yahoo_quotes(self):
+        market = Market.objects.create(
+            symbol="KC", name="Coffee", yahoo_exchange="NYB", yahoo_price_factor=0.01
+        )
+        kc = Ticker.objects.create(ticker="KCH2021", market=market)
+        stock = Market.objects.create(symbol="STOCK", name="Equity")
+        bad = Ticker.objects.create(ticker="BAD", market=stock)
+
+        with mock.patch("markets.quotes.get_transport", return_value=self.transport):
+            result = yahooQuotes([kc, bad])
+
+        self.assertEqual({"KCH21.NYB"}, set(result))
+        self.assertAlmostEqual(1.255, result["KCH21.NYB"])
+
+
+class QuoteSnapshotTests(TestCase):
+    def setUp(self):
+        market = Market.objects.create(symbol="STOCK", name="Equity", t_close=dt_time(16, 0))
+        self.ticker = Ticker.objects.create(ticker="AAPL", market=market)
+
+    def test_freshness(self):
+        tz = ZoneInfo("America/New_York")
+        trading = datetime(2021, 10, 22, 11, 0, tzinfo=tz)
+        save_snapshots([self.ticker], {"AAPL": 150.0}, now=trading)
+
+        later = trading + timedelta(seconds=30)
+        self.assertEqual({"AAPL": 150.0}, load_snapshots([self.ticker], now=later))
+        later = trading + timedelta(minutes=5)
+        self.assertEqual({}, load_snapshots([self.ticker], now=later))
+
+        # Taken after the close so it is still good on Saturday.
+        evening = datetime(2021, 10, 22, 19, 0, tzinfo=tz)
+        save_snapshots([self.ticker], {"AAPL": 151.0}, now=evening)
+        saturday = datetime(2021, 10, 23, 12, 0, tzinfo=tz)
+        self.assertEqual({"AAPL": 151.0}, load_snapshots([self.ticker], now=saturday))
+
+    def test_yahoo_quotes_use_snapshots(self):
+        with mock.patch("markets.tbgyahoo.fetch_quotes") as fq:
+            fq.return_value = Quotes({"AAPL": 150.0}, {})
+            self.assertEqual({"AAPL": 150.0}, yahooQuotes([self.ticker]))
+            self.assertEqual({"AAPL": 150.0}, yahooQuotes([self.ticker]))
+            fq.assert_called_once_with(["AAPL"])
+
+
+class ProviderTests(TestCase):
+    def setUp(self):
+        market = Market.objects.create(symbol="STOCK", name="Equity", pprec=2)
+        self.ticker = Ticker.objects.create(ticker="AAPL", market=market)
+
+    def test_synthetic(self):
+        bars = SyntheticProvider(seed=7).history(self.ticker)
+        np.testing.assert_array_equal(bars, SyntheticProvider(seed=7).history(self.ticker))
+        self.assertFalse(np.array_equal(bars["c"], SyntheticProvider(8).history(self.ticker)["c"]))
+
+        self.assertTrue(np.is_busday(bars["d"]).all())
+        self.assertTrue((bars["l"] <= np.minimum(bars["o"], bars["c"])).all())
+        self.assertTrue((bars["h"] >= np.maximum(bars["o"], bars["c"])).all())
+
+        # Saturday gets Friday's close.
+        provider = SyntheticProvider(seed=7)
+        friday = provider.bar(self.ticker, date(2021, 10, 22))
+        self.assertEqual(friday, provider.bar(self.ticker, date(2021, 10, 23)))
+
+    @override_settings(PRICE_PROVIDER="db")
+    def test_db(self):
+        d = date(2021, 10, 22)
+        DailyPrice.objects.create(ticker=self.ticker, d=d, c=150.0)
+        TBGDailyBar.objects.create(ticker=self.ticker, d=d, o=1, h=3, l=1, c=2, v=10, oi=0)
+        DailyPrice.objects.create(ticker=self.ticker, d=date(2021, 10, 25), c=151.0)
+
+        provider = DBProvider()
+        self.assertEqual((d, 1.0, 3.0, 1.0, 2.0, 10, 0), provider.bar(self.ticker, d))
+        self.assertEqual(151.0, provider.bar(self.ticker, date(2021, 10, 27))[4])
+        self.assertIsNone(provider.bar(self.ticker, date(2021, 10, 21)))
+
+        # Nothing is fetched or saved.
+        prices = get_prices_bulk([(self.ticker, date(2021, 10, 26))])
+        self.assertEqual(151.0, prices[(self.ticker, date(2021, 10, 26))])
+        self.assertFalse(DailyPrice.objects.filter(d=date(2021, 10, 26)).exists())
+
+
+class PriceWriterTests(TestCase):
+    def setUp(self):
+        market = Market.objects.create(symbol="STOCK", name="Equity")
+        self.ticker = Ticker.objects.create(ticker="AAPL", market=market)
+
+    def test_populate_is_rerunnable(self):
+        bars = HistoryStoreTests.bars(date(2021, 9, 27), date(2021, 11, 2))
+        with mock.patch("markets.providers.yahoo_history", return_value=bars):
+            # Month ends only, Sep 30 and Oct 29, 2021.
+            self.assertEqual(2, populate_historical_price_data(self.ticker))
+            bars["c"] = 2.5
+            self.assertEqual(2, populate_historical_price_data(self.ticker))
+
+        closes = DailyPrice.objects.filter(ticker=self.ticker).values_list("d", "c")
+        self.assertEqual({(date(2021, 9, 30), 2.5), (date(2021, 10, 29), 2.5)}, set(closes))
+
+    def test_save_daily_bars(self):
+        d = date(2021, 10, 22)
+        rows = [
+            (self.ticker, d, 1, 2, 0.5, 1.5, 10, 0),
+            (self.ticker.id, d, 1, 2, 0.5, 1.75, 20, 0),
+        ]
+        rows += [(self.ticker, d + timedelta(days=i), 1, 2, 0.5, 1.5, 10, 0) for i in range(1, 5)]
+        self.assertEqual(5, save_daily_bars(rows, chunk_size=2))
+        self.assertEqual(5, TBGDailyBar.objects.count())
+        self.assertEqual(1.75, TBGDailyBar.objects.get(d=d).c)
@@ -1,10 +1,13 @@
+from itertools import islice
+
+import numpy as np
 from cachetools.func import ttl_cache
-from django.conf import settings
+from django.db import transaction
 from django.urls import reverse
 from django.utils.safestring import mark_safe
-from datetime import date
+from datetime import date, timedelta
 from tbgutils.dt import y1_to_y4, is_lbd_of_month, most_recent_business_day
-from markets.tbgyahoo import yahooHistory, yahooQuote
+from markets.providers import YahooProvider, get_provider
 from markets.models import DailyPrice, TBGDailyBar
 from markets.models import Ticker, Market, NOT_FUTURES_EXCHANGES
 
@@ -34,78 +37,129 @@ def ticker_admin_url(request, ticker):
     return mark_safe(url)
 
 
-@ttl_cache(maxsize=1000, ttl=10)
 def get_yahoo_history(ticker):
     print(f"Getting yahoo history for {ticker}.")
     if isinstance(ticker, str):
         ticker = Ticker.objects.get(ticker=ticker)
-    return yahooHistory(ticker)
+    return YahooProvider().history(ticker)
 
 
-def populate_historical_price_data(ticker, d_i=None, d_f=None, lbd_f=True):
-    data = get_yahoo_history(ticker)
-    for d, o, h, l, c, v, oi in data:
-        if lbd_f and not is_lbd_of_month(d):
-            continue
-        if (d_i is not None) and (d < d_i):
-            continue
-        if (d_f is not None) and (d > d_f):
-            continue
-        DailyPrice.objects.create(ticker=ticker, d=d, c=c)
+# Rows per INSERT ... ON CONFLICT statement when writing prices.
+WRITE_CHUNK_SIZE = 2000
 
 
-def get_historical_bar(ticker, d):
-    print(f"Getting yahoo history for {ticker} on {d}.")
-    data = get_yahoo_history(ticker)
-    bar = next(filter(lambda x: x[0] >= d, data), None)
-    if bar:
-        if d == bar[0]:
-            return bar
+def upsert(model, objs, unique_fields, update_fields, chunk_size=WRITE_CHUNK_SIZE):
+    """
+    Insert objs, updating update_fields of rows that already exist, one
+    statement per chunk_size rows and all in one transaction.
+
+    objs may be any iterable, only one chunk is held in memory at a time.
+    Returns the number of rows written.
+    """
+    n = 0
+    objs = iter(objs)
+    key = [model._meta.get_field(f).attname for f in unique_fields]
+    with transaction.atomic():
+        while chunk := list(islice(objs, chunk_size)):
+            # A statement may not update the same row twice, last one wins.
+            chunk = list({tuple(getattr(o, k) for k in key): o for o in chunk}.values())
+            model.objects.bulk_create(
+                chunk,
+                update_conflicts=True,
+                unique_fields=unique_fields,
+                update_fields=update_fields,
+            )
+            n += len(chunk)
+    return n
+
+
+def ticker_id(ticker):
+    return ticker.id if isinstance(ticker, Ticker) else ticker
 
-        # Get last bar prior to d
-        i = data.index(bar)
-        if i >= 0:
-            return data[i - 1]
 
-        return None
+def save_daily_prices(rows, chunk_size=WRITE_CHUNK_SIZE):
+    """
+    Upsert DailyPrice rows given as (ticker, d, c) where ticker is a Ticker
+    or a ticker id.  Returns the number of rows written.
+    """
+    objs = (DailyPrice(ticker_id=ticker_id(t), d=d, c=c) for t, d, c in rows)
+    return upsert(DailyPrice, objs, ["ticker", "d"], ["c"], chunk_size)
 
-    return None
 
+def save_daily_bars(rows, chunk_size=WRITE_CHUNK_SIZE):
+    """
+    Upsert TBGDailyBar rows given as (ticker, d, o, h, l, c, v, oi) where
+    ticker is a Ticker or a ticker id.  Returns the number of rows written.
+    """
+    objs = (
+        TBGDailyBar(ticker_id=ticker_id(t), d=d, o=o, h=h, l=l, c=c, v=v, oi=oi)
+        for t, d, o, h, l, c, v, oi in rows
+    )
+    return upsert(TBGDailyBar, objs, ["ticker", "d"], ["o", "h", "l", "c", "v", "oi"], chunk_size)
+
+
+def populate_historical_price_data(ticker, d_i=None, d_f=None, lbd_f=True):
+    """
+    Save yahoo closes for ticker to DailyPrice, only month ends when lbd_f.
+    Existing prices are updated.  Returns the number of rows written.
+    """
+    bars = get_yahoo_history(ticker)
+    mask = np.ones(len(bars), dtype=bool)
+    if d_i is not None:
+        mask &= bars["d"] >= np.datetime64(d_i, "D")
+    if d_f is not None:
+        mask &= bars["d"] <= np.datetime64(d_f, "D")
+    dates = bars["d"][mask].astype(object)
+    closes = bars["c"][mask].tolist()
+    rows = ((ticker, d, c) for d, c in zip(dates, closes) if not lbd_f or is_lbd_of_month(d))
+    return save_daily_prices(rows)
 
-fixed_prices = {
-    "AAPL": 305.0,
-    "MSFT": 305.0,
-    "AMZN": 115.0,
-    "ESZ2021": 4300.0,
-    "MBXIX": 33.0,
-}
+
+def populate_historical_prices(ticker_ids):
+    """populate_historical_price_data for many tickers, as a job."""
+    tickers = Ticker.objects.filter(id__in=ticker_ids)
+    n = sum(populate_historical_price_data(ticker) for ticker in tickers)
+    return {"message": f"Saved {n} month end prices for {len(tickers)} tickers."}
+
+
+def get_historical_bar(ticker, d):
+    """
+    Return the yahoo bar for d, or the last one before d if there is no bar
+    on d.  None if the history does not reach d or starts after it.
+    """
+    print(f"Getting yahoo history for {ticker} on {d}.")
+    return YahooProvider().bar(ticker, d)
 
 
 @ttl_cache(maxsize=1000, ttl=10)
 def get_price(ticker, d=None):
     d = most_recent_business_day(d)
-
-    if not settings.USE_PRICE_FEED:
-        return fixed_prices.get(ticker.yahoo_ticker, 1.0)
+    provider = get_provider()
 
     if isinstance(ticker, str):
         ticker = Ticker.objects.get(ticker=ticker)
 
+    if provider.authoritative:
+        return provider.price(ticker, d)
+
     if ticker.fixed_price is None:
         if (d is None) or (d == date.today()):
-            p = yahooQuote(ticker)
+            p = provider.quote(ticker)
+            if p is None:
+                print(f"No quote for {ticker}")
+                p = 0.0
         else:
             if DailyPrice.objects.filter(ticker=ticker).filter(d=d).exists():
                 p = DailyPrice.objects.filter(ticker=ticker).filter(d=d).first()
                 p = p.c
             else:
-                bar = get_historical_bar(ticker, d)
+                bar = provider.bar(ticker, d)
                 if bar is None:
                     if TBGDailyBar.objects.filter(ticker=ticker, d=d).exists():
                         print(f"Bar exists in TBGDaily, saving to DailyPrice: {d} {ticker}")
                         tb = TBGDailyBar.objects.get(ticker=ticker, d=d)
                         p = tb.c
-                        DailyPrice.objects.create(ticker=ticker, d=d, c=p)
+                        save_daily_prices([(ticker, d, p)])
                     else:
                         print(f"Cannot find price in TBGDaily: {d} {ticker}")
                         print(
@@ -117,7 +171,8 @@ def get_price(ticker, d=None):
                     d_bar, o, h, l, c, v, oi = bar
                     if d_bar != d:
                         print(f"Using price found on {d_bar} for {d} for {ticker}")
-                    DailyPrice.objects.create(ticker=ticker, d=d, c=c)
+                    if provider.persist:
+                        save_daily_prices([(ticker, d, c)])
                     p = c
     else:
         p = ticker.fixed_price
@@ -126,6 +181,133 @@ def get_price(ticker, d=None):
     return p
 
 
+# How far before the earliest requested date to download yahoo bars so that
+# a date without a bar (holiday, halted contract) can use the prior close.
+BULK_LOOKBACK_DAYS = 10
+
+
+def get_prices_bulk(pairs):
+    """
+    Resolve closing prices for many (ticker, d) pairs at once.
+
+    One DailyPrice query, one TBGDailyBar query and one multi-ticker
+    download from the price provider for whatever is still missing.  Closes
+    found in TBGDailyBar or from the provider are saved to DailyPrice in one
+    bulk insert.  Today's prices come from a single provider quotes() call.
+
+    The answers differ from get_price() in two ways.  A TBGDailyBar close is
+    used before the provider's, get_price() asks the provider first.  The
+    provider close must be at most BULK_LOOKBACK_DAYS before d, get_price()
+    takes the last bar on or before d however old it is.
+
+    ticker may be a Ticker or a ticker symbol.
+    Returns {(ticker, d): price} keyed by the pairs as given.  Pairs that
+    cannot be priced map to 0.0, just like get_price.
+    """
+    pairs = list(dict.fromkeys(pairs))
+    if not pairs:
+        return {}
+
+    symbols = {t for t, _ in pairs if isinstance(t, str)}
+    by_symbol = {}
+    if symbols:
+        qs = Ticker.objects.filter(ticker__in=symbols).select_related("market")
+        by_symbol = {t.ticker: t for t in qs}
+
+    provider = get_provider()
+    result = {}
+    wanted = {}  # (ticker_id, d) -> keys of pairs asking for that close
+    quotes = {}  # ticker_id -> keys of pairs asking for today's price
+    tickers = {}
+    today = date.today()
+    for key in pairs:
+        ticker, d = key
+        if isinstance(ticker, str):
+            ticker = by_symbol.get(ticker)
+            if ticker is None:
+                print(f"Cannot find ticker {key[0]}")
+                result[key] = 0.0
+                continue
+
+        if provider.authoritative:
+            result[key] = provider.price(ticker, most_recent_business_day(d))
+            continue
+
+        if ticker.fixed_price is not None:
+            result[key] = ticker.fixed_price
+            continue
+
+        tickers[ticker.id] = ticker
+        d = most_recent_business_day(d)
+        if d == today:
+            quotes.setdefault(ticker.id, []).append(key)
+        else:
+            wanted.setdefault((ticker.id, d), []).append(key)
+
+    if quotes:
+        prices = provider.quotes([tickers[i] for i in quotes])
+        for ticker_id, keys in quotes.items():
+            p = prices.get(tickers[ticker_id].yahoo_ticker, 0.0)
+            for key in keys:
+                result[key] = p
+
+    found = {}
+    if wanted:
+        ids = {i for i, _ in wanted}
+        dates = {d for _, d in wanted}
+
+        qs = DailyPrice.objects.filter(ticker_id__in=ids, d__in=dates)
+        for ticker_id, d, c in qs.values_list("ticker_id", "d", "c"):
+            if (ticker_id, d) in wanted:
+                found[(ticker_id, d)] = c
+
+        new_prices = {}
+        provider_prices = {}
+        missing = set(wanted) - set(found)
+        if missing:
+            qs = TBGDailyBar.objects.filter(
+                ticker_id__in={i for i, _ in missing}, d__in={d for _, d in missing}
+            )
+            for ticker_id, d, c in qs.values_list("ticker_id", "d", "c"):
+                if (ticker_id, d) in missing:
+                    new_prices[(ticker_id, d)] = c
+            missing -= set(new_prices)
+
+        if missing:
+            d_i = min(d for _, d in missing) - timedelta(days=BULK_LOOKBACK_DAYS)
+            d_f = max(d for _, d in missing) + timedelta(days=1)
+            closes = provider.closes([tickers[i] for i in {i for i, _ in missing}], d_i, d_f)
+            for ticker_id, d in missing:
+                close = closes.get(tickers[ticker_id].yahoo_ticker)
+                if close is None:
+                    continue
+                close = close[close.index <= d]
+                if close.empty:
+                    continue
+                if close.index[-1] != d:
+                    print(
+                        f"Using price found on {close.index[-1]} for {d} for {tickers[ticker_id]}"
+                    )
+                provider_prices[(ticker_id, d)] = float(close.iloc[-1])
+
+        if provider.persist:
+            new_prices.update(provider_prices)
+        if new_prices:
+            save_daily_prices((i, d, c) for (i, d), c in new_prices.items())
+        found.update(new_prices)
+        found.update(provider_prices)
+
+        for k, keys in wanted.items():
+            p = found.get(k)
+            if p is None:
+                print(f"Cannot find price for {tickers[k[0]]} on {k[1]}")
+                p = 0.0
+            for key in keys:
+                result[key] = p
+
+    return result
+
+
 def add_ticker(t):
     if Ticker.objects.filter(ticker=t).exists():
         ticker = Ticker.objects.get(ticker=t)
@@ -139,10 +321,35 @@ def add_ticker(t):
     return ticker
 
 
-def ib_symbol2ticker(symbol):
+def ib_symbol_parts(symbol):
+    """Market symbol and ticker of an IB futures symbol like ESZ4."""
     symbol, mo, yr = symbol[:-2], symbol[-2:-1], symbol[-1:]
-    m = Market.objects.get(symbol=symbol)
     yr = y1_to_y4(yr)
-    ticker = f"{symbol}{mo}{yr}"
+    return symbol, f"{symbol}{mo}{yr}"
+
+
+def ib_symbol2ticker(symbol):
+    symbol, ticker = ib_symbol_parts(symbol)
+    m = Market.objects.get(symbol=symbol)
     ticker = Ticker.objects.get_or_create(ticker=ticker, market=m)
     return ticker[0]
+
+
+def ib_symbols2tickers(symbols):
+    """
+    Return {IB symbol: Ticker} like ib_symbol2ticker for many symbols with
+    one Market query, one Ticker query and one insert of the new tickers.
+    """
+    parts = {s: ib_symbol_parts(s) for s in set(symbols)}
+    tickers = Ticker.objects.filter(ticker__in={t for _, t in parts.values()})
+    tickers = {t.ticker: t for t in tickers.select_related("market")}
+
+    missing = {t: m for m, t in parts.values() if t not in tickers}
+    if missing:
+        markets = {m.symbol: m for m in Market.objects.filter(symbol__in=set(missing.values()))}
+        for m in set(missing.values()) - set(markets):
+            raise Market.DoesNotExist(f"Market {m} does not exist.")
+        new = [Ticker(ticker=t, market=markets[m]) for t, m in missing.items()]
+        tickers.update((t.ticker, t) for t in Ticker.objects.bulk_create(new))
+
+    return {s: tickers[t] for s, (_, t) in parts.items()}
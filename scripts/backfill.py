@@ -1,8 +1,8 @@
 import re
 from datetime import datetime, date
 from cachetools import cached
-from django.db import IntegrityError
-from markets.models import TBGDailyBar, Market, Ticker
+from markets.models import Market, Ticker
+from markets.utils import save_daily_bars
 from markets.tbgyahoo import yahooHistory
 
 
@@ -46,7 +46,8 @@ def get_ticker(ticker):
     return tbg_ticker2ticker(ticker)
 
 
-def insert(ti, d, o, h, l, c, v=0, oi=0):
+def parse_bar(ti, d, o, h, l, c, v=0, oi=0):
+    # Returns a row for save_daily_bars or None if there is no ticker for ti.
     if "-" in d:
         d = datetime.strptime(d, "%Y-%m-%d")
     elif "/" in d:
@@ -68,31 +69,30 @@ def insert(ti, d, o, h, l, c, v=0, oi=0):
 
     if ticker is None:
         print(f"No ticker for {ti}")
-    else:
-        try:
-            TBGDailyBar.objects.update_or_create(
-                ticker=ticker, d=d, defaults={"o": o, "h": h, "l": l, "c": c, "v": v, "oi": oi}
-            )
-        except IntegrityError as e:
-            print(e)
-            print(f"Could not add {ti} {d} {o} {h} {l} {c} {oi}")
+        return None
+
+    return ticker, d, o, h, l, c, v, oi
+
+
+def insert_bars(bars):
+    n = save_daily_bars(bar for bar in bars if bar is not None)
+    print(f"Saved {n} bars.")
+
+
+def insert(ti, d, o, h, l, c, v=0, oi=0):
+    insert_bars([parse_bar(ti, d, o, h, l, c, v, oi)])
 
 
 def process_line(line):
     id, d, o, h, l, c, v, oi, ti = line.strip().split(",")
-    insert(ti, d, o, h, l, c, v, oi)
+    return parse_bar(ti, d, o, h, l, c, v, oi)
 
 
 def do_csv():
     fn = "dailybars.csv"
-    fh = open(fn, "r")
-    l = fh.readline()
-    while True:
-        l = fh.readline()
-        if "" == l:
-            break
-        process_line(l)
-    fh.close()
+    with open(fn, "r") as fh:
+        fh.readline()
+        insert_bars(process_line(line) for line in fh)
 
 
 def do_txt():
@@ -178,6 +178,7 @@ def do_txt():
     USO210115C2             20200430 0.710
     """
 
+    bars = []
     for line in txt.split("\n"):
         line = line.strip()
         if not line:
@@ -190,11 +191,13 @@ def do_txt():
         else:
             ti, d, o, h, l, c = items
         print(f"{ti} {d} {o} {h} {l} {c}")
-        insert(ti, d, o, h, l, c)
+        bars.append(parse_bar(ti, d, o, h, l, c))
+    insert_bars(bars)
 
 
 def do_investing_com(ticker):
     fn = f"/Users/ms/Downloads/{ticker}.csv"
+    bars = []
     with open(fn, "r") as fh:
         l = fh.readline()
         while len(l):
@@ -209,7 +212,8 @@ def do_investing_com(ticker):
             except ValueError as e:
                 print(e)
 
-            insert(ticker, d, o, h, l, c)
+            bars.append(parse_bar(ticker, d, o, h, l, c))
+    insert_bars(bars)
 
 
 # May 16, 2019 - July 10, 2019
@@ -3,7 +3,7 @@ from django.db import transaction
 from tbgutils.dt import dt2dt
 from accounts.models import Account
 from markets.models import Market, Ticker
-from trades.models import Trade
+from trades.batch import TradeBatch
 
 account = Account.objects.get(name="FUTURES")
 
@@ -27,32 +27,32 @@ def add_trades():
     with open(fn) as fh:
         lines = fh.readlines()
 
-    for line in lines:
-        line = line.replace('"', "")
-        line = line.replace("'", "")
-        id, cash_account, d, t, reinv_f, q, p, c, c_f, note, a, ticker = line.split(",")
-        dt = f"{d} {t}"
+    with TradeBatch() as batch:
+        for line in lines:
+            line = line.replace('"', "")
+            line = line.replace("'", "")
+            id, cash_account, d, t, reinv_f, q, p, c, c_f, note, a, ticker = line.split(",")
+            dt = f"{d} {t}"
 
-        dt = dt2dt(dt)
-        q = float(q)
-        p = float(p)
-        c = float(c)
+            dt = dt2dt(dt)
+            q = float(q)
+            p = float(p)
+            c = float(c)
 
-        t, exchange = ticker.split(".")
-        t = t[:-2] + "20" + t[-2:]
+            t, exchange = ticker.split(".")
+            t = t[:-2] + "20" + t[-2:]
 
-        print(f"{t} {dt} {q} {p} {c}")
+            print(f"{t} {dt} {q} {p} {c}")
 
-        try:
-            ticker = Ticker.objects.get(ticker=t)
-        except Ticker.DoesNotExist:
-            market = get_market(t[:-5])
-            print(f"Creating ticker {t}.")
-            ticker = Ticker(ticker=t, market=market)
-            ticker.save()
+            try:
+                ticker = Ticker.objects.get(ticker=t)
+            except Ticker.DoesNotExist:
+                market = get_market(t[:-5])
+                print(f"Creating ticker {t}.")
+                ticker = Ticker(ticker=t, market=market)
+                ticker.save()
 
-        trade = Trade(dt=dt, account=account, ticker=ticker, q=q, p=p, commission=c, note=note)
-        trade.save()
+            batch.create(dt=dt, account=account, ticker=ticker, q=q, p=p, commission=c, note=note)
 
 
 add_trades()
@@ -1,8 +1,10 @@
 import re
 from django.db import transaction
 from tbgutils.dt import yyyymmdd2dt
+from accounts.batch import CashBatch
 from accounts.models import Account, CashRecord
 from markets.models import Market, Ticker
+from trades.batch import TradeBatch
 from trades.models import Trade
 from markets.utils import add_ticker
 
@@ -113,24 +115,25 @@ def cash_balance(account):
 
 def fix_none_accounts(none_accounts):
     # These accounts had no associated cash accounts.
-    for a in none_accounts.keys():
-        balance = cash_balance(a)
-        a = get_account(a)
-        description = "Stub to close account because there never was this cash account."
-        CashRecord(
-            account=a,
-            d=none_accounts[a.name].date(),
-            description=description,
-            category=CashRecord.DE,
-            amt=-balance,
-        ).save()
+    with CashBatch() as batch:
+        for a in none_accounts.keys():
+            balance = cash_balance(a)
+            a = get_account(a)
+            description = "Stub to close account because there never was this cash account."
+            batch.create(
+                account=a,
+                d=none_accounts[a.name].date(),
+                description=description,
+                category=CashRecord.DE,
+                amt=-balance,
+            )
 
 
 @transaction.atomic
 def add_trades():
     fn = "/Users/ms/data/trades.dat"
     none_accounts = {}
-    with open(fn) as fh:
+    with open(fn) as fh, TradeBatch() as trades, CashBatch() as cash:
         lines = fh.readlines()
         for line in lines:
             line = re.sub(r"\!.*\n", r"\n", line)
@@ -161,7 +164,7 @@ def add_trades():
                 c = float(c)
 
             if t.lower() == "cash":
-                CashRecord(account=a, d=dt.date(), description=note, amt=q).save()
+                cash.create(account=a, d=dt.date(), description=note, amt=q)
                 continue
 
             if ca.lower() == "none" and not r_f:
@@ -170,16 +173,16 @@ def add_trades():
                     x = q * p + c
                 else:
                     x = -q * p + c
-                CashRecord(
+                cash.create(
                     account=a,
                     d=dt.date(),
                     description=description,
                     category=CashRecord.DE,
                     amt=x,
-                ).save()
+                )
 
             t = add_ticker(t)
-            trade = Trade(
+            trades.create(
                 dt=dt,
                 account=a,
                 ticker=t,
@@ -189,15 +192,15 @@ def add_trades():
                 commission=c,
                 note=note,
             )
-            trade.save()
 
+    # cash_balance() reads the trades and records written by the batches.
     fix_none_accounts(none_accounts)
 
 
 def bofa():
     a = get_account("BofA")
     fn = "/Users/ms/data/bofa.csv"
-    with open(fn) as fh:
+    with open(fn) as fh, CashBatch() as batch:
         lines = fh.readlines()
         for line in lines:
             line = re.sub(r"\!.*\n", r"\n", line)
@@ -213,14 +216,14 @@ def bofa():
             dt = yyyymmdd2dt(d)
             amt = float(amount)
 
-            CashRecord(
+            batch.create(
                 account=a,
                 d=dt.date(),
                 description=description,
                 category=category,
                 amt=amt,
                 cleared_f=cleared_f,
-            ).save()
+            )
 
 
 @transaction.atomic()
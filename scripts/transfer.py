@@ -2,9 +2,11 @@
 
 from datetime import datetime
 from tbgutils.dt import set_tz
-from trades.models import Trade, get_trades_df
+from trades.batch import TradeBatch
+from trades.models import copy_trades_df
 from markets.models import Ticker, DailyPrice
-from accounts.models import Account, CashRecord
+from accounts.batch import CashBatch
+from accounts.models import Account
 from trades.utils import open_position_pnl
 from analytics.pnl import pnl
 
@@ -13,13 +15,12 @@ def transfer_cash_balance(d, a_from, a_to):
     *_, cash = pnl(d=d, a=a_from)
     print(float(cash))
 
-    rec = CashRecord(account=a_from, d=d, description=note, amt=-cash)
-    print(f"Cash: {rec}")
-    rec.save()
+    with CashBatch() as batch:
+        rec = batch.create(account=a_from, d=d, description=note, amt=-cash)
+        print(f"Cash: {rec}")
 
-    rec = CashRecord(account=a_to, d=d, description=note, amt=cash)
-    print(f"Cash: {rec}")
-    rec.save()
+        rec = batch.create(account=a_to, d=d, description=note, amt=cash)
+        print(f"Cash: {rec}")
 
 
 # Inputs
@@ -33,11 +34,11 @@ a_to = Account.objects.get(name=to_account)
 note = f"Transfer from {from_account} to {to_account}."
 
 # Get prices
-qs = DailyPrice.objects.filter(d=d).all()
-prices = {i.ticker.ticker: i.c for i in qs}
+qs = DailyPrice.objects.filter(d=d).values_list("ticker__ticker", "c")
+prices = dict(qs)
 
 # Get open positions not incluing cash
-df = get_trades_df(a=from_account)
+df = copy_trades_df(a=from_account)
 df = open_position_pnl(df)
 positions = [(row["t"], row["position"]) for index, row in df.iterrows()]
 
@@ -46,27 +47,25 @@ positions = [(row["t"], row["position"]) for index, row in df.iterrows()]
 
 transfer_cash_balance(d, a_from, a_to)
 
-for ticker, pos in positions:
-    p = prices[ticker]
-    ticker = Ticker.objects.get(ticker=ticker)
-    print(ticker, pos, p)
+tickers = Ticker.objects.in_bulk([ticker for ticker, _ in positions], field_name="ticker")
+with TradeBatch() as trades, CashBatch() as cash:
+    for ticker, pos in positions:
+        p = prices[ticker]
+        ticker = tickers[ticker]
+        print(ticker, pos, p)
 
-    rec = Trade(dt=t, account=a_to, ticker=ticker, q=pos, p=p, note=note)
-    print(f"Trade: {rec}")
-    rec.save()
+        rec = trades.create(dt=t, account=a_to, ticker=ticker, q=pos, p=p, note=note)
+        print(f"Trade: {rec}")
 
-    rec = Trade(dt=t, account=a_from, ticker=ticker, q=-pos, p=p, note=note)
-    print(f"Trade: {rec}")
-    rec.save()
+        rec = trades.create(dt=t, account=a_from, ticker=ticker, q=-pos, p=p, note=note)
+        print(f"Trade: {rec}")
 
-    cash_note = f"Transfer {ticker.ticker} to {to_account}"
-    rec = CashRecord(account=a_from, d=d, description=cash_note, amt=-pos * p)
-    print(f"Cash: {rec}")
-    rec.save()
+        cash_note = f"Transfer {ticker.ticker} to {to_account}"
+        rec = cash.create(account=a_from, d=d, description=cash_note, amt=-pos * p)
+        print(f"Cash: {rec}")
 
-    cash_note = f"Transfer {ticker.ticker} from {from_account}"
-    rec = CashRecord(account=a_to, d=d, description=cash_note, amt=pos * p)
-    print(f"Cash: {rec}")
-    rec.save()
+        cash_note = f"Transfer {ticker.ticker} from {from_account}"
+        rec = cash.create(account=a_to, d=d, description=cash_note, amt=pos * p)
+        print(f"Cash: {rec}")
 
 transfer_cash_balance(d, a_from, a_to)
@@ -5,7 +5,8 @@ from django.contrib import messages
 from tbgutils.dt import our_now, day_start, prior_business_day
 from markets.models import NOT_FUTURES_EXCHANGES
 from accounts.models import Account
-from trades.models import Trade
+from trades.models import LotClose, TaxLot, Trade
+from trades.batch import TradeBatch
 from trades.ib_flex import get_trades, lbd
 from trades.utils import trades_pnl
 
@@ -122,18 +123,18 @@ class SplitsFilter(SimpleListFilter):
 
 def duplicate_record(modeladmin, request, qs):
     t = our_now()
-    for rec in qs:
-        new_rec = Trade(
-            dt=t,
-            account=rec.account,
-            ticker=rec.ticker,
-            reinvest=rec.reinvest,
-            q=rec.q,
-            p=rec.p,
-            commission=rec.commission,
-            note=rec.note,
-        )
-        new_rec.save()
+    with TradeBatch() as batch:
+        for rec in qs:
+            batch.create(
+                dt=t,
+                account=rec.account,
+                ticker=rec.ticker,
+                reinvest=rec.reinvest,
+                q=rec.q,
+                p=rec.p,
+                commission=rec.commission,
+                note=rec.note,
+            )
 
 
 def sum_commissions(modeladmin, request, qs):
@@ -187,3 +188,37 @@ class TradeAdmin(admin.ModelAdmin):
 
     class Media:
         js = ("js/trade_admin.js",)
+
+
+class LotCloseInline(admin.TabularInline):
+    model = LotClose
+    fk_name = "lot"
+    fields = ("dt", "q", "p", "basis_p", "realized", "trade")
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(TaxLot)
+class TaxLotAdmin(admin.ModelAdmin):
+    """Read only, the lots are written by trades.lots from the trades."""
+
+    date_hierarchy = "dt"
+    list_display = ("dt", "account", "ticker", "q", "p", "open_q", "open_p")
+    list_filter = (TradesAccountFilter,)
+    search_fields = ("account__name", "ticker__ticker")
+    ordering = ("account", "ticker", "-dt")
+    readonly_fields = ("account", "ticker", "trade", "dt", "q", "p", "open_q", "open_p")
+    inlines = [LotCloseInline]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
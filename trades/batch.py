@@ -0,0 +1,90 @@
+"""
+Write many trades with a few queries.
+
+    with TradeBatch() as batch:
+        batch.create(account=a, ticker=t, dt=dt, q=q, p=p)
+        batch.update(trade, q=q)
+
+Trades are collected in the with block and written when it exits, with one
+bulk_create and one bulk_update in a transaction.  Trade.save() is not
+called: a commission left None gets the default Trade.save() would give it
+from the market commissions read in one query, a negative commission is
+made positive, and the trade frames and positions are refreshed once by
+trades_written().  Nothing is written if the block raises.
+"""
+
+from django.db import transaction
+from django.utils import timezone
+
+from markets.models import Ticker
+from trades.models import Trade
+from trades.positions import trades_written
+
+
+class TradeBatch:
+    def __init__(self):
+        self.created = []
+        self.updated = {}  # id -> trade
+        self.fields = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.write()
+
+    def create(self, trade=None, **kwargs):
+        """Add trade, or a new Trade(**kwargs).  Returns the trade."""
+        if trade is None:
+            trade = Trade(**kwargs)
+        self.created.append(trade)
+        return trade
+
+    def update(self, trade, **kwargs):
+        """
+        Set the fields in kwargs of trade and save them.  trade may be one
+        added by create().
+        """
+        for field, value in kwargs.items():
+            setattr(trade, field, value)
+        if trade.pk is not None:
+            self.fields.update(kwargs)
+            self.updated[trade.pk] = trade
+        return trade
+
+    def set_commissions(self, trades):
+        missing = [t for t in trades if t.commission is None]
+        if missing:
+            qs = Ticker.objects.filter(id__in={t.ticker_id for t in missing})
+            commissions = dict(qs.values_list("id", "market__commission"))
+            for t in missing:
+                t.commission = abs(float(t.q) * commissions[t.ticker_id])
+        for t in trades:
+            if t.commission < 0:
+                t.commission = -t.commission
+
+    def write(self):
+        trades = self.created + list(self.updated.values())
+        if not trades:
+            return
+
+        self.set_commissions(trades)
+        now = timezone.now()
+        for t in trades:
+            t.modified = now
+
+        # Updated trades may have moved to another pair or day.
+        before = Trade.objects.filter(pk__in=self.updated)
+        before = list(before.values_list("account_id", "ticker_id", "dt"))
+
+        fields = sorted(self.fields | {"modified"})
+        with transaction.atomic():
+            Trade.objects.bulk_create(self.created)
+            if self.updated:
+                Trade.objects.bulk_update(self.updated.values(), fields)
+            trades_written(trades, before)
+
+        self.created = []
+        self.updated = {}
+        self.fields = set()
@@ -4,14 +4,15 @@ from django.conf import settings
 from tbgutils.dt import dt2dt, set_tz
 from accounts.models import Account
 from trades.models import Trade
-from markets.utils import ib_symbol2ticker
+from trades.batch import TradeBatch
+from markets.utils import ib_symbols2tickers
 
 daily = "905409"
 lbd = "905414"
 last30days = "905412"
 
 
-def get_trades(report_id=daily):
+def get_trades(report_id=daily, path=None):
     # eventkit (ib_insync dependency) expects a main-thread event loop at import time
     # on newer Python versions. Ensure one exists before importing ib_insync.
     try:
@@ -40,7 +41,11 @@ def get_trades(report_id=daily):
     data = []
 
     try:
-        report = FlexReport(settings.IB_FLEX_TOKEN, report_id)
+        if path is None:
+            report = FlexReport(settings.IB_FLEX_TOKEN, report_id)
+        else:
+            # A saved Flex XML file, for tests and reruns.
+            report = FlexReport(path=path)
     except FlexError as e:
         msg = str(e)
         data.append([msg, "", "", "", ""])
@@ -50,35 +55,9 @@ def get_trades(report_id=daily):
     # print(report.topics())
     # {'TradeConfirm', 'FlexQueryResponse', 'FlexStatements', 'FlexStatement'}
 
-    trades = report.extract("TradeConfirm")
+    confirms = report.extract("TradeConfirm")
     account = Account.objects.get(name=settings.IB_DEFAULT_ACCOUNT)
-    for i in trades:
-        t = dt2dt(i.dateTime)
-        ticker = ib_symbol2ticker(i.symbol)
-
-        # do not need to scale i.price by tickers.ib_price_factor,
-        # flex already converted it to dollars.
-        p = i.price
-        q = i.quantity
-        try:
-            trade = Trade.objects.get(trade_id=i.tradeID)
-            trade.dt = t
-            trade.ticker = ticker
-            trade.q = q
-            trade.p = p
-            trade.commission = -i.commission
-        except Trade.DoesNotExist:
-            trade = Trade(
-                dt=t,
-                account=account,
-                ticker=ticker,
-                q=q,
-                p=p,
-                commission=i.commission,
-                trade_id=i.tradeID,
-            )
-        trade.save()
-
+    for trade in save_trade_confirms(confirms, account):
         data.append(
             [
                 set_tz(trade.dt).strftime("%Y%m%d %H:%M:%S"),
@@ -90,3 +69,48 @@ def get_trades(report_id=daily):
         )
 
     return headings, data, formats
+
+
+def save_trade_confirms(confirms, account):
+    """
+    Create or update the Trade of each TradeConfirm, matched by tradeID.
+
+    New trades go to account.  One query finds the existing trades and one
+    ib_symbols2tickers() call all tickers, then everything is written by a
+    TradeBatch.
+
+    Returns the trades in the order of confirms.
+    """
+    confirms = list(confirms)
+    tickers = ib_symbols2tickers(i.symbol for i in confirms)
+    existing = Trade.objects.filter(trade_id__in={i.tradeID for i in confirms})
+    existing = {trade.trade_id: trade for trade in existing}
+
+    result = []
+    new = {}
+    with TradeBatch() as batch:
+        for i in confirms:
+            # do not need to scale i.price by tickers.ib_price_factor,
+            # flex already converted it to dollars.
+            # IB reports commissions as negative numbers, TradeBatch stores them positive.
+            trade = existing.get(i.tradeID) or new.get(i.tradeID)
+            if trade is None:
+                trade = new[i.tradeID] = batch.create(account=account, trade_id=i.tradeID)
+            batch.update(
+                trade,
+                dt=dt2dt(i.dateTime),
+                ticker=tickers[i.symbol],
+                q=i.quantity,
+                p=i.price,
+                commission=i.commission,
+            )
+            result.append(trade)
+
+    return result
+
+
+def get_trades_job(report_id=daily):
+    """get_trades for the jobs runner, the table as JSON for the job page."""
+    headings, data, formats = get_trades(report_id=report_id)
+    data = [[str(i) for i in row] for row in data]
+    return {"headings": headings, "data": data, "formats": formats}
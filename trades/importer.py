@@ -0,0 +1,256 @@
+"""
+Bulk import of trades from CSV, for moving a history over from another
+broker.
+
+The file is read chunk_size rows at a time so only one chunk is in memory.
+Each chunk is checked with column operations, accounts and tickers come
+from maps filled with one query for the symbols not seen before, and the
+trades are written with bulk_create in a transaction per chunk.  Trade.save()
+and the Trade signals are not run, the trade frames are marked out of date
+with each chunk and the positions of the pairs traded are refreshed once at
+the end.
+
+The file has a header row naming its columns:
+
+    dt          ISO date-time, local time unless it has a UTC offset
+    account     Account name, may be left out for a default account
+    ticker      Ticker symbol
+    q, p        quantity and price
+    commission  optional, abs(q) times the market commission when empty
+    note        optional
+    trade_id    optional
+    reinvest    optional, true/false
+    market      optional, missing tickers are created in this market
+"""
+
+import time
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+
+from accounts.models import Account
+from markets.models import Market, Ticker
+from trades.models import Trade, trades_changed
+from trades.positions import add_change, refresh_positions
+
+CHUNK_SIZE = 5000
+
+REQUIRED_COLUMNS = ["dt", "ticker", "q", "p"]
+
+# Trade.q, p and commission have 10 digits before the decimal point.
+MAX_VALUE = 1e10
+
+TRUE_STRINGS = {"1", "t", "true", "y", "yes"}
+FALSE_STRINGS = {"", "0", "f", "false", "n", "no"}
+
+
+class TradeImportError(Exception):
+    pass
+
+
+def column(chunk, name):
+    """Stripped strings of a column, empty ones if the file does not have it."""
+    if name in chunk:
+        return chunk[name].str.strip()
+    return pd.Series("", index=chunk.index, dtype=str)
+
+
+def parse_dt(s):
+    """
+    UTC datetimes of a Series of ISO strings, NaT where they do not parse.
+    Strings without a UTC offset are in settings.TIME_ZONE.
+    """
+    s = s.str.strip()
+    aware = s.str.contains(r"(?:Z|[+-]\d\d:?\d\d)$", regex=True)
+    dt = pd.Series(pd.NaT, index=s.index, dtype="datetime64[us, UTC]")
+    if aware.any():
+        dt[aware] = pd.to_datetime(s[aware], errors="coerce", format="ISO8601", utc=True)
+    if not aware.all():
+        naive = pd.to_datetime(s[~aware], errors="coerce", format="ISO8601")
+        naive = naive.dt.tz_localize(settings.TIME_ZONE, ambiguous="NaT", nonexistent="NaT")
+        dt[~aware] = naive.dt.tz_convert("UTC")
+    return dt
+
+
+class TradeImporter:
+    """
+    Import chunks of CSV rows, see import_csv().  Bad rows raise
+    TradeImportError before their chunk is written, or are skipped with
+    skip_invalid.  With dry_run nothing is written and every bad row is
+    reported.
+    """
+
+    def __init__(self, default_account=None, dry_run=False, skip_invalid=False):
+        self.accounts = dict(Account.objects.values_list("name", "id"))
+        if default_account is not None and default_account not in self.accounts:
+            raise TradeImportError(f"Account {default_account} does not exist.")
+        self.default_account = default_account
+        self.dry_run = dry_run
+        self.skip_invalid = skip_invalid
+
+        self.tickers = {}  # symbol -> (ticker id, market commission)
+        self.new_tickers = set()
+        self.changes = {}  # (account id, ticker id) -> earliest dt written
+        self.errors = []
+        self.n_read = 0
+        self.n_written = 0
+
+    def resolve_tickers(self, symbols, markets):
+        """
+        Add the symbols not seen yet to self.tickers.  Missing tickers with a
+        market are created, unless dry_run.
+        """
+        symbols = set(symbols) - set(self.tickers) - self.new_tickers
+        if not symbols:
+            return
+
+        qs = Ticker.objects.filter(ticker__in=symbols).values_list(
+            "ticker", "id", "market__commission"
+        )
+        self.tickers.update((t, (i, c)) for t, i, c in qs)
+
+        missing = {t: markets.get(t) for t in symbols if t not in self.tickers}
+        missing = {t: m for t, m in missing.items() if m}
+        if not missing:
+            return
+
+        qs = Market.objects.filter(symbol__in=set(missing.values()))
+        by_symbol = {m.symbol: m for m in qs}
+        new = [Ticker(ticker=t, market=by_symbol[m]) for t, m in missing.items() if m in by_symbol]
+        if self.dry_run:
+            self.new_tickers.update(t.ticker for t in new)
+            return
+        for t in Ticker.objects.bulk_create(new):
+            self.tickers[t.ticker] = (t.id, t.market.commission)
+        self.new_tickers.update(t.ticker for t in new)
+
+    def check(self, chunk, first_line):
+        """
+        Return the good rows of chunk with their account id, ticker id, UTC dt
+        and commission.  Bad rows are added to self.errors.
+        """
+        df = pd.DataFrame(index=chunk.index)
+        problems = {}
+
+        df["dt"] = parse_dt(chunk["dt"])
+        problems["bad dt"] = df["dt"].isna()
+
+        for c in ("q", "p", "commission"):
+            text = column(chunk, c)
+            df[c] = text
+            v = pd.to_numeric(text, errors="coerce")
+            df[f"{c}_f"] = v
+            empty = text == ""
+            bad = v.isna() & ~(empty & (c == "commission"))
+            problems[f"bad {c}"] = bad
+            problems[f"{c} out of range"] = v.abs() >= MAX_VALUE
+        problems["q is zero"] = df["q_f"] == 0
+        problems["negative p"] = df["p_f"] < 0
+
+        if "account" in chunk:
+            account = column(chunk, "account")
+            if self.default_account is not None:
+                account = account.mask(account == "", self.default_account)
+        elif self.default_account is not None:
+            account = pd.Series(self.default_account, index=chunk.index)
+        else:
+            raise TradeImportError("There is no account column and no default account.")
+        df["account_id"] = account.map(self.accounts)
+        problems["unknown account"] = df["account_id"].isna()
+
+        symbols = column(chunk, "ticker")
+        markets = dict(zip(symbols, column(chunk, "market")))
+        self.resolve_tickers(symbols.unique(), markets)
+        tickers = symbols.map(self.tickers)
+        df["ticker_id"] = tickers.str[0]
+        df["market_commission"] = tickers.str[1]
+        problems["unknown ticker"] = df["ticker_id"].isna() & ~symbols.isin(self.new_tickers)
+
+        df["note"] = column(chunk, "note")
+        trade_id = column(chunk, "trade_id")
+        v = pd.to_numeric(trade_id, errors="coerce")
+        df["trade_id"] = v.where(v % 1 == 0).astype("Int64")
+        problems["bad trade_id"] = df["trade_id"].isna() & (trade_id != "")
+        reinvest = column(chunk, "reinvest").str.lower()
+        df["reinvest"] = reinvest.isin(TRUE_STRINGS)
+        problems["bad reinvest"] = ~reinvest.isin(TRUE_STRINGS | FALSE_STRINGS)
+
+        problems = pd.DataFrame(problems).fillna(False).astype(bool)
+        bad = problems.any(axis=1).to_numpy()
+        if bad.any():
+            problems = problems[bad]
+            reasons = (problems.astype(object) @ (problems.columns + ", ")).str[:-2]
+            # The header is line 1.
+            lines = first_line + 1 + np.flatnonzero(bad)
+            self.errors.extend(f"line {n}: {r}" for n, r in zip(lines, reasons))
+
+        if bad.any() and not (self.skip_invalid or self.dry_run):
+            raise TradeImportError(
+                f"{bad.sum()} bad rows, the first is {self.errors[-bad.sum()]}.  "
+                f"{self.n_written} trades were imported before it."
+            )
+
+        return df[~bad]
+
+    def trades(self, df):
+        default = (df["q_f"].abs() * df["market_commission"]).round(10)
+        for row, d in zip(df.itertuples(index=False), default):
+            yield Trade(
+                dt=row.dt.to_pydatetime(),
+                account_id=int(row.account_id),
+                ticker_id=int(row.ticker_id),
+                q=Decimal(row.q),
+                p=Decimal(row.p),
+                commission=Decimal(row.commission or str(d)).copy_abs(),
+                note=row.note or None,
+                trade_id=None if pd.isna(row.trade_id) else int(row.trade_id),
+                reinvest=row.reinvest,
+            )
+
+    def write(self, df):
+        if df.empty:
+            return
+        with transaction.atomic():
+            Trade.objects.bulk_create(self.trades(df), batch_size=1000)
+            trades_changed()
+        self.n_written += len(df)
+
+        first = df.groupby(["account_id", "ticker_id"])["dt"].min()
+        for (account_id, ticker_id), dt in first.items():
+            add_change(self.changes, (int(account_id), int(ticker_id)), dt.to_pydatetime())
+
+    def import_csv(self, f, chunk_size=CHUNK_SIZE, progress=None):
+        """
+        Import the trades of f, a path or file object.  progress, if given, is
+        called with the importer after each chunk.  Returns the number of
+        trades written, or that would be with dry_run.
+        """
+        start = time.monotonic()
+        reader = pd.read_csv(
+            f, dtype=str, keep_default_na=False, chunksize=chunk_size, skipinitialspace=True
+        )
+        try:
+            for chunk in reader:
+                missing = set(REQUIRED_COLUMNS) - set(chunk.columns)
+                if missing:
+                    raise TradeImportError(f"Missing columns: {', '.join(sorted(missing))}.")
+
+                df = self.check(chunk, first_line=self.n_read + 1)
+                self.n_read += len(chunk)
+                if self.dry_run:
+                    self.n_written += len(df)
+                else:
+                    self.write(df)
+                self.elapsed = time.monotonic() - start
+                if progress is not None:
+                    progress(self)
+        finally:
+            # Also for the chunks written before an error.
+            if self.changes:
+                refresh_positions(self.changes)
+
+        self.elapsed = time.monotonic() - start
+        return self.n_written
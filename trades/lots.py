@@ -0,0 +1,190 @@
+"""
+Tax lots and the closes against them, kept in the TaxLot and LotClose tables.
+
+Every trade that adds to a position opens a lot, and a trade that reduces it
+closes lots FIFO.  Each close records the quantity, its price, the split
+adjusted price of the lot and the realized gain, so the gains of a year are
+one sum over the closes of that year.
+
+The ledger is always FIFO, like moneycounter's realized_gains() the gains
+page used before it.  settings.FIFO only picks the matching of the position
+snapshots and the PnL pages, which then differ from the ledger in the
+realized gain of pairs that were partly closed.
+
+trades.positions.refresh_positions() rewrites the lots and closes of a pair
+from the dt of a change on, together with its snapshots.  The positions
+management command builds all of them, it has to be run once after
+migrating to 0011.
+"""
+
+from collections import deque
+from datetime import date
+
+import pandas as pd
+from django.db.models import Sum
+from tbgutils.dt import day_start, day_start_next_day
+from tbgutils.str import is_near_zero
+
+from markets.models import NOT_FUTURES_EXCHANGES
+from trades.models import LotClose, TaxLot
+
+# Trades at a price this low are splits, like moneycounter.
+SPLIT_PRICE = 1e-10
+
+
+def match_lots(pair, trades, fifo=True):
+    """
+    TaxLots and LotCloses of one pair from its trades, a DataFrame of id, dt,
+    q, p and cs in time order.  Returns ({trade id: TaxLot}, [LotClose]), not
+    saved.  fifo=False closes the latest lots first, the ledger does not.
+    """
+    account_id, ticker_id = pair
+    cs = float(trades["cs"].iloc[0])
+    lots = {}
+    open_lots = deque()
+    closes = []
+    position = 0.0
+    for trade_id, dt, q, p in zip(trades["id"], trades["dt"], trades["q"], trades["p"]):
+        q, p, dt = float(q), float(p), dt.to_pydatetime()
+        if p <= SPLIT_PRICE:
+            if not is_near_zero(position):
+                factor = (position + q) / position
+                for lot in open_lots:
+                    lot.open_q *= factor
+                    lot.open_p /= factor
+        elif is_near_zero(position) or (q > 0) == (position > 0):
+            lot = TaxLot(account_id=account_id, ticker_id=ticker_id, trade_id=trade_id, dt=dt)
+            lot.q = lot.open_q = q
+            lot.p = lot.open_p = p
+            lots[trade_id] = lot
+            open_lots.append(lot)
+        else:
+            left = q
+            while open_lots and not is_near_zero(left):
+                lot = open_lots[0] if fifo else open_lots[-1]
+                if abs(lot.open_q) > abs(left):
+                    closed = -left
+                else:
+                    closed = lot.open_q
+                    if fifo:
+                        open_lots.popleft()
+                    else:
+                        open_lots.pop()
+                lot.open_q -= closed
+                left += closed
+                closes.append(
+                    LotClose(
+                        lot=lot,
+                        trade_id=trade_id,
+                        dt=dt,
+                        q=closed,
+                        p=p,
+                        basis_p=lot.open_p,
+                        realized=cs * closed * (p - lot.open_p),
+                    )
+                )
+            if not is_near_zero(left):
+                lot = TaxLot(account_id=account_id, ticker_id=ticker_id, trade_id=trade_id, dt=dt)
+                lot.q = lot.open_q = left
+                lot.p = lot.open_p = p
+                lots[trade_id] = lot
+                open_lots.append(lot)
+
+        position += q
+        if is_near_zero(position):
+            # What is left is rounding.
+            for lot in open_lots:
+                lot.open_q = 0.0
+            open_lots.clear()
+
+    return lots, closes
+
+
+def refresh_lots(pair, trades, dt=None):
+    """
+    Rewrite the lots and closes of pair from dt on, all of them if dt is
+    None.  trades are all the trades of the pair as for match_lots(), None
+    if it has none.
+    """
+    account_id, ticker_id = pair
+    stale_lots = TaxLot.objects.filter(account_id=account_id, ticker_id=ticker_id)
+    stale_closes = LotClose.objects.filter(lot__account_id=account_id, lot__ticker_id=ticker_id)
+    if dt is not None:
+        stale_lots = stale_lots.filter(dt__gte=dt)
+        stale_closes = stale_closes.filter(dt__gte=dt)
+    stale_closes.delete()
+    stale_lots.delete()
+    if trades is None:
+        return
+
+    lots, closes = match_lots(pair, trades)
+    if dt is not None:
+        # Lots opened before dt are kept, closes after it change what is open.
+        kept = TaxLot.objects.filter(account_id=account_id, ticker_id=ticker_id, dt__lt=dt)
+        changed = []
+        for pk, trade_id, open_q, open_p in kept.values_list("id", "trade_id", "open_q", "open_p"):
+            lot = lots.pop(trade_id)
+            lot.pk = pk
+            if (lot.open_q, lot.open_p) != (open_q, open_p):
+                changed.append(lot)
+        TaxLot.objects.bulk_update(changed, ["open_q", "open_p"])
+        closes = [c for c in closes if c.dt >= dt]
+
+    TaxLot.objects.bulk_create(lots.values())
+    LotClose.objects.bulk_create(closes)
+
+
+def equity_realized_gains(year, active_f=True):
+    """
+    DataFrame of a, t and realized, the gains of the non-qualified equity
+    lots closed in year, from one aggregate query.
+    """
+    qs = LotClose.objects.filter(
+        dt__gte=day_start(date(year, 1, 1)),
+        dt__lt=day_start_next_day(date(year, 12, 31)),
+        lot__account__qualified_f=False,
+        lot__ticker__market__ib_exchange__in=NOT_FUTURES_EXCHANGES,
+    )
+    if active_f:
+        qs = qs.filter(lot__account__active_f=True)
+    qs = (
+        qs.values_list("lot__account__name", "lot__ticker__ticker")
+        .annotate(realized=Sum("realized"))
+        .order_by("lot__account__name", "lot__ticker__ticker")
+    )
+    df = pd.DataFrame.from_records(list(qs), columns=["a", "t", "realized"])
+    df = df.astype({"realized": float})
+    df = df[df.realized.round(10) != 0]
+    df.reset_index(drop=True, inplace=True)
+    return df
+
+
+def lot_detail(year=None, a=None, t=None):
+    """
+    DataFrame of the lot closes, for audits: when and at what each lot was
+    opened and closed and the gain.  Limited to the closes in year, account
+    a and ticker t if given.
+    """
+    qs = LotClose.objects.all()
+    if year is not None:
+        qs = qs.filter(
+            dt__gte=day_start(date(year, 1, 1)), dt__lt=day_start_next_day(date(year, 12, 31))
+        )
+    if a is not None:
+        qs = qs.filter(lot__account__name=a)
+    if t is not None:
+        qs = qs.filter(lot__ticker__ticker=t)
+    columns = ["a", "t", "opened", "lot_q", "lot_p", "closed", "q", "basis_p", "p", "realized"]
+    rows = qs.order_by("lot__account__name", "lot__ticker__ticker", "dt", "id").values_list(
+        "lot__account__name",
+        "lot__ticker__ticker",
+        "lot__dt",
+        "lot__q",
+        "lot__p",
+        "dt",
+        "q",
+        "basis_p",
+        "p",
+        "realized",
+    )
+    return pd.DataFrame.from_records(list(rows), columns=columns)
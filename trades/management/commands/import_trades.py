@@ -0,0 +1,67 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from trades.importer import CHUNK_SIZE, TradeImporter, TradeImportError
+
+# Bad rows printed, the rest are counted.
+MAX_ERRORS_SHOWN = 50
+
+
+class Command(BaseCommand):
+    help = "Import trades from a CSV file, see trades.importer for the columns."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV file, - for stdin.")
+        parser.add_argument("--account", help="Account of rows without an account column.")
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=CHUNK_SIZE,
+            help="Rows read and written per transaction.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Check the file and report bad rows without writing anything.",
+        )
+        parser.add_argument(
+            "--skip-invalid",
+            action="store_true",
+            help="Import the good rows and report the bad ones instead of stopping.",
+        )
+        parser.add_argument("--quiet", action="store_true", help="No progress lines.")
+
+    def handle(self, *args, **options):
+        def progress(importer):
+            print(
+                f"{importer.n_read} rows read, {importer.n_written} trades "
+                f"{'checked' if importer.dry_run else 'written'}, {importer.elapsed:.1f}s"
+            )
+
+        path = sys.stdin if options["path"] == "-" else options["path"]
+        try:
+            importer = TradeImporter(
+                default_account=options["account"],
+                dry_run=options["dry_run"],
+                skip_invalid=options["skip_invalid"],
+            )
+            n = importer.import_csv(
+                path,
+                chunk_size=options["chunk_size"],
+                progress=None if options["quiet"] else progress,
+            )
+        except TradeImportError as e:
+            raise CommandError(str(e))
+
+        for e in importer.errors[:MAX_ERRORS_SHOWN]:
+            print(e)
+        if len(importer.errors) > MAX_ERRORS_SHOWN:
+            print(f"... and {len(importer.errors) - MAX_ERRORS_SHOWN} more bad rows.")
+        if importer.new_tickers:
+            verb = "Would create" if importer.dry_run else "Created"
+            print(f"{verb} {len(importer.new_tickers)} tickers.")
+
+        if importer.dry_run:
+            print(f"Would import {n} of {importer.n_read} trades.")
+        else:
+            print(f"Imported {n} of {importer.n_read} trades in {importer.elapsed:.1f}s.")
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from trades.positions import rebuild_positions, verify_positions
+
+
+class Command(BaseCommand):
+    help = "Rebuild the PositionSnapshot and tax lot tables from all trades and check them."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify-only",
+            action="store_true",
+            help="Only check the snapshots against the trades, do not rebuild.",
+        )
+
+    def handle(self, *args, **options):
+        if not options["verify_only"]:
+            n = rebuild_positions()
+            print(f"Wrote {n} position snapshots.")
+
+        errors = verify_positions()
+        for e in errors:
+            print(e)
+        if errors:
+            raise CommandError(f"{len(errors)} pairs do not match their trades.")
+        print("Position snapshots match the trades.")
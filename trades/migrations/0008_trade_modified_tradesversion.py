@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:32
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trades", "0007_alter_trade_commission_alter_trade_p"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TradesVersion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("changed", models.UUIDField(default=uuid.uuid4)),
+                ("deleted", models.UUIDField(default=uuid.uuid4)),
+                ("reset", models.UUIDField(default=uuid.uuid4)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="trade",
+            name="modified",
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# The table starts empty.  Run `manage.py positions` after migrating to build
+# the snapshots from the trades, see README.md.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0023_receivable_account"),
+        ("markets", "0017_quotesnapshot"),
+        ("trades", "0008_trade_modified_tradesversion"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PositionSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("d", models.DateField()),
+                ("q", models.FloatField()),
+                ("cost_basis", models.FloatField()),
+                ("realized", models.FloatField()),
+                (
+                    "account",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="accounts.account"
+                    ),
+                ),
+                (
+                    "ticker",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="markets.ticker"
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("account", "ticker", "d")},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0024_cashrecord_cash_account_d"),
+        ("markets", "0018_dailyprice_dailyprice_d_brin_and_more"),
+        ("trades", "0009_positionsnapshot"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="trade",
+            index=models.Index(fields=["account", "dt"], name="trade_account_dt"),
+        ),
+        migrations.AddIndex(
+            model_name="trade",
+            index=models.Index(fields=["ticker", "dt"], name="trade_ticker_dt"),
+        ),
+        migrations.AddIndex(
+            model_name="trade",
+            index=models.Index(
+                condition=models.Q(("trade_id__isnull", False)),
+                fields=["trade_id"],
+                name="trade_trade_id",
+            ),
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# The tables start empty.  Run `manage.py positions` after migrating to build
+# the tax lots from the trades, see README.md.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0024_cashrecord_cash_account_d"),
+        ("markets", "0018_dailyprice_dailyprice_d_brin_and_more"),
+        ("trades", "0010_trade_trade_account_dt_trade_trade_ticker_dt_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TaxLot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("dt", models.DateTimeField()),
+                ("q", models.FloatField()),
+                ("p", models.FloatField()),
+                ("open_q", models.FloatField()),
+                ("open_p", models.FloatField()),
+                (
+                    "account",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="accounts.account"
+                    ),
+                ),
+                (
+                    "ticker",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="markets.ticker"
+                    ),
+                ),
+                (
+                    "trade",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE, to="trades.trade"
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="LotClose",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("dt", models.DateTimeField(db_index=True)),
+                ("q", models.FloatField()),
+                ("p", models.FloatField()),
+                ("basis_p", models.FloatField()),
+                ("realized", models.FloatField()),
+                (
+                    "trade",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="trades.trade"
+                    ),
+                ),
+                (
+                    "lot",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="closes",
+                        to="trades.taxlot",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="taxlot",
+            index=models.Index(fields=["account", "ticker", "dt"], name="taxlot_pair_dt"),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:34
+
+from django.db import migrations, models
+
+# The new columns start at 0.  Run `manage.py positions` after migrating to
+# rebuild the snapshots from the trades, see README.md.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trades", "0011_taxlot_lotclose"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="positionsnapshot",
+            name="c",
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name="positionsnapshot",
+            name="qp",
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name="positionsnapshot",
+            name="reinvest_c",
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name="positionsnapshot",
+            name="reinvest_qp",
+            field=models.FloatField(default=0.0),
+        ),
+    ]
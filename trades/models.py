@@ -1,12 +1,21 @@
+import threading
+from collections import namedtuple
+from uuid import uuid4
+
+import numpy as np
 import pandas as pd
+from cachetools import LRUCache
 from cachetools.func import lru_cache
 from django.db import models
-from django.db.models import Q
+from django.db.models import Max, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.core.exceptions import ImproperlyConfigured
 from django.core.validators import MinValueValidator
 from django.conf import settings
-from tbgutils.dt import day_start_next_day, next_business_day
-from datetime import time, datetime, date as date_cls
-from markets.models import Ticker, NOT_FUTURES_EXCHANGES
+from tbgutils.dt import day_start, day_start_next_day, is_holiday_observed, prior_business_day
+from datetime import time, timedelta
+from markets.models import Market, Ticker, NOT_FUTURES_EXCHANGES
 from accounts.models import Account
 
 
@@ -27,9 +36,19 @@ class Trade(models.Model):
     )
     note = models.CharField(max_length=180, blank=True, null=True)
     trade_id = models.IntegerField(blank=True, null=True)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         ordering = ["dt"]
+        indexes = [
+            # Trades of an account or of a ticker in time order.
+            models.Index(fields=["account", "dt"], name="trade_account_dt"),
+            models.Index(fields=["ticker", "dt"], name="trade_ticker_dt"),
+            # Only broker trades have a trade_id, the Flex ingest looks them up.
+            models.Index(
+                fields=["trade_id"], condition=Q(trade_id__isnull=False), name="trade_trade_id"
+            ),
+        ]
 
     def __str__(self):
         return (
@@ -38,7 +57,6 @@ class Trade(models.Model):
         )
 
     def save(self, *args, **kwargs):
-        get_trades_df.cache_clear()
         if self.commission is None:
             self.commission = abs(self.q * self.ticker.market.commission)
         elif self.commission < 0:
@@ -89,7 +107,11 @@ class Trade(models.Model):
         return qs
 
     @classmethod
-    def qs_to_df(cls, qs):
+    def qs_to_df(cls, qs, ids=False):
+        """
+        Trades frame of qs, typed by trades_dtypes().  With ids=True return
+        (ids, df) where ids is an array of the Trade ids of the rows.
+        """
         fields = (
             "account__name",
             "ticker__ticker",
@@ -101,26 +123,232 @@ class Trade(models.Model):
             "commission",
             "reinvest",
         )
+        if ids:
+            fields = ("id",) + fields
 
-        qs = qs.values_list(*fields)
-        columns = ["a", "t", "e", "cs", "dt", "q", "p", "c", "r"]
-        if len(qs):
-            df = pd.DataFrame.from_records(list(qs), coerce_float=True)
-            df.columns = columns
-        else:
-            df = pd.DataFrame.from_records(list(qs), coerce_float=True, columns=columns)
+        # One list per column instead of a list of row tuples.
+        rows = list(qs.values_list(*fields))
+        columns = list(zip(*rows)) if rows else [()] * len(fields)
+        if ids:
+            ids, *columns = columns
+            ids = np.array(ids, dtype=np.int64)
 
+        df = trades_frame(columns)
         factor = settings.PPM_FACTOR
         if factor is not False:
             df.q *= factor
 
-        # df = df.convert_dtypes(convert_string=True)
+        if ids is not False:
+            return ids, df
         return df
 
 
-@lru_cache(maxsize=10)
-def get_trades_df(a=None, t=None, only_non_qualified=False, active_f=True):
-    #  Use copy_trades_df() which calls this to preserve the cached df
+# Column dtypes of trades frames.  Account, ticker and exchange repeat a few
+# values over many rows so they are categories, int8 or int16 codes plus one
+# copy of each name, which also makes groupby on them fast.
+#
+# 100k trades over 10 accounts and 300 tickers take about 4.5 MB: 0.4 MB
+# for a, t and e, 0.8 MB for each of the five 8 byte columns and 0.1 MB for
+# r.  With one string per row a, t and e alone take about 19 MB.
+TRADES_DTYPES = {
+    "a": "category",
+    "t": "category",
+    "e": "category",
+    "cs": "float64",
+    "dt": "datetime64[us, UTC]",
+    "q": "float64",
+    "p": "float64",
+    "c": "float64",
+    "r": "bool",
+}
+
+
+def trades_dtypes():
+    """
+    TRADES_DTYPES, or with settings.TRADES_ARROW the numbers, dates and
+    flags as Arrow arrays.  The names stay categories either way.
+    """
+    if not settings.TRADES_ARROW:
+        return TRADES_DTYPES
+
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImproperlyConfigured("TRADES_ARROW needs pyarrow installed.")
+
+    dtypes = dict(TRADES_DTYPES)
+    for column in ("cs", "q", "p", "c"):
+        dtypes[column] = pd.ArrowDtype(pa.float64())
+    dtypes["dt"] = pd.ArrowDtype(pa.timestamp("us", tz="UTC"))
+    dtypes["r"] = pd.ArrowDtype(pa.bool_())
+    return dtypes
+
+
+def trades_frame(columns):
+    """
+    Build a trades frame from one sequence per column of TRADES_DTYPES, in
+    that order.  Decimals become floats and datetimes UTC timestamps.
+    """
+    data = {}
+    for (name, dtype), values in zip(trades_dtypes().items(), columns):
+        if name == "dt":
+            values = pd.to_datetime(list(values), utc=True)
+        elif dtype != "category":
+            values = np.array(values, dtype=float if name != "r" else bool)
+        data[name] = pd.Series(values, dtype=dtype)
+    return pd.DataFrame(data)
+
+
+class TradesVersion(models.Model):
+    """
+    One row that changes whenever the trades change, so every process can
+    tell whether its cached trade frames are current.
+
+    changed is new after any change, deleted after trades were deleted and
+    reset after an account, ticker or market was edited.  They are uuids and
+    not counters so a rolled back change can not bring back a version.
+    """
+
+    changed = models.UUIDField(default=uuid4)
+    deleted = models.UUIDField(default=uuid4)
+    reset = models.UUIDField(default=uuid4)
+
+
+NO_VERSION = (None, None, None)
+
+
+def trades_version():
+    version = TradesVersion.objects.filter(pk=1).values_list("changed", "deleted", "reset")
+    return version.first() or NO_VERSION
+
+
+def trades_changed(deleted=False, reset=False):
+    """
+    Mark the cached trade frames of every process as out of date.
+
+    The signals below call this for Trade saves and deletes.  Code that
+    writes trades without signals, bulk_create or QuerySet.update, must call
+    it itself, with deleted=True after deleting trades that way.
+    """
+    values = {"changed": uuid4()}
+    if deleted:
+        values["deleted"] = uuid4()
+    if reset:
+        values["reset"] = uuid4()
+    TradesVersion.objects.update_or_create(pk=1, defaults=values)
+
+
+@receiver(post_save, sender=Trade)
+def trade_saved(sender, instance, **kwargs):
+    trades_changed()
+
+
+@receiver(post_delete, sender=Trade)
+def trade_deleted(sender, instance, **kwargs):
+    trades_changed(deleted=True)
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_save, sender=Ticker)
+@receiver(post_save, sender=Market)
+def trade_columns_changed(sender, instance, created, **kwargs):
+    # Names, exchanges, multipliers and account flags are in every frame.
+    if not created:
+        trades_changed(reset=True)
+
+
+class PositionSnapshot(models.Model):
+    """
+    Position of an account in a ticker at the end of each trading day it
+    traded, kept up to date by trades.positions.
+
+    cost_basis is cs * sum(q * p) of the open lots and realized the gain on
+    the lots closed so far, both before commissions.  qp is sum(-q * p) and c
+    the commissions of the trades so far, reinvest_qp and reinvest_c the part
+    of them from reinvestments, what trades_pnl() sums.
+    """
+
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    ticker = models.ForeignKey(Ticker, on_delete=models.CASCADE)
+    d = models.DateField()
+    q = models.FloatField()
+    cost_basis = models.FloatField()
+    realized = models.FloatField()
+    qp = models.FloatField(default=0.0)
+    c = models.FloatField(default=0.0)
+    reinvest_qp = models.FloatField(default=0.0)
+    reinvest_c = models.FloatField(default=0.0)
+
+    class Meta:
+        unique_together = [["account", "ticker", "d"]]
+
+    def __str__(self):
+        return f"{self.account} {self.ticker.ticker} {self.d} {self.q}"
+
+
+class TaxLot(models.Model):
+    """
+    A lot opened by a trade, kept up to date by trades.lots.
+
+    q and p are what the trade opened, open_q and open_p what is still open,
+    adjusted for the splits since.  q and open_q have the sign of the
+    position.
+    """
+
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    ticker = models.ForeignKey(Ticker, on_delete=models.CASCADE)
+    trade = models.OneToOneField(Trade, on_delete=models.CASCADE)
+    dt = models.DateTimeField()
+    q = models.FloatField()
+    p = models.FloatField()
+    open_q = models.FloatField()
+    open_p = models.FloatField()
+
+    class Meta:
+        indexes = [models.Index(fields=["account", "ticker", "dt"], name="taxlot_pair_dt")]
+
+    def __str__(self):
+        return f"{self.account} {self.ticker.ticker} {self.dt} {self.q}@{self.p}"
+
+
+class LotClose(models.Model):
+    """
+    Part of a TaxLot closed by a trade.  q has the sign of the lot, p is the
+    price of the closing trade and basis_p the split adjusted price of the
+    lot.  realized is cs * q * (p - basis_p), before commissions.
+    """
+
+    lot = models.ForeignKey(TaxLot, on_delete=models.CASCADE, related_name="closes")
+    trade = models.ForeignKey(Trade, on_delete=models.CASCADE)
+    dt = models.DateTimeField(db_index=True)
+    q = models.FloatField()
+    p = models.FloatField()
+    basis_p = models.FloatField()
+    realized = models.FloatField()
+
+    def __str__(self):
+        return f"{self.lot} closed {self.q}@{self.p} {self.dt}"
+
+
+# A cached trades frame.  last_id and last_modified are the newest Trade id
+# and modified stamp in the table when it was read, ids the Trade id of each
+# row of df.
+TradesFrame = namedtuple("TradesFrame", ["version", "last_id", "last_modified", "ids", "df"])
+
+# Rows modified this long before the newest stamp already seen are read
+# again, so trades from a transaction that committed late are not missed.
+MODIFIED_OVERLAP = timedelta(minutes=5)
+
+_trades_frames = LRUCache(maxsize=10)
+_trades_frames_lock = threading.Lock()
+
+
+def clear_trades_frames():
+    with _trades_frames_lock:
+        _trades_frames.clear()
+
+
+def filter_trades(a=None, t=None, only_non_qualified=False, active_f=True):
     qs = Trade.objects
     if a is not None:
         qs = qs.filter(account__name=a)
@@ -134,22 +362,144 @@ def get_trades_df(a=None, t=None, only_non_qualified=False, active_f=True):
     if only_non_qualified:
         qs = qs.filter(account__qualified_f=False)
 
-    qs.order_by("dt")
-    df = Trade.qs_to_df(qs)
-    return df
+    return qs.order_by("dt", "id")
+
+
+def trade_marks():
+    marks = Trade.objects.aggregate(last_id=Max("id"), last_modified=Max("modified"))
+    return marks["last_id"] or 0, marks["last_modified"]
+
+
+def load_trades_frame(qs, version):
+    last_id, last_modified = trade_marks()
+    ids, df = Trade.qs_to_df(qs, ids=True)
+    return TradesFrame(version, last_id, last_modified, ids, df)
+
+
+def refresh_trades_frame(frame, qs, version):
+    """
+    Bring frame up to version reading only the trades added or modified
+    since it was read, and the ids of all trades if some were deleted.
+    """
+    last_id, last_modified = trade_marks()
+
+    changed = Q(id__gt=frame.last_id)
+    if frame.last_modified is not None:
+        changed |= Q(modified__gte=frame.last_modified - MODIFIED_OVERLAP)
+    changed_ids = Trade.objects.filter(changed).values_list("id", flat=True)
+    changed_ids = np.fromiter(changed_ids, dtype=np.int64)
+    new_ids, new_df = Trade.qs_to_df(qs.filter(changed), ids=True)
+
+    # Edited rows are replaced, also dropped if they no longer pass the filter.
+    keep = ~np.isin(frame.ids, np.concatenate([changed_ids, new_ids]))
+    if version[1] != frame.version[1]:
+        all_ids = np.fromiter(Trade.objects.values_list("id", flat=True), dtype=np.int64)
+        keep &= np.isin(frame.ids, all_ids)
+
+    ids, df = frame.ids[keep], frame.df.loc[keep]
+    if len(new_ids):
+        if len(ids):
+            ids = np.concatenate([ids, new_ids])
+            # Different categories concatenate to strings, make them categories again.
+            df = pd.concat([df, new_df]).astype(trades_dtypes())
+            order = np.lexsort((ids, df["dt"].to_numpy(dtype="datetime64[ns]")))
+            ids, df = ids[order], df.iloc[order]
+        else:
+            ids, df = new_ids, new_df
+    df = df.reset_index(drop=True)
+
+    return TradesFrame(version, last_id, last_modified, ids, df)
+
+
+def get_trades_df(a=None, t=None, only_non_qualified=False, active_f=True):
+    """
+    Trades frame, shared by every caller with the same arguments.
+
+    Frames are cached per process and checked against TradesVersion on every
+    call.  When trades were added or edited only those rows are read and
+    merged in.  Edits to accounts, tickers or markets reread everything.
+    """
+    #  Use copy_trades_df() which calls this to preserve the cached df
+    key = (a, t, only_non_qualified, active_f)
+    version = trades_version()
+    with _trades_frames_lock:
+        frame = _trades_frames.get(key)
+
+    if frame is not None and frame.version == version:
+        return frame.df
+
+    qs = filter_trades(*key)
+    if frame is None or frame.version[2] != version[2]:
+        frame = load_trades_frame(qs, version)
+    else:
+        frame = refresh_trades_frame(frame, qs, version)
+
+    with _trades_frames_lock:
+        _trades_frames[key] = frame
+    return frame.df
 
 
 def copy_trades_df(d=None, t=None, a=None, only_non_qualified=False, active_f=True):
+    """
+    Trades up to the end of day d, all of them if d is None.
+
+    The cached frame is sorted by dt so d is found with a binary search and
+    the result is a slice of it.  Nothing is copied, pandas copy on write,
+    always on since pandas 3 which pyproject.toml requires, copies a column
+    only when a caller changes it.
+    """
     df = get_trades_df(a=a, t=t, only_non_qualified=only_non_qualified, active_f=active_f)
-    df = df.copy(deep=True)
     if (not df.empty) and (d is not None):
-        dt = day_start_next_day(d)
-        mask = df["dt"] < dt
-        df = df.loc[mask]
-    return df
+        i = df["dt"].searchsorted(day_start_next_day(d), side="left")
+        return df.iloc[:i]
+    # A new frame so added columns do not end up in the cached one.
+    return df.copy(deep=False)
+
+
+def time_to_ns(t):
+    return ((t.hour * 60 + t.minute) * 60 + t.second) * 1_000_000_000 + t.microsecond * 1000
+
 
+@lru_cache(maxsize=100)
+def _year_holidays(year):
+    days = np.arange(f"{year}-01-01", f"{year + 1}-01-01", dtype="datetime64[D]")
+    return [d for d in days if is_holiday_observed(d.astype(object), weekend_f=False)]
 
-def bucketed_trades(d=None, t=None, a=None, only_non_qualified=False, active_f=True):
+
+def _holidays(d0, d1):
+    # Holidays from d0's year through a week past d1, for np.busday_offset.
+    y0 = int(d0.astype("datetime64[Y]").astype(int)) + 1970
+    y1 = int((d1 + 7).astype("datetime64[Y]").astype(int)) + 1970
+    holidays = [d for y in range(y0, y1 + 1) for d in _year_holidays(y)]
+    return np.array(holidays, dtype="datetime64[D]")
+
+
+# Close used for tickers without a market close time.
+DEFAULT_CLOSE = time(18, 0)
+
+
+def trading_days(dt, cutoff):
+    """
+    datetime64[D] trading day of each time in dt, a tz-aware Series in
+    America/New_York.  cutoff is the market close of each row, in ns after
+    midnight.  Weekend trades and trades after the close belong to the next
+    business day.
+    """
+    # Wall clock times as datetime64, split into the day and the time of day.
+    local = dt.dt.tz_localize(None).to_numpy("datetime64[ns]")
+    d0 = local.astype("datetime64[D]")
+    tod = (local - d0).astype(np.int64)
+
+    late = ~np.is_busday(d0) | (tod > cutoff)
+    d = d0.copy()
+    if late.any():
+        d[late] = np.busday_offset(
+            d0[late] + 1, 0, roll="forward", holidays=_holidays(d0.min(), d0.max())
+        )
+    return d
+
+
+def bucketed_trades(d=None, t=None, a=None, only_non_qualified=False, active_f=True, start=None):
     """
     Return trades dataframe bucketed by trading day per market close.
 
@@ -158,11 +508,26 @@ def bucketed_trades(d=None, t=None, a=None, only_non_qualified=False, active_f=T
     - Adds a `d` column (date) for each trade such that if the trade's
       timestamp (in America/New_York) is later than the Market.t_close
       for its ticker, the date is moved to the next business day.
+    - With start, only the trades bucketed on or after start.  Only the
+      trades from the business day before start on are bucketed, none
+      before it can be bucketed as late as start.
     """
     df = copy_trades_df(d=d, t=t, a=a, only_non_qualified=only_non_qualified, active_f=active_f)
+    if start is None:
+        return bucket_trades(df)
 
+    start = pd.Timestamp(start).date()
+    i = df["dt"].searchsorted(day_start(prior_business_day(start)), side="left")
+    df = bucket_trades(df.iloc[i:])
     if df.empty:
         return df
+    return df[df["d"] >= start]
+
+
+def bucket_trades(df):
+    """Add the `d` column of bucketed_trades() to the trades frame df."""
+    if df.empty:
+        return df.assign(d=np.array([], dtype=object))
 
     # Normalize timestamps to America/New_York for trading-day bucketing
     # If values are tz-aware, convert to Eastern. If naive, assume they are
@@ -183,27 +548,15 @@ def bucketed_trades(d=None, t=None, a=None, only_non_qualified=False, active_f=T
         tclose_qs = Ticker.objects.filter(ticker__in=tickers).values_list(
             "ticker", "market__t_close"
         )
-        tclose_map = {tkr: tc for tkr, tc in tclose_qs}
+        tclose_map = {tkr: time_to_ns(tc) for tkr, tc in tclose_qs if tc is not None}
     else:
         tclose_map = {}
 
-    def _trading_day_row(row):
-        ts = row["_dt_eastern"]
-        tkr = row["t"]
-        d0 = ts.date()
-        # If weekend, always move to next business day
-        if ts.weekday() >= 5:
-            return next_business_day(d0)
-        t_close = tclose_map.get(tkr)
-        cutoff_time = t_close if t_close is not None else time(18, 0)
-        cutoff_local = pd.Timestamp(datetime.combine(d0, cutoff_time), tz="America/New_York")
-        return d0 if ts <= cutoff_local else next_business_day(d0)
-
-    df["d"] = df.apply(_trading_day_row, axis=1)
-    # Ensure 'd' is a pure date column (not datetime/timestamp)
-    df["d"] = df["d"].apply(
-        lambda x: x if isinstance(x, date_cls) else getattr(x, "date", lambda: x)()
-    )
+    t = df["t"].astype("category")
+    default = time_to_ns(DEFAULT_CLOSE)
+    cutoffs = np.array([tclose_map.get(k, default) for k in t.cat.categories], dtype=np.int64)
+    cutoff = cutoffs[t.cat.codes.to_numpy()]
+    df["d"] = trading_days(df["_dt_eastern"], cutoff).astype(object)
 
     # Drop helper column used for computation
     if "_dt_eastern" in df.columns:
@@ -0,0 +1,448 @@
+"""
+End of day positions kept in the PositionSnapshot table.
+
+Every (account, ticker) has a snapshot for each trading day it traded, with
+the position, the cost basis of the open lots and the realized gain so far.
+The trades of a pair are run through its open lots in time order, FIFO or
+LIFO by settings.FIFO, the same matching moneycounter does.  The tax lots
+are always FIFO.
+
+Saving or deleting a Trade replays only its pair and rewrites the snapshots
+from the trade's day on, and the tax lots of trades.lots from its dt on.
+Code writing trades without signals uses a trades.batch.TradeBatch or calls
+trades_written() itself.  The positions management command rebuilds the
+whole table and checks it against the trades, it has to be run once after
+migrating to 0012.
+
+positions_asof() reads the latest snapshot of every pair on or before a
+date, so it does not depend on how much trade history there is.
+trades.utils.pnl_asof() sums the trades up to a date from it and
+analytics.pnl.daily_pnl() takes the positions before its first day from it,
+both read only the trades after the snapshot.  daily_pos() reads
+position_history().  Editing the cs or close of a market rewrites the
+snapshots of its tickers.
+"""
+
+from collections import deque
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from moneycounter.pnl import unrealized
+from tbgutils.str import is_near_zero
+
+from markets.models import Market, Ticker
+
+from trades.lots import SPLIT_PRICE, match_lots, refresh_lots
+from trades.models import (
+    DEFAULT_CLOSE,
+    LotClose,
+    PositionSnapshot,
+    TaxLot,
+    Trade,
+    time_to_ns,
+    trades_changed,
+    trading_days,
+)
+
+
+def replay(q, p, fifo=True, first=None):
+    """
+    Run trades, arrays of q and p in time order, through the open lots.
+
+    Returns arrays of the position and of sum(q * p) of the open lots after
+    each trade.  A trade at p=0 is a split, it scales the open lots.  A trade
+    that takes the position through zero opens a lot with the rest.
+
+    first, a boolean array, marks the first trade of each of several pairs
+    run in one pass, the lots are emptied before it.
+    """
+    n = len(q)
+    positions = np.empty(n)
+    costs = np.empty(n)
+    lots = deque()  # [q, p] with the sign of the position
+    position = 0.0
+    cost = 0.0  # sum(q * p) of lots, a split leaves it unchanged
+    for i in range(n):
+        if first is not None and first[i]:
+            lots.clear()
+            position = cost = 0.0
+        qi, pi = float(q[i]), float(p[i])
+        if pi <= SPLIT_PRICE:
+            if not is_near_zero(position):
+                factor = (position + qi) / position
+                for lot in lots:
+                    lot[0] *= factor
+                    lot[1] /= factor
+        elif is_near_zero(position) or (qi > 0) == (position > 0):
+            lots.append([qi, pi])
+            cost += qi * pi
+        else:
+            left = qi
+            while lots and not is_near_zero(left):
+                lot = lots[0] if fifo else lots[-1]
+                if abs(lot[0]) > abs(left):
+                    lot[0] += left
+                    cost += left * lot[1]
+                    left = 0.0
+                else:
+                    left += lot[0]
+                    cost -= lot[0] * lot[1]
+                    if fifo:
+                        lots.popleft()
+                    else:
+                        lots.pop()
+            if not is_near_zero(left):
+                lots.append([left, pi])
+                cost += left * pi
+
+        position += qi
+        if is_near_zero(position):
+            lots.clear()
+            cost = 0.0
+        positions[i] = position
+        costs[i] = cost
+
+    return positions, costs
+
+
+def pair_snapshots(dt, q, p, c, r, cs, t_close, fifo=True):
+    """
+    Snapshots of one pair from its trades in time order, dt a tz-aware
+    Series, c the commissions and r the reinvest flags.  Returns a DataFrame
+    with columns d, q, cost_basis, realized, qp, c, reinvest_qp and
+    reinvest_c, one row per trading day.
+    """
+    dt = dt.dt.tz_convert("America/New_York")
+    cutoff = np.full(len(dt), time_to_ns(t_close or DEFAULT_CLOSE), dtype=np.int64)
+    days = trading_days(dt, cutoff)
+
+    q = np.asarray(q, dtype=float)
+    p = np.asarray(p, dtype=float)
+    c = np.asarray(c, dtype=float)
+    r = np.asarray(r, dtype=bool)
+    positions, costs = replay(q, p, fifo=fifo)
+    flows = np.cumsum(-q * p)
+
+    # The last trade of each day.
+    last = np.append(days[1:] != days[:-1], True)
+    return pd.DataFrame(
+        {
+            "d": days[last].astype(object),
+            "q": positions[last],
+            "cost_basis": cs * costs[last],
+            "realized": cs * (flows[last] + costs[last]),
+            "qp": flows[last],
+            "c": np.cumsum(c)[last],
+            "reinvest_qp": np.cumsum(np.where(r, -q * p, 0.0))[last],
+            "reinvest_c": np.cumsum(np.where(r, c, 0.0))[last],
+        }
+    )
+
+
+def pair_trades(qs):
+    """{(account_id, ticker_id): DataFrame of id, dt, q, p, c, r, cs, t_close} of qs."""
+    rows = qs.order_by("account_id", "ticker_id", "dt", "id").values_list(
+        "account_id",
+        "ticker_id",
+        "id",
+        "dt",
+        "q",
+        "p",
+        "commission",
+        "reinvest",
+        "ticker__market__cs",
+        "ticker__market__t_close",
+    )
+    columns = ["a", "t", "id", "dt", "q", "p", "c", "r", "cs", "t_close"]
+    df = pd.DataFrame.from_records(list(rows), columns=columns)
+    if df.empty:
+        return {}
+    df["dt"] = pd.to_datetime(df["dt"], utc=True)
+    return {pair: g for pair, g in df.groupby(["a", "t"], sort=False)}
+
+
+def snapshots(pair, trades, d_from=None):
+    account_id, ticker_id = pair
+    df = pair_snapshots(
+        trades["dt"],
+        trades["q"],
+        trades["p"],
+        trades["c"],
+        trades["r"],
+        float(trades["cs"].iloc[0]),
+        trades["t_close"].iloc[0],
+        fifo=settings.FIFO,
+    )
+    if d_from is not None:
+        df = df[df.d >= d_from]
+    return [
+        PositionSnapshot(account_id=account_id, ticker_id=ticker_id, **row)
+        for row in df.to_dict("records")
+    ]
+
+
+def local_date(dt):
+    dt = pd.Timestamp(dt)
+    if dt.tzinfo is None:
+        return dt.date()
+    return dt.tz_convert("America/New_York").date()
+
+
+def refresh_positions(changes):
+    """
+    Rewrite the snapshots of the pairs in changes, {(account_id, ticker_id):
+    dt}, from the day of dt on, and their tax lots from dt on.  dt None
+    rewrites all of them.
+    """
+    with transaction.atomic():
+        for pair, dt in changes.items():
+            account_id, ticker_id = pair
+            stale = PositionSnapshot.objects.filter(account_id=account_id, ticker_id=ticker_id)
+            # No trade is bucketed before its calendar day.
+            d_from = None if dt is None else local_date(dt)
+            if d_from is not None:
+                stale = stale.filter(d__gte=d_from)
+            stale.delete()
+
+            trades = pair_trades(Trade.objects.filter(account_id=account_id, ticker_id=ticker_id))
+            if pair in trades:
+                PositionSnapshot.objects.bulk_create(snapshots(pair, trades[pair], d_from))
+            refresh_lots(pair, trades.get(pair), dt)
+
+
+def rebuild_positions(batch_size=2000):
+    """
+    Replace every snapshot and tax lot with ones built from all trades.
+    Returns the number of snapshots.
+    """
+    n = 0
+    with transaction.atomic():
+        PositionSnapshot.objects.all().delete()
+        LotClose.objects.all().delete()
+        TaxLot.objects.all().delete()
+        for pair, trades in pair_trades(Trade.objects.all()).items():
+            objs = snapshots(pair, trades)
+            PositionSnapshot.objects.bulk_create(objs, batch_size=batch_size)
+            n += len(objs)
+            lots, closes = match_lots(pair, trades)
+            TaxLot.objects.bulk_create(lots.values(), batch_size=batch_size)
+            LotClose.objects.bulk_create(closes, batch_size=batch_size)
+    return n
+
+
+def verify_positions(tolerance=1e-6):
+    """
+    Check the snapshots against the trades.  Every pair must have one
+    snapshot per trading day with the running sum of q, and the latest
+    cost basis and realized gain must match moneycounter's unrealized lots.
+    The gains of the tax lot closes of a pair must add up to its realized
+    gain matched FIFO.
+
+    Returns a list of strings describing the differences, empty if none.
+    """
+    errors = []
+    stored = {}
+    qs = PositionSnapshot.objects.order_by("account_id", "ticker_id", "d")
+    for account_id, ticker_id, d, q, cost_basis, realized in qs.values_list(
+        "account_id", "ticker_id", "d", "q", "cost_basis", "realized"
+    ):
+        stored.setdefault((account_id, ticker_id), []).append((d, q, cost_basis, realized))
+
+    qs = LotClose.objects.values_list("lot__account_id", "lot__ticker_id")
+    qs = qs.annotate(realized=Sum("realized")).order_by()
+    lot_realized = {(a, t): realized for a, t, realized in qs}
+
+    trades = pair_trades(Trade.objects.all())
+    for pair in set(stored) - set(trades):
+        errors.append(f"{pair}: snapshots without trades")
+
+    for pair, df in trades.items():
+        rows = stored.get(pair, [])
+        dt = df["dt"].dt.tz_convert("America/New_York")
+        t_close = df["t_close"].iloc[0] or DEFAULT_CLOSE
+        days = trading_days(dt, np.full(len(df), time_to_ns(t_close), dtype=np.int64))
+        q = df["q"].astype(float).to_numpy()
+        # Trades are in time order, so are their days.
+        first = np.flatnonzero(np.append(True, days[1:] != days[:-1]))
+        if [d for d, *_ in rows] != list(days[first].astype(object)):
+            errors.append(f"{pair}: snapshot days differ from trading days")
+            continue
+        expected = np.cumsum(np.add.reduceat(q, first))
+        if not np.allclose([r[1] for r in rows], expected, atol=tolerance):
+            errors.append(f"{pair}: positions differ from the sum of trades")
+
+        trades_df = pd.DataFrame({"q": q, "p": df["p"].astype(float).to_numpy()})
+        cs = float(df["cs"].iloc[0])
+        open_lots = unrealized(trades_df, fifo=settings.FIFO)
+        cost_basis = cs * (open_lots.q * open_lots.p).sum()
+        realized = cs * (-(trades_df.q * trades_df.p).sum()) + cost_basis
+        _, _, stored_cost, stored_realized = rows[-1]
+        if abs(cost_basis - stored_cost) > tolerance * max(1.0, abs(cost_basis)):
+            errors.append(f"{pair}: cost basis {stored_cost} should be {cost_basis}")
+        if abs(realized - stored_realized) > tolerance * max(1.0, abs(realized)):
+            errors.append(f"{pair}: realized {stored_realized} should be {realized}")
+        # The tax lots are FIFO whatever settings.FIFO is.
+        if not settings.FIFO:
+            open_lots = unrealized(trades_df, fifo=True)
+            realized = cs * (
+                -(trades_df.q * trades_df.p).sum() + (open_lots.q * open_lots.p).sum()
+            )
+        closed = lot_realized.get(pair, 0.0)
+        if abs(realized - closed) > tolerance * max(1.0, abs(realized)):
+            errors.append(f"{pair}: tax lot gains {closed} should be {realized}")
+
+    return errors
+
+
+def latest_snapshots(d=None, a=None, only_non_qualified=False, active_f=True):
+    """The latest snapshot of every pair on or before d, the latest of all if d is None."""
+    qs = PositionSnapshot.objects.all()
+    latest = PositionSnapshot.objects.filter(
+        account=OuterRef("account"), ticker=OuterRef("ticker")
+    )
+    if d is not None:
+        qs = qs.filter(d__lte=d)
+        latest = latest.filter(d__lte=d)
+    if a is not None:
+        qs = qs.filter(account__name=a)
+    if active_f:
+        qs = qs.filter(account__active_f=True)
+    if only_non_qualified:
+        qs = qs.filter(account__qualified_f=False)
+
+    if connection.features.can_distinct_on_fields:
+        qs = qs.order_by("account_id", "ticker_id", "-d").distinct("account_id", "ticker_id")
+    else:
+        qs = qs.filter(d=Subquery(latest.order_by("-d").values("d")[:1]))
+    return qs
+
+
+def positions_asof(d=None, a=None, only_non_qualified=False, active_f=True):
+    """
+    DataFrame of a, t, q, cost_basis, realized, c, cs, e, qp and qpr from the
+    latest snapshot of every pair on or before d, the columns of
+    trades_pnl() sums included.  Scaled by PPM_FACTOR like the trade frames,
+    which scale q and not commissions.
+    """
+    qs = latest_snapshots(d, a=a, only_non_qualified=only_non_qualified, active_f=active_f)
+    columns = ["a", "t", "q", "cost_basis", "realized", "c", "cs", "e", "qp", "reinvest_qp"]
+    rows = qs.values_list(
+        "account__name",
+        "ticker__ticker",
+        "q",
+        "cost_basis",
+        "realized",
+        "c",
+        "ticker__market__cs",
+        "ticker__market__ib_exchange",
+        "qp",
+        "reinvest_qp",
+        "reinvest_c",
+    )
+    df = pd.DataFrame.from_records(list(rows), columns=columns + ["reinvest_c"])
+    df = df.astype({"cs": float})
+    factor = settings.PPM_FACTOR
+    if factor is not False:
+        df[["q", "cost_basis", "realized", "qp", "reinvest_qp"]] *= factor
+    df["qpr"] = df.pop("reinvest_qp") - df.pop("reinvest_c")
+    return df
+
+
+def position_history(a=None, active_f=True):
+    """
+    DataFrame of d, a, t and q of every snapshot, sorted by a, t and d.
+    Scaled by PPM_FACTOR like the trade frames.
+    """
+    qs = PositionSnapshot.objects.all()
+    if a is not None:
+        qs = qs.filter(account__name=a)
+    if active_f:
+        qs = qs.filter(account__active_f=True)
+    qs = qs.order_by("account__name", "ticker__ticker", "d")
+    rows = qs.values_list("d", "account__name", "ticker__ticker", "q")
+    df = pd.DataFrame.from_records(list(rows), columns=["d", "a", "t", "q"])
+    factor = settings.PPM_FACTOR
+    if factor is not False:
+        df["q"] *= factor
+    return df
+
+
+def add_change(changes, pair, dt):
+    if pair in changes and changes[pair] is not None and dt is not None:
+        dt = min(changes[pair], dt)
+    changes[pair] = dt
+
+
+def trades_written(trades, before=(), deleted=False):
+    """
+    What the Trade signals do, once for trades written by bulk_create,
+    bulk_update or QuerySet.delete: mark the trade frames out of date and
+    refresh the positions of every pair the trades are in.  before has the
+    (account_id, ticker_id, dt) of updated trades from before the change.
+    """
+    changes = {}
+    for account_id, ticker_id, dt in before:
+        add_change(changes, (account_id, ticker_id), dt)
+    for trade in trades:
+        add_change(changes, (trade.account_id, trade.ticker_id), trade.dt)
+    if changes:
+        trades_changed(deleted=deleted)
+        refresh_positions(changes)
+
+
+@receiver(pre_save, sender=Trade)
+def remember_trade(sender, instance, **kwargs):
+    # An edit can move a trade to another pair or day, that one changes too.
+    instance._before = None
+    if instance.pk is not None:
+        before = Trade.objects.filter(pk=instance.pk)
+        instance._before = before.values_list("account_id", "ticker_id", "dt").first()
+
+
+@receiver(post_save, sender=Trade)
+def update_positions_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    changes = {}
+    before = getattr(instance, "_before", None)
+    if before is not None:
+        add_change(changes, before[:2], before[2])
+    add_change(changes, (instance.account_id, instance.ticker_id), instance.dt)
+    refresh_positions(changes)
+
+
+@receiver(post_delete, sender=Trade)
+def update_positions_on_delete(sender, instance, **kwargs):
+    refresh_positions({(instance.account_id, instance.ticker_id): instance.dt})
+
+
+# The contract size and close of a market are in the snapshots of its
+# tickers, the cost basis is scaled by cs and the days are cut at t_close.
+MARKET_FIELDS = {Market: ("cs", "t_close"), Ticker: ("market_id",)}
+
+
+@receiver(pre_save, sender=Market)
+@receiver(pre_save, sender=Ticker)
+def remember_market(sender, instance, **kwargs):
+    instance._market_before = None
+    if instance.pk is not None:
+        before = sender.objects.filter(pk=instance.pk)
+        instance._market_before = before.values_list(*MARKET_FIELDS[sender]).first()
+
+
+@receiver(post_save, sender=Market)
+@receiver(post_save, sender=Ticker)
+def update_positions_on_market_change(sender, instance, created, raw=False, **kwargs):
+    before = getattr(instance, "_market_before", None)
+    if raw or created or before is None:
+        return
+    if before == tuple(getattr(instance, f) for f in MARKET_FIELDS[sender]):
+        return
+    trades = Trade.objects.filter(**{"ticker__market" if sender is Market else "ticker": instance})
+    pairs = trades.values_list("account_id", "ticker_id").order_by().distinct()
+    refresh_positions({pair: None for pair in pairs})
@@ -1,10 +1,30 @@
 import datetime
-from django.test import TestCase, override_settings
+import tempfile
+import numpy as np
+import pandas as pd
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase, override_settings
+from moneycounter import wap_calc
+from moneycounter.pnl import realized_gains, unrealized
 from tbgutils.dt import our_localize, next_business_day
 from accounts.models import Account, CashRecord
 from markets.models import Market, Ticker
-from trades.models import Trade
-from trades.utils import weighted_average_price
+from markets.utils import ib_symbol_parts
+from trades.models import (
+    TRADES_DTYPES,
+    PositionSnapshot,
+    Trade,
+    bucketed_trades,
+    copy_trades_df,
+    get_non_qualified_equity_trades_df,
+    get_trades_df,
+)
+from trades.batch import TradeBatch
+from trades.ib_flex import get_trades
+from trades.lots import equity_realized_gains, lot_detail
+from trades.positions import positions_asof, rebuild_positions, replay, verify_positions
+from trades.utils import cost_basis, pnl_asof, trades_pnl, weighted_average_price
 
 
 def make_trades():
@@ -307,3 +327,322 @@ class TradesTests(TestCase):
         pos, wap = weighted_average_price(t)
         self.assertAlmostEqual(95, pos)
         self.assertAlmostEqual(94.36842105263158, wap)
+
+    def test_bucketed_trades(self):
+        t = Ticker.objects.get(ticker="AAPL")
+        times = [
+            (2022, 1, 14, 15, 59),  # Friday before the close
+            (2022, 1, 14, 16, 0),  # at the close
+            (2022, 1, 14, 16, 1),  # after the close, Monday is MLK day
+            (2022, 1, 15, 10, 0),  # Saturday
+            (2021, 12, 23, 20, 0),  # Thursday night, Friday is the Christmas holiday
+            (2021, 11, 24, 23, 59),  # Wednesday night before Thanksgiving
+            (2021, 11, 25, 10, 0),  # on Thanksgiving itself
+        ]
+        for y, m, d, h, mi in times:
+            dt = our_localize(datetime.datetime(y, m, d, h, mi))
+            Trade.objects.create(dt=dt, account=self.a, ticker=t, q=1, p=300, reinvest=False)
+
+        df = bucketed_trades()
+        close = dict(Ticker.objects.values_list("ticker", "market__t_close"))
+        for dt, tkr, d in zip(df.dt, df.t, df.d):
+            # The row by row rule the vectorized version replaced.
+            ts = dt.tz_convert("America/New_York")
+            d0 = ts.date()
+            cutoff = close.get(tkr, datetime.time(18, 0))
+            if ts.weekday() >= 5 or ts.time() > cutoff:
+                d0 = next_business_day(d0)
+            self.assertEqual(d0, d)
+            self.assertIs(type(d), datetime.date)
+
+        dates = set(df.d)
+        self.assertIn(datetime.date(2022, 1, 18), dates)
+        self.assertIn(datetime.date(2021, 12, 27), dates)
+        self.assertIn(datetime.date(2021, 11, 26), dates)
+        self.assertIn(datetime.date(2021, 11, 25), dates)
+
+    def test_trades_df_refresh(self):
+        df = get_trades_df()
+        self.assertIs(df, get_trades_df())
+        n = len(df)
+        n_a = len(get_trades_df(a=self.a.name))
+
+        t = Ticker.objects.get(ticker="AAPL")
+        dt = our_localize(datetime.datetime(2022, 1, 3, 10, 0))
+        trade = Trade.objects.create(dt=dt, account=self.a, ticker=t, q=7, p=300, reinvest=False)
+        df = get_trades_df()
+        self.assertEqual(n + 1, len(df))
+        self.assertEqual(n_a + 1, len(get_trades_df(a=self.a.name)))
+        self.assertTrue(df.dt.is_monotonic_increasing)
+
+        trade.q = 8
+        trade.save()
+        df = get_trades_df()
+        self.assertEqual(n + 1, len(df))
+        self.assertEqual([8.0], df.loc[df.dt == dt, "q"].tolist())
+
+        trade.delete()
+        df = get_trades_df()
+        self.assertEqual(n, len(df))
+        self.assertEqual(TRADES_DTYPES, {k: str(v) for k, v in df.dtypes.items()})
+
+        self.a.active_f = False
+        self.a.save()
+        self.assertEqual(0, len(get_trades_df(a=self.a.name)))
+
+    def test_copy_trades_df(self):
+        d = datetime.date(2021, 10, 22)
+        df = copy_trades_df(d=d)
+        expected = Trade.objects.filter(dt__lt=our_localize(datetime.datetime(2021, 10, 23)))
+        self.assertEqual(expected.count(), len(df))
+
+        # Changes to the slice leave the cached frame alone.
+        df["qp"] = df.q * df.p
+        df.loc[df.index[0], "q"] = -1e9
+        cached = get_trades_df()
+        self.assertNotIn("qp", cached.columns)
+        self.assertNotEqual(-1e9, cached.q.iloc[0])
+        self.assertEqual(len(cached), len(copy_trades_df()))
+
+
+class ReplayTests(SimpleTestCase):
+    def test_replay_matches_moneycounter(self):
+        rng = np.random.default_rng(7)
+        for fifo in (True, False):
+            for _ in range(20):
+                q = rng.integers(-30, 40, 25).astype(float)
+                p = rng.uniform(50, 150, 25).round(2)
+                positions, costs = replay(q, p, fifo=fifo)
+                for i in (4, 12, 24):
+                    df = pd.DataFrame({"q": q[: i + 1], "p": p[: i + 1]})
+                    lots = unrealized(df, fifo=fifo)
+                    self.assertAlmostEqual(q[: i + 1].sum(), positions[i])
+                    self.assertAlmostEqual((lots.q * lots.p).sum(), costs[i], places=6)
+
+    def test_cost_basis_matches_wap_calc(self):
+        rng = np.random.default_rng(11)
+        frames = []
+        for i in range(30):
+            q = rng.integers(-30, 40, 15).astype(float)
+            p = rng.uniform(50, 150, 15).round(2)
+            if i % 3 == 0:
+                # Flat at the end.
+                q[-1] = -q[:-1].sum()
+            elif i % 3 == 1 and q[:8].sum() != 0:
+                # A 2 for 1 split.
+                q[8], p[8] = q[:8].sum(), 0.0
+            dt = pd.date_range("2024-01-02", periods=15, freq="D", tz="UTC")
+            frames.append(
+                pd.DataFrame(
+                    {"a": f"A{i % 4}", "t": f"T{i}", "dt": dt, "q": q, "p": p, "cs": 1.0 + i % 2}
+                )
+            )
+        # Rows of all pairs mixed together, as in the trade frames.
+        df = pd.concat(frames).sample(frac=1, random_state=3)
+
+        for fifo in (True, False):
+            result = cost_basis(df, fifo=fifo).set_index(["a", "t"])
+            self.assertEqual(len(frames), len(result))
+            for trades in frames:
+                row = result.loc[(trades.a.iloc[0], trades.t.iloc[0])]
+                lots = unrealized(trades, fifo=fifo)
+                cs = trades.cs.iloc[0]
+                realized = cs * ((lots.q * lots.p).sum() - (trades.q * trades.p).sum())
+                self.assertAlmostEqual(trades.q.sum(), row.position)
+                self.assertAlmostEqual(wap_calc(trades, fifo=fifo), row.wap, places=6)
+                self.assertAlmostEqual(realized, row.realized, places=6)
+
+
+@override_settings(FIFO=True)
+class PositionSnapshotTests(TestCase):
+    def test_snapshots_follow_trades(self):
+        make_trades()
+        self.assertEqual([], verify_positions())
+
+        trade = Trade.objects.filter(ticker__ticker="AAPL").order_by("dt").first()
+        trade.q = 75
+        trade.save()
+        self.assertEqual([], verify_positions())
+
+        trade.account = Account.objects.create(name="Other", owner="MS", broker="Fidelity")
+        trade.save()
+        self.assertEqual([], verify_positions())
+
+        trade.delete()
+        self.assertEqual([], verify_positions())
+
+        n = PositionSnapshot.objects.count()
+        self.assertEqual(n, rebuild_positions())
+        self.assertEqual([], verify_positions())
+
+    def test_snapshots_with_splits(self):
+        make_trades_split()
+        self.assertEqual([], verify_positions())
+        aapl = PositionSnapshot.objects.filter(ticker__ticker="AAPL").order_by("d").last()
+        self.assertAlmostEqual(100, aapl.q)
+        self.assertAlmostEqual(100 * 305 / 4, aapl.cost_basis)
+
+    def test_positions_asof(self):
+        make_trades()
+        d = datetime.date(2021, 10, 22)
+        df = positions_asof(d)
+        trades = bucketed_trades()
+        expected = trades[trades.d <= d].groupby(["a", "t"], observed=True)["q"].sum()
+        result = df.set_index(["a", "t"])["q"].sort_index()
+        self.assertEqual(list(expected.index), list(result.index))
+        self.assertTrue(np.allclose(expected.to_numpy(), result.to_numpy()))
+
+    @override_settings(PRICE_PROVIDER="fixed")
+    def test_pnl_asof_from_snapshots(self):
+        make_trades()
+        # After the close on Friday, bucketed to Monday.
+        dt = our_localize(datetime.datetime(2021, 10, 22, 18, 0, 0))
+        a = Account.objects.get(name="MSFidelity")
+        t = Ticker.objects.get(ticker="MSFT")
+        Trade.objects.create(dt=dt, account=a, ticker=t, q=5, p=311, commission=1, reinvest=True)
+        self.assertEqual([], verify_positions())
+
+        for d in (datetime.date(2021, 10, 22), datetime.date(2021, 10, 23), None):
+            pnl, _ = pnl_asof(d=d)
+            expected = trades_pnl(copy_trades_df(d=d), d=d)
+            pd.testing.assert_frame_equal(
+                expected, pnl.drop(columns="cash_flow"), check_dtype=False
+            )
+
+    def check_tax_lots(self):
+        trades_df = get_non_qualified_equity_trades_df()
+        for year in sorted({dt.year for dt in trades_df.dt}):
+            expected = realized_gains(trades_df, year)
+            result = equity_realized_gains(year)
+            self.assertEqual(list(expected.a), list(result.a))
+            self.assertEqual(list(expected.t), list(result.t))
+            self.assertTrue(np.allclose(expected.realized, result.realized))
+
+        # Lots written trade by trade are the ones built from all trades.
+        detail = lot_detail()
+        self.assertFalse(detail.empty)
+        rebuild_positions()
+        pd.testing.assert_frame_equal(detail, lot_detail())
+
+    def test_tax_lots(self):
+        make_trades()
+        self.check_tax_lots()
+
+    def test_tax_lots_with_splits(self):
+        make_trades_split()
+        self.check_tax_lots()
+
+    @override_settings(FIFO=False)
+    def test_tax_lots_stay_fifo(self):
+        make_lifo_trades()
+        self.assertEqual([], verify_positions())
+        # moneycounter's realized_gains, what check_tax_lots expects, is FIFO.
+        self.check_tax_lots()
+
+
+FLEX_XML = """<FlexQueryResponse queryName="trades" type="AF">
+<FlexStatements count="1"><FlexStatement accountId="U1"><TradeConfirms>
+<TradeConfirm symbol="ESZ6" dateTime="2026-10-15 10:30:00" quantity="{q}" price="5800.25"
+ commission="-4.5" tradeID="111" />
+<TradeConfirm symbol="ESZ6" dateTime="2026-10-15 17:30:00" quantity="-1" price="5810.5"
+ commission="-2.25" tradeID="112" />
+</TradeConfirms></FlexStatement></FlexStatements></FlexQueryResponse>
+"""
+
+
+@override_settings(FIFO=True, IB_DEFAULT_ACCOUNT="MSFidelity")
+class FlexIngestTests(TestCase):
+    def setUp(self):
+        make_trades()
+
+    def get_trades(self, q):
+        with tempfile.NamedTemporaryFile("w", suffix=".xml") as f:
+            f.write(FLEX_XML.format(q=q))
+            f.flush()
+            return get_trades(path=f.name)
+
+    def test_flex_report_file(self):
+        _, ticker = ib_symbol_parts("ESZ6")
+        n = len(get_trades_df())
+
+        _, data, _ = self.get_trades(q=2)
+        self.assertEqual(2, len(data))
+        trades = Trade.objects.filter(ticker__ticker=ticker).order_by("trade_id")
+        self.assertEqual([2, -1], [t.q for t in trades])
+        self.assertEqual([4.5, 2.25], [t.commission for t in trades])
+        self.assertEqual(n + 2, len(get_trades_df()))
+
+        # Running the report again updates the trades instead of adding them.
+        self.get_trades(q=3)
+        self.assertEqual([3, -1], [t.q for t in trades.all()])
+        self.assertEqual(1, Ticker.objects.filter(ticker=ticker).count())
+        self.assertEqual(n + 2, len(get_trades_df()))
+        self.assertEqual([], verify_positions())
+
+
+TRADES_CSV = """dt,ticker,q,p,commission,market
+2022-01-03 10:00,AAPL,10,150.5,1,
+2022-01-04 10:00:00-05:00,AAPL,-4,160,,
+2022-01-05 11:00,NEW1,2,4000,-4.5,ES
+"""
+
+
+@override_settings(FIFO=True)
+class ImportTradesTests(TestCase):
+    def setUp(self):
+        make_trades()
+
+    def import_trades(self, text, *args):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as f:
+            f.write(text)
+            f.flush()
+            call_command("import_trades", f.name, "--account", "MSFidelity", "--quiet", *args)
+
+    def test_import(self):
+        n = Trade.objects.count()
+        self.import_trades(TRADES_CSV, "--dry-run")
+        self.assertEqual(n, Trade.objects.count())
+        self.assertFalse(Ticker.objects.filter(ticker="NEW1").exists())
+
+        self.import_trades(TRADES_CSV, "--chunk-size", "2")
+        trades = Trade.objects.filter(dt__year=2022).order_by("dt")
+        self.assertEqual(["AAPL", "AAPL", "NEW1"], [t.ticker.ticker for t in trades])
+        self.assertEqual([10, -4, 2], [t.q for t in trades])
+        self.assertEqual([1, 0, 4.5], [t.commission for t in trades])
+        self.assertEqual(datetime.datetime(2022, 1, 4, 15, tzinfo=datetime.UTC), trades[1].dt)
+        self.assertEqual([], verify_positions())
+
+    def test_bad_rows(self):
+        n = Trade.objects.count()
+        text = TRADES_CSV + "bad,XXX,a,-1,,\n"
+        with self.assertRaisesRegex(CommandError, "line 5: bad dt, bad q, negative p"):
+            self.import_trades(text)
+        self.assertEqual(n, Trade.objects.count())
+
+        self.import_trades(text, "--skip-invalid")
+        self.assertEqual(n + 3, Trade.objects.count())
+
+
+@override_settings(FIFO=True)
+class TradeBatchTests(TestCase):
+    def setUp(self):
+        make_trades()
+
+    def test_batch(self):
+        a = Account.objects.get(name="MSFidelity")
+        es = Ticker.objects.get(ticker="ESZ2021")
+        es.market.commission = 2.25
+        es.market.save()
+        aapl = Ticker.objects.get(ticker="AAPL")
+        trade = Trade.objects.filter(ticker=aapl).earliest("dt")
+        dt = our_localize(datetime.datetime(2022, 1, 3, 10))
+
+        with TradeBatch() as batch:
+            for q in (2, -2):
+                batch.create(dt=dt, account=a, ticker=es, q=q, p=4000, commission=None)
+            batch.update(trade, q=trade.q + 1, commission=-1)
+        new = Trade.objects.filter(ticker=es, dt=dt)
+        self.assertEqual([4.5, 4.5], [t.commission for t in new])
+        trade.refresh_from_db()
+        self.assertEqual(1, trade.commission)
+        self.assertEqual([], verify_positions())
@@ -1,9 +1,9 @@
-from json import JSONDecodeError
+from datetime import timedelta
 
+import numpy as np
 import pandas as pd
 from django.conf import settings
 from tbgutils.dt import our_now
-from moneycounter import wap_calc
 from tbgutils.str import is_near_zero
 from accounts.models import copy_cash_df
 from markets.models import (
@@ -11,29 +11,65 @@ from markets.models import (
     get_tickers,
     NOT_FUTURES_EXCHANGES,
 )
-from trades.models import copy_trades_df, bucketed_trades
-from markets.utils import get_price
-from markets.tbgyahoo import yahooQuotes
-
-
-def reindexed_wap(df):
-    df.sort_values(by=["dt"])
-    df.reset_index(inplace=True)
-    wap = wap_calc(df, fifo=settings.FIFO)
-    a = df.loc[0, "a"]
-    t = df.loc[0, "t"]
-    cs = df.loc[0, "cs"]
-    position = df.q.sum()
-    result = pd.DataFrame({"a": [a], "t": [t], "position": [position], "wap": [wap], "cs": cs})
-    return result
+from trades.models import bucketed_trades, copy_trades_df
+from trades.positions import positions_asof, replay
+from markets.utils import get_prices_bulk
+from markets.providers import get_provider
+
+
+def cost_basis(df, fifo=None):
+    """
+    Position, weighted average price of the open lots and realized gain of
+    each (a, t) pair in the trades df.  Every pair is run through its lots,
+    FIFO or LIFO by settings.FIFO, in one pass over the trades sorted by pair
+    and dt.  The answers are those of moneycounter's wap_calc and pnl per
+    pair.
+
+    Returns a DataFrame of a, t, position, wap, realized and cs, one row per
+    pair.  A flat position has wap 0.
+    """
+    if fifo is None:
+        fifo = settings.FIFO
+    columns = ["a", "t", "position", "wap", "realized", "cs"]
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+
+    df = df.sort_values(by=["a", "t", "dt"], kind="stable")
+    a = df.a.to_numpy()
+    t = df.t.to_numpy()
+    first = np.append(True, (a[1:] != a[:-1]) | (t[1:] != t[:-1]))
+    starts = np.flatnonzero(first)
+    last = np.append(starts[1:], len(df)) - 1
+
+    q = df.q.to_numpy(dtype=float)
+    p = df.p.to_numpy(dtype=float)
+    positions, costs = replay(q, p, fifo=fifo, first=first)
+    flows = np.add.reduceat(-q * p, starts)
+
+    position = positions[last]
+    position[np.abs(position) < 1e-10] = 0.0
+    cost = costs[last]
+    wap = np.divide(cost, position, out=np.zeros(len(starts)), where=position != 0)
+    cs = df.cs.to_numpy(dtype=float)[starts]
+
+    return pd.DataFrame(
+        {
+            "a": a[starts],
+            "t": t[starts],
+            "position": position,
+            "wap": wap,
+            "realized": cs * (flows + cost),
+            "cs": cs,
+        }
+    )
 
 
 def wap_df(df):
     # Must compute WAP separately for each account to make sure
     # trades are closed out against trades in the same account.
-    g1 = df.groupby(["a", "t"], group_keys=False)
-    df = g1[["a", "t", "dt", "q", "p", "cs"]].apply(reindexed_wap)
+    df = cost_basis(df)
     df = df[df.position != 0]
+    df = df.drop(columns="realized")
     df.reset_index(inplace=True, drop=True)
     return df
 
@@ -54,40 +90,22 @@ def weighted_average_price(ticker):
     return pos, wap
 
 
-def price_mapper(t, d):
-    try:
-        t, q = t.t, t.q
-        if is_near_zero(q):
-            return 0
-    except AttributeError:
-        pass
-
-    ti = get_ticker(t)
-    try:
-        price = get_price(ti, d)
-    except JSONDecodeError as e:
-        print(e)
-        price = 0
-        raise Exception(f"Failed to get price for {ti.yahoo_ticker} {d}")
-    return price
-
-
-def get_current_price_mapper(tickers):
+def current_prices(tickers):
+    """{ticker: price now} of ticker symbols, one quotes call for all of them."""
     tickers = [t for t in get_tickers(tickers)]
     cash_prices = {t.ticker: t.fixed_price for t in tickers if t.market.is_cash}
     tickers = [t for t in tickers if not t.market.is_cash]
     yahoo2worth_tickers = {t.yahoo_ticker: t.ticker for t in tickers}
 
-    if not settings.USE_PRICE_FEED:
-        prices = {t.ticker: get_price(t) for t in tickers}
-    else:
-        if tickers:
-            quotes = yahooQuotes(tickers)
-        else:
-            quotes = {}
-        prices = {yahoo2worth_tickers[k]: v for k, v in quotes.items()}
+    quotes = get_provider().quotes(tickers) if tickers else {}
+    prices = {yahoo2worth_tickers[k]: v for k, v in quotes.items()}
 
     prices.update(cash_prices)
+    return prices
+
+
+def get_current_price_mapper(tickers):
+    prices = current_prices(tickers)
 
     def mapper(t):
         try:
@@ -97,50 +115,116 @@ def get_current_price_mapper(tickers):
         except AttributeError:
             pass
 
-        return prices[t]
+        # Like get_price, a ticker whose quote failed is priced at 0.
+        return prices.get(t, 0.0)
 
     return mapper
 
 
+def map_prices(t, held, prices):
+    """Series of prices[t] where held, 0 elsewhere and for tickers without a price."""
+    return t.map(prices).where(held, 0.0).fillna(0.0).astype(float)
+
+
+def position_prices(pnl, d):
+    """
+    Price on d of the ticker of each row of pnl, 0 where q is 0.  A ticker
+    held in several accounts is priced once, all of them in one batch.
+    """
+    held = pnl.q != 0
+    tickers = pnl.t[held].unique().tolist()
+    if d == our_now().date():
+        prices = current_prices(tickers)
+    else:
+        prices = {t: p for (t, _), p in get_prices_bulk([(t, d) for t in tickers]).items()}
+    return map_prices(pnl.t, held, prices)
+
+
+PNL_COLUMNS = ["a", "t", "c", "cs", "e", "q", "qp", "qpr"]
+
+
+def position_sums(df):
+    """
+    DataFrame of a, t, c, cs, e, q, qp and qpr, the sums of the trades df
+    per position sorted by a and t.  qp is sum(-q * p) and qpr the qp less
+    commissions of reinvestments.
+    """
+    if df.empty:
+        return pd.DataFrame(columns=PNL_COLUMNS)
+
+    df["qp"] = -df.q * df.p
+
+    reinvested_recs = df[df.r]
+    df["qpr"] = reinvested_recs.qp - reinvested_recs.c
+
+    pnl = pd.pivot_table(
+        df,
+        index=["a", "t"],
+        aggfunc={
+            "qp": "sum",
+            "qpr": "sum",
+            "q": "sum",
+            "cs": "max",
+            "c": "sum",
+            "e": "first",
+        },
+    ).reset_index(["a", "t"])
+    # One row per position, plain strings are easier to merge and fill.
+    return pnl.astype({"a": str, "t": str, "e": str})
+
+
+def value_positions(pnl, d, prices=None):
+    """
+    Add price on d, pnl and value to the position sums pnl.  prices, {t:
+    price} on d, saves looking them up.
+    """
+    if pnl.empty:
+        return pnl.reindex(columns=PNL_COLUMNS + ["price", "pnl", "value"])
+
+    pnl["q"] = pnl.q.mask(pnl.q.abs() < 1e-8, 0.0)
+
+    if prices is None:
+        pnl["price"] = position_prices(pnl, d)
+    else:
+        pnl["price"] = map_prices(pnl.t, pnl.q != 0, prices)
+    pnl["pnl"] = pnl.cs * (pnl.qp + pnl.q * pnl.price) - pnl.c
+    pnl["value"] = pnl.cs * pnl.q * pnl.price
+    return pnl
+
+
 def trades_pnl(df, d=None):
     if d is None:
         d = our_now().date()
 
-    if df.empty:
-        pnl = pd.DataFrame(
-            columns=["a", "t", "qp", "qpr", "q", "cs", "c", "e", "price", "pnl", "value"]
+    return value_positions(position_sums(df), d)
+
+
+def snapshot_sums(d=None, a=None, only_non_qualified=False, active_f=True):
+    """
+    position_sums() of the trades up to the end of day d, all of them if d
+    is None, without reading the trades before the last close on or before
+    d.  Those are summed in the latest position snapshots, only the trades
+    after that close are added to them.
+    """
+    pnl = positions_asof(d, a=a, only_non_qualified=only_non_qualified, active_f=active_f)
+    pnl = pnl[PNL_COLUMNS]
+    if d is not None:
+        # The trades of d and the days before it bucketed after d.
+        late = bucketed_trades(
+            d=d,
+            a=a,
+            only_non_qualified=only_non_qualified,
+            active_f=active_f,
+            start=d + timedelta(days=1),
         )
-    else:
-        df["qp"] = -df.q * df.p
-
-        reinvested_recs = df[df.r]
-        df["qpr"] = reinvested_recs.qp - reinvested_recs.c
-
-        pnl = pd.pivot_table(
-            df,
-            index=["a", "t"],
-            aggfunc={
-                "qp": "sum",
-                "qpr": "sum",
-                "q": "sum",
-                "cs": "max",
-                "c": "sum",
-                "e": "first",
-            },
-        ).reset_index(["a", "t"])
-
-        pnl["q"] = pnl["q"].apply(lambda x: 0 if is_near_zero(x, epsilon=1e-8) else x)
-
-        if d == our_now().date():
-            tickers = [t for t, f in zip(pnl.t, pnl.q == 0) if not f]
-            mapper = get_current_price_mapper(tickers)
-            pnl["price"] = pnl.apply(lambda x: mapper(x), axis=1)
-        else:
-            pnl["price"] = pnl.apply(lambda x: price_mapper(x, d), axis=1)
-        pnl["pnl"] = pnl.cs * (pnl.qp + pnl.q * pnl.price) - pnl.c
-        pnl["value"] = pnl.cs * pnl.q * pnl.price
+        if not late.empty:
+            pnl = pd.concat([pnl, position_sums(late.drop(columns="d"))], ignore_index=True)
+            pnl = pnl.groupby(["a", "t"], as_index=False, sort=False).agg(
+                {"c": "sum", "cs": "max", "e": "first", "q": "sum", "qp": "sum", "qpr": "sum"}
+            )
 
-    return pnl
+    pnl = pnl.sort_values(["a", "t"], ignore_index=True)
+    return pnl.astype({"a": str, "t": str, "e": str})
 
 
 def pnl_asof(d=None, a=None, only_non_qualified=False, active_f=True, cleared=False):
@@ -148,11 +232,17 @@ def pnl_asof(d=None, a=None, only_non_qualified=False, active_f=True, cleared=Fa
     Calculate PnL from all trades - need that for cash flow.
     Calculate Cash balances.
     Return YTD data for active positions.
+
+    The trades are summed from the position snapshots, see snapshot_sums().
     """
+    pnl = snapshot_sums(d=d, a=a, only_non_qualified=only_non_qualified, active_f=active_f)
+    pnl = value_positions(pnl, our_now().date() if d is None else d)
+    cash = cash_balances(pnl, d=d, a=a, active_f=active_f, cleared=cleared)
+    return pnl, cash
 
-    df = bucketed_trades(d=d, a=a, only_non_qualified=only_non_qualified, active_f=active_f)
 
-    pnl = trades_pnl(df, d=d)
+def cash_balances(pnl, d=None, a=None, active_f=True, cleared=False):
+    """Cash of each account on d, the cash records plus the cash flow of pnl's trades."""
 
     # Need to add cash flow to cash records for each account.
     pnl["cash_flow"] = pnl.qp - pnl.c - pnl.qpr
@@ -160,36 +250,56 @@ def pnl_asof(d=None, a=None, only_non_qualified=False, active_f=True, cleared=Fa
     # The full pnl for futures should be added to cash
     # The cs * sum(q*p) for everything else, not the pnl, should be added to
     # cash
-    # Pivot on these to get cash contributions for each account
+    futures = ~pnl.e.isin(NOT_FUTURES_EXCHANGES)
+    cash_adj = pnl.pnl.where(futures, pnl.cash_flow).groupby(pnl.a).sum()
 
-    futures_cash = pnl[~pnl.e.isin(NOT_FUTURES_EXCHANGES)]
-    futures_cash = futures_cash.groupby("a")["pnl"].sum().reset_index()
+    cash = copy_cash_df(d=d, a=a, pivot=True, active_f=active_f, cleared=cleared)
+    cash = cash.set_index("a").q.add(cash_adj, fill_value=0)
+    return cash.rename_axis("a").reset_index(name="q")
 
-    non_futures_cash = pnl[pnl.e.isin(NOT_FUTURES_EXCHANGES)]
-    non_futures_cash = non_futures_cash.groupby("a")["cash_flow"].sum().reset_index()
 
-    if futures_cash.empty:
-        cash_adj = non_futures_cash
-        cash_adj.rename(columns={"cash_flow": "q"}, inplace=True)
-    elif non_futures_cash.empty:
-        cash_adj = futures_cash
-        cash_adj.rename(columns={"pnl": "q"}, inplace="True")
-    else:
-        cash_adj = pd.merge(futures_cash, non_futures_cash, how="outer", on="a")
-        cash_adj = cash_adj.fillna(0)
-        cash_adj["q"] = cash_adj.cash_flow + cash_adj.pnl
-        cash_adj.drop(["cash_flow", "pnl"], axis=1, inplace=True)
+def pnl_horizons(dates, a=None, only_non_qualified=False, active_f=True, cleared=False):
+    """
+    pnl_asof() of every date in dates.  Returns a list of (pnl, cash) in the
+    order of dates.
 
-    cash = copy_cash_df(d=d, a=a, pivot=True, active_f=active_f, cleared=cleared)
-    # if empty: cash = pd.DataFrame(columns=['a', 'q'])
-    # concat with axis=1 is an outer join
-    cash = pd.merge(cash, cash_adj, on="a", how="outer")
-    cash = cash.fillna(0)
-    cash.q_x = cash.q_x + cash.q_y
-    cash.drop(["q_y"], axis=1, inplace=True)
-    cash.rename(columns={"q_x": "q"}, inplace=True)
+    The sums of each date come from snapshot_sums(), as in pnl_asof().  Past
+    prices of all dates come from one get_prices_bulk() call and today's
+    from one quotes call.
+    """
+    today = our_now().date()
+    frames = {
+        d: snapshot_sums(d=d, a=a, only_non_qualified=only_non_qualified, active_f=active_f)
+        for d in set(dates)
+    }
+    frames = price_horizons(frames, today)
+
+    result = []
+    for d in dates:
+        pnl = frames[d].copy()
+        result.append((pnl, cash_balances(pnl, d=d, a=a, active_f=active_f, cleared=cleared)))
+    return result
 
-    return pnl, cash
+
+def price_horizons(frames, today):
+    """value_positions() of each of frames, {d: position sums}, d None is today."""
+    pairs = [
+        (t, d)
+        for d, pnl in frames.items()
+        if d not in (None, today)
+        for t in pnl.t[pnl.q.abs() >= 1e-8].unique()
+    ]
+    prices = {}
+    for (t, d), p in get_prices_bulk(pairs).items():
+        prices.setdefault(d, {})[t] = p
+
+    valued = {}
+    for d, pnl in frames.items():
+        if d in (None, today):
+            valued[d] = value_positions(pnl, today)
+        else:
+            valued[d] = value_positions(pnl, d, prices=prices.get(d, {}))
+    return valued
 
 
 def trades_with_position(df):
@@ -25,7 +25,12 @@ if config_file.exists():
     IB_DEFAULT_ACCOUNT = config["IB"]["IB_DEFAULT_ACCOUNT"]
 
     PPM_FACTOR = float(config["GENERAL"]["PPM_FACTOR"])
-    USE_PRICE_FEED = config["GENERAL"]["USE_PRICE_FEED"].lower() == "true"
+    # yahoo, db, synthetic or fixed, see markets.providers.
+    # Older config files only have USE_PRICE_FEED.
+    use_price_feed = config["GENERAL"].get("USE_PRICE_FEED", "true").lower() == "true"
+    PRICE_PROVIDER = config["GENERAL"].get(
+        "PRICE_PROVIDER", "yahoo" if use_price_feed else "fixed"
+    )
 
     GPG_EMAIL = config["GPG"]["GPG_EMAIL"]
     GPG_HOME = config["GPG"]["GPG_HOME"]
@@ -51,12 +56,36 @@ else:
     GPG_EMAIL = "you@example.com"
     PPM_FACTOR = 1
     FIFO = True
+    PRICE_PROVIDER = "fixed"
 
 # Build paths inside the worth like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 ALLOWED_HOSTS = ["127.0.0.1"]
 
+# Daily bar history files shared by all workers, see markets.history_store.
+PRICE_HISTORY_DIR = Path(os.environ.get("PRICE_HISTORY_DIR", BASE_DIR / "price_history"))
+
+# Seed for the synthetic price provider.
+PRICE_PROVIDER_SEED = int(os.environ.get("PRICE_PROVIDER_SEED", 0))
+
+# Live quotes, see markets.quotes.  The timeout is per request in seconds.
+QUOTE_TRANSPORT = "markets.quotes.YahooChartTransport"
+QUOTE_MAX_WORKERS = 8
+QUOTE_TIMEOUT = 10
+# Seconds a quote taken during trading hours is reused by all processes.
+QUOTE_STALENESS = 60
+# Minutes after Market.t_close from which a quote is taken as final for the day.
+QUOTE_CLOSE_DELAY = 20
+
+# Seconds a job may run before it is taken for one whose worker died and is
+# failed, see jobs.utils.
+JOB_TIMEOUT = 3600
+
+# Keep the numbers and dates of trade frames in Arrow arrays, needs pyarrow.
+# See trades.models.TRADES_DTYPES.
+TRADES_ARROW = os.environ.get("TRADES_ARROW", "").lower() == "true"
+
 INSTALLED_APPS = [
     "worth.apps.ALLAdminConfig",
     "django.contrib.auth",
@@ -72,6 +101,7 @@ INSTALLED_APPS = [
     "markets",
     "trades",
     "analytics",
+    "jobs",
 ]
 
 MIDDLEWARE = [
@@ -121,6 +151,12 @@ DJANGO_EASY_AUDIT_UNREGISTERED_CLASSES_EXTRA = [
     "markets.DailyPrice",
     "markets.DailyPrice",
     "markets.TBGDailyBar",
+    "jobs.Job",
+    "markets.QuoteSnapshot",
+    "trades.TradesVersion",
+    "trades.PositionSnapshot",
+    "trades.TaxLot",
+    "trades.LotClose",
     "analytics.PPMResult",
 ]
 
@@ -15,4 +15,5 @@ urlpatterns = [
     path("", include("analytics.urls")),
     path("", include("accounts.urls")),
     path("", include("markets.urls")),
+    path("", include("jobs.urls")),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)